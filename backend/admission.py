@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# 当前请求的(用户, 优先级)：由路由设置，实际调用LLM时按它准入
+_requester: ContextVar[Optional[Tuple[Hashable, str]]] = ContextVar('llm_requester', default=None)
+
+
+@contextmanager
+def requester(user: Hashable, priority: str = INTERACTIVE):
+    """标记当前请求的用户和优先级，在此期间发起的LLM调用按该用户准入
+    （线程池中执行的任务需要复制上下文，asyncio任务自动继承）"""
+    token = _requester.set((user, priority))
+    try:
+        yield
+    finally:
+        _requester.reset(token)
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入：status为429（用户超出速率）或503（队列已满、预计等待过长或等待超时）"""
+
+    def __init__(self, message: str, status: int, retry_after: float):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class TokenBucket:
+    """令牌桶：每秒补充rate个令牌，最多积累capacity个"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, cost: float = 1.0) -> float:
+        """取得令牌返回0，否则返回需要等待的秒数"""
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if cost > self.capacity or self.rate <= 0:
+            return float('inf')
+        return (cost - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class Ticket:
+    """一次准入请求，排队期间等待调度器调用notify"""
+
+    __slots__ = ('user', 'priority', 'cost', 'enqueued_at', 'granted_at', 'notify')
+
+    def __init__(self, user: Hashable, priority: str, cost: float, notify: Callable[[], None]):
+        self.user = user
+        self.priority = priority
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.notify = notify
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+
+class AdmissionController:
+    """LLM后端的准入控制与公平调度
+    - 每个用户一个令牌桶限制请求速率
+    - 同时执行的LLM请求数不超过concurrency，其余请求进入有界队列
+    - 队列按优先级加权轮转（交互请求与批量请求的调度比例为weights），同一优先级内按用户轮转，
+      一个用户提交大量请求也只能占用自己的轮次
+    - 队列已满、预计等待超过期限或等待超时时立即拒绝"""
+
+    def __init__(self, concurrency: int = 4, max_queue: int = 100, user_rate: float = 1.0, user_burst: float = 20,
+                 max_wait: Optional[Dict[str, float]] = None, weights: Optional[Dict[str, int]] = None):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_wait = max_wait or {INTERACTIVE: 30.0, BATCH: 300.0}
+        weights = weights or {INTERACTIVE: 4, BATCH: 1}
+        self._turns = [priority for priority in PRIORITIES for _ in range(max(1, weights.get(priority, 1)))]
+        self._turn = 0
+
+        self._lock = threading.Lock()
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        self._queues: Dict[str, "OrderedDict[Hashable, Deque[Ticket]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._queued = {p: 0 for p in PRIORITIES}
+        self._active = 0
+        # 单个请求执行时间的指数移动平均，用于估算排队等待时间
+        self._service_time: Optional[float] = None
+
+        self.admitted = 0
+        self.rejected = {"rate_limited": 0, "queue_full": 0, "wait_too_long": 0, "timeout": 0}
+
+    def _bucket(self, user: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            if len(self._buckets) >= 10000:
+                # 令牌已满的桶与新建的桶等价，可以丢弃
+                for key in [key for key, b in self._buckets.items() if b.is_full()]:
+                    del self._buckets[key]
+            bucket = self._buckets[user] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    def _estimated_wait(self, priority: str) -> float:
+        if self._service_time is None:
+            return 0.0
+        # 排在前面的请求：同优先级和更高优先级的排队请求
+        ahead = sum(self._queued[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        return (ahead + 1) * self._service_time / self.concurrency
+
+    def _enqueue(self, user: Hashable, priority: str, cost: float, notify: Callable[[], None]) -> Ticket:
+        if priority not in PRIORITIES:
+            priority = INTERACTIVE
+        ticket = Ticket(user, priority, cost, notify)
+        with self._lock:
+            immediate = self._active < self.concurrency and not any(self._queued.values())
+            # 先检查队列，被拒绝的请求不消耗用户的令牌
+            if not immediate:
+                if sum(self._queued.values()) >= self.max_queue:
+                    self.rejected["queue_full"] += 1
+                    raise AdmissionRejected("LLM服务繁忙，请稍后再试", 503, self._estimated_wait(priority) or 1)
+                wait = self._estimated_wait(priority)
+                if wait > self.max_wait[priority]:
+                    self.rejected["wait_too_long"] += 1
+                    raise AdmissionRejected(f"LLM服务繁忙，预计等待{wait:.0f}秒", 503, wait)
+            retry_after = self._bucket(user).try_acquire(cost)
+            if retry_after:
+                self.rejected["rate_limited"] += 1
+                raise AdmissionRejected("请求过于频繁，请稍后再试", 429, min(retry_after, 3600))
+            if immediate:
+                self._grant(ticket, notify=False)
+                return ticket
+            self._queues[priority].setdefault(user, deque()).append(ticket)
+            self._queued[priority] += 1
+        return ticket
+
+    def _grant(self, ticket: Ticket, notify: bool = True) -> None:
+        self._active += 1
+        self.admitted += 1
+        ticket.granted_at = time.monotonic()
+        if notify:
+            ticket.notify()
+
+    def _next_ticket(self) -> Optional[Ticket]:
+        """按优先级权重轮转选出下一个优先级，再取该优先级中排在最前的用户的第一个请求"""
+        for _ in range(len(self._turns)):
+            priority = self._turns[self._turn]
+            self._turn = (self._turn + 1) % len(self._turns)
+            users = self._queues[priority]
+            if users:
+                user, tickets = next(iter(users.items()))
+                ticket = tickets.popleft()
+                if tickets:
+                    users.move_to_end(user)
+                else:
+                    del users[user]
+                self._queued[priority] -= 1
+                return ticket
+        return None
+
+    def _schedule(self) -> None:
+        while self._active < self.concurrency:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            self._grant(ticket)
+
+    def _withdraw(self, ticket: Ticket) -> bool:
+        """从队列中撤回未获准的请求，已获准时返回False"""
+        with self._lock:
+            if ticket.granted:
+                return False
+            tickets = self._queues[ticket.priority].get(ticket.user)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del self._queues[ticket.priority][ticket.user]
+                self._queued[ticket.priority] -= 1
+            return True
+
+    def _timeout_error(self, ticket: Ticket) -> AdmissionRejected:
+        with self._lock:
+            self.rejected["timeout"] += 1
+        return AdmissionRejected("LLM服务繁忙，排队等待超时", 503, self._estimated_wait(ticket.priority) or 1)
+
+    def acquire(self, user: Hashable, priority: str = INTERACTIVE, cost: float = 1.0) -> Ticket:
+        """阻塞直到获准执行，失败时抛出AdmissionRejected"""
+        event = threading.Event()
+        ticket = self._enqueue(user, priority, cost, event.set)
+        if ticket.granted:
+            return ticket
+        if not event.wait(self.max_wait[ticket.priority]) and self._withdraw(ticket):
+            raise self._timeout_error(ticket)
+        return ticket
+
+    async def acquire_async(self, user: Hashable, priority: str = INTERACTIVE, cost: float = 1.0) -> Ticket:
+        """acquire的异步版本，排队时不占用线程"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        ticket = self._enqueue(user, priority, cost, notify)
+        if ticket.granted:
+            return ticket
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait[ticket.priority])
+        except asyncio.TimeoutError:
+            if self._withdraw(ticket):
+                raise self._timeout_error(ticket)
+        except asyncio.CancelledError:
+            # 调用方取消：撤回排队请求，已获准的名额要归还
+            if not self._withdraw(ticket):
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """请求执行完毕，归还名额并调度下一个排队请求"""
+        duration = time.monotonic() - ticket.granted_at
+        with self._lock:
+            self._active -= 1
+            self._service_time = duration if self._service_time is None else 0.8 * self._service_time + 0.2 * duration
+            self._schedule()
+
+    @contextmanager
+    def admit(self, user: Hashable, priority: str = INTERACTIVE, cost: float = 1.0):
+        ticket = self.acquire(user, priority, cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def admit_async(self, user: Hashable, priority: str = INTERACTIVE, cost: float = 1.0):
+        ticket = await self.acquire_async(user, priority, cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @contextmanager
+    def admit_current(self):
+        """按当前请求者准入一次LLM调用；没有请求者时（批处理脚本等内部调用）不做限制"""
+        current = _requester.get()
+        if current is None:
+            yield None
+            return
+        with self.admit(*current) as ticket:
+            yield ticket
+
+    @asynccontextmanager
+    async def admit_current_async(self):
+        current = _requester.get()
+        if current is None:
+            yield None
+            return
+        async with self.admit_async(*current) as ticket:
+            yield ticket
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active": self._active,
+                "concurrency": self.concurrency,
+                "queued": dict(self._queued),
+                "max_queue": self.max_queue,
+                "queued_users": {p: len(users) for p, users in self._queues.items()},
+                "avg_service_time": round(self._service_time, 3) if self._service_time is not None else None,
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected)
+            }
@@ -1,20 +1,39 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
 from werkzeug.security import generate_password_hash, check_password_hash
 import jieba
 import jieba.analyse
-from snownlp import SnowNLP
+from fast_sentiment import get_sentiment_scorer
 import numpy as np
 import os
+import functools
 from datetime import datetime, timedelta
 from config import Config
 from enhanced_analyzer import EnhancedTextAnalyzer
+from singleflight import SingleFlight, make_flight_key
+from segmentation import get_segmenter, textrank_from_pairs, tfidf_from_tokens
+from tenant_dictionaries import get_tenant_registry
+from token_ids import get_document_cache, cosine_similarity
+from incremental import get_incremental_analyzer
+from history_export import iter_ndjson, iter_csv, iter_gzip, parse_datetime
+from admission import AdmissionRejected, BATCH, INTERACTIVE, requester
+from database import configure_app, ensure_indexes
+from archive import Archiver, ArchiveScheduler, get_archive_store
+from search_index import SearchIndex, make_snippet
+from rollups import GRANULARITIES, TrendRollups
+from response_shaping import get_response_shaper
+from pipeline import AnalysisPipeline, PipelineError, get_pipeline_executor, get_pipeline_llm_executor
+from embeddings import EmbeddingError, SemanticSearch
+from circuit_breaker import CircuitOpenError
+from itertools import islice
 
 app = Flask(__name__)
 config = Config()
 app.config.from_object(config)
+configure_app(app, config)
 
 db = SQLAlchemy(app)
 jwt = JWTManager(app)
@@ -23,6 +42,63 @@ CORS(app)
 # 初始化增强版分析器
 enhanced_analyzer = EnhancedTextAnalyzer()
 
+# 声明式分析流水线，阶段在共享线程池中并发执行
+analysis_pipeline = AnalysisPipeline(enhanced_analyzer, get_pipeline_executor(), get_pipeline_llm_executor())
+
+# 合并相同的并发分析请求，每个请求仍各自保存分析记录
+analysis_flight = SingleFlight()
+
+def run_coalesced(text, analysis_type, params, provider, fn):
+    """相同文本、类型、参数和提供商的并发请求只计算一次"""
+    return analysis_flight.do(make_flight_key(text, analysis_type, params, provider), fn)
+
+def run_coalesced_incremental(text, analysis_type, params, provider, user_id, tenant, fn):
+    """增量分析的请求合并：增量计算只复用中间结果，结果与用户无关，合并键不含用户ID。
+    fn(user_id)由领头请求按其用户状态计算，合并到他人请求的用户随后只更新自己的增量状态"""
+    computed = []
+
+    def leader():
+        computed.append(True)
+        return fn(user_id)
+
+    result = run_coalesced(text, analysis_type, params, provider, leader)
+    if not computed:
+        get_incremental_analyzer().observe(user_id, text, tenant)
+    return result
+
+def current_tenant():
+    """当前请求的租户：令牌中有tenant声明时使用它，否则按用户ID区分"""
+    return get_jwt().get('tenant') or get_jwt_identity()
+
+def request_priority():
+    """请求体中priority为batch时按批量请求调度"""
+    data = request.get_json(silent=True)
+    return BATCH if isinstance(data, dict) and data.get('priority') == BATCH else INTERACTIVE
+
+def llm_admission(fn):
+    """LLM路由的准入控制：按用户限流和公平排队。这里只标记请求者，实际调用LLM时才准入
+    （见LLMService._dispatch）：参数校验失败、合并到他人请求或命中缓存的请求不占用名额和令牌"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with requester(get_jwt_identity(), request_priority()):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def shaped_response(result, status=200):
+    """分析结果响应：fields参数（查询参数或请求体）只返回指定字段，较大的响应按Accept-Encoding压缩"""
+    data = request.get_json(silent=True)
+    fields = request.args.get('fields') or (data.get('fields') if isinstance(data, dict) else None)
+    body, headers = get_response_shaper().shape(result, fields, request.headers.get('Accept-Encoding'),
+                                                request.path)
+    return Response(body, status=status, mimetype='application/json', headers=headers)
+
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(e):
+    response = jsonify({"error": e.message, "retry_after": e.retry_after})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 # 数据模型
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -39,15 +115,64 @@ class Analysis(db.Model):
     analysis_type = db.Column(db.String(50), nullable=False)
     result = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # 历史记录按用户和时间查询，归档任务按时间查询
+        db.Index('ix_analysis_user_created', 'user_id', 'created_at'),
+        db.Index('ix_analysis_created_at', 'created_at'),
+    )
+
+# 趋势时间桶：插入分析记录时在同一事务中累加
+trend_rollups = TrendRollups(db.metadata)
+trend_rollups.install(Analysis)
+
+# 全文索引：插入分析记录时在同一事务中写入
+search_index = SearchIndex(Analysis.__table__)
+search_index.install(Analysis)
+
+# 冷数据归档
+archiver = Archiver(get_archive_store(), Analysis.__table__, after_days=config.ARCHIVE_AFTER_DAYS,
+                    segment_records=config.ARCHIVE_SEGMENT_RECORDS) if config.ARCHIVE_ENABLED else None
+
+def run_archive_job():
+    with app.app_context():
+        return archiver.run(db.engine)
+
+archive_scheduler = ArchiveScheduler(run_archive_job, config.ARCHIVE_INTERVAL) if archiver else None
+if archiver:
+    archiver.on_archived.append(search_index.delete)
+
+# 历史记录的语义检索：每个用户的向量索引在首次检索时建立，之后只补充新增记录
+semantic_search = SemanticSearch(
+    enhanced_analyzer.llm_service.embed,
+    max_users=config.EMBEDDING_INDEX_MAX_USERS,
+    exact_threshold=config.EMBEDDING_EXACT_THRESHOLD,
+    tables=config.EMBEDDING_LSH_TABLES,
+    bits=config.EMBEDDING_LSH_BITS
+)
+if archiver:
+    archiver.on_archived.append(lambda connection, ids: semantic_search.discard(ids))
+
+def load_history_texts(user_id, after_id):
+    """用户ID大于after_id的分析记录(ID, 文本)，按ID排序"""
+    rows = db.session.execute(
+        select(Analysis.id, Analysis.text)
+        .where(Analysis.user_id == user_id, Analysis.id > after_id)
+        .order_by(Analysis.id)
+    ).all()
+    return [(row.id, row.text) for row in rows]
 
 # 文本分析类
 class TextAnalyzer:
     @staticmethod
-    def sentiment_analysis(text):
-        """情感分析"""
+    def sentiment_analysis(text, user_id=None, tenant=None):
+        """情感分析，指定user_id时复用该用户上一版文本中未修改句子的中间结果"""
         try:
-            s = SnowNLP(text)
-            sentiment_score = s.sentiments
+            # 复用常驻内存的向量化模型，结果与SnowNLP(text).sentiments一致
+            if user_id is not None:
+                sentiment_score = get_incremental_analyzer().sentiment_score(user_id, text, tenant)
+            else:
+                sentiment_score = get_sentiment_scorer().score(text)
             if sentiment_score > 0.6:
                 sentiment = "积极"
             elif sentiment_score < 0.4:
@@ -63,13 +188,19 @@ class TextAnalyzer:
             return {"error": str(e)}
 
     @staticmethod
-    def extract_keywords(text, top_k=10):
-        """关键词提取"""
+    def extract_keywords(text, top_k=10, tenant=None, user_id=None):
+        """关键词提取，租户有自定义词典时使用租户的分词器和停用词；指定user_id时增量计算"""
         try:
-            # 使用TF-IDF方法提取关键词
-            keywords_tfidf = jieba.analyse.extract_tags(text, topK=top_k, withWeight=True)
-            # 使用TextRank方法提取关键词
-            keywords_textrank = jieba.analyse.textrank(text, topK=top_k, withWeight=True)
+            if user_id is not None:
+                keywords_tfidf, keywords_textrank = get_incremental_analyzer().keywords(user_id, text, top_k, tenant)
+            else:
+                entry = get_tenant_registry().get(tenant)
+                # 使用TF-IDF方法提取关键词（基于分词服务的分词结果）
+                keywords_tfidf = tfidf_from_tokens(get_segmenter().segment(text, tenant=tenant), top_k,
+                                                   entry.stop_words if entry else None)
+                # 使用TextRank方法提取关键词
+                keywords_textrank = textrank_from_pairs(get_segmenter().segment(text, pos=True, tenant=tenant), top_k,
+                                                        entry.textrank if entry else None)
             
             return {
                 "tfidf_keywords": [{"word": word, "weight": round(weight, 3)} for word, weight in keywords_tfidf],
@@ -103,28 +234,14 @@ class TextAnalyzer:
     def calculate_similarity(text1, text2):
         """计算文本相似度"""
         try:
-            # 将文本转换为小写并去除标点符号，以便进行更准确的比较
-            text1_lower = ''.join(c for c in text1.lower() if c.isalnum() or c == ' ')
-            text2_lower = ''.join(c for c in text2.lower() if c.isalnum() or c == ' ')
-
-            # 计算词频向量
-            words1 = text1_lower.split()
-            words2 = text2_lower.split()
-
-            # 创建词汇表
-            all_words = set(words1 + words2)
-            vector1 = [words1.count(word) for word in all_words]
-            vector2 = [words2.count(word) for word in all_words]
+            # 分词后转换为小写并去除标点符号，再转换为缓存的词ID表示进行比较
+            doc1, doc2 = get_document_cache().get_many([text1, text2])
 
-            # 计算余弦相似度
-            dot_product = sum(a * b for a, b in zip(vector1, vector2))
-            norm_a = np.sqrt(sum(a**2 for a in vector1))
-            norm_b = np.sqrt(sum(b**2 for b in vector2))
-
-            if norm_a == 0 or norm_b == 0:
+            if doc1.norm == 0 or doc2.norm == 0:
                 return {"similarity_score": 0.0, "similarity_percentage": 0.0, "interpretation": "无法计算相似度"}
 
-            cosine_sim = dot_product / (norm_a * norm_b)
+            # 计算余弦相似度
+            cosine_sim = cosine_similarity(doc1, doc2)
             
             return {
                 "similarity_score": round(cosine_sim, 3),
@@ -190,7 +307,9 @@ def analyze_sentiment():
     if not text:
         return jsonify({"error": "请提供文本内容"}), 400
     
-    result = TextAnalyzer.sentiment_analysis(text)
+    tenant = current_tenant()
+    result = run_coalesced_incremental(text, 'sentiment', {'tenant': tenant}, 'traditional', user_id, tenant,
+                                       lambda uid: TextAnalyzer.sentiment_analysis(text, uid, tenant))
     
     # 保存分析记录
     analysis = Analysis(
@@ -202,7 +321,7 @@ def analyze_sentiment():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
 
 @app.route('/api/keywords', methods=['POST'])
 @jwt_required()
@@ -215,7 +334,10 @@ def extract_keywords():
     if not text:
         return jsonify({"error": "请提供文本内容"}), 400
     
-    result = TextAnalyzer.extract_keywords(text, top_k)
+    tenant = current_tenant()
+    result = run_coalesced_incremental(text, 'keywords', {'top_k': top_k, 'tenant': tenant}, 'traditional',
+                                       user_id, tenant,
+                                       lambda uid: TextAnalyzer.extract_keywords(text, top_k, tenant, uid))
     
     # 保存分析记录
     analysis = Analysis(
@@ -227,7 +349,7 @@ def extract_keywords():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
 
 @app.route('/api/summary', methods=['POST'])
 @jwt_required()
@@ -240,7 +362,8 @@ def generate_summary():
     if not text:
         return jsonify({"error": "请提供文本内容"}), 400
     
-    result = TextAnalyzer.generate_summary(text, max_length)
+    result = run_coalesced(text, 'summary', {'max_length': max_length}, 'traditional',
+                           lambda: TextAnalyzer.generate_summary(text, max_length))
     
     # 保存分析记录
     analysis = Analysis(
@@ -252,7 +375,7 @@ def generate_summary():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
 
 @app.route('/api/similarity', methods=['POST'])
 @jwt_required()
@@ -265,7 +388,13 @@ def calculate_similarity():
     if not text1 or not text2:
         return jsonify({"error": "请提供两段文本内容"}), 400
     
-    result = TextAnalyzer.calculate_similarity(text1, text2)
+    if data.get('method') == 'embedding':
+        # 比较两段文本的向量，向量服务不可用时回退到传统方法
+        result = run_coalesced(text1, 'similarity', {'text2': text2}, 'embedding',
+                               lambda: enhanced_analyzer.calculate_similarity(text1, text2, use_llm=True))
+    else:
+        result = run_coalesced(text1, 'similarity', {'text2': text2}, 'traditional',
+                               lambda: TextAnalyzer.calculate_similarity(text1, text2))
     
     # 保存分析记录
     analysis = Analysis(
@@ -277,49 +406,302 @@ def calculate_similarity():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
 
 @app.route('/api/history', methods=['GET'])
 @jwt_required()
 def get_history():
+    """分析历史，从新到旧排列；热表中的记录不足limit条时从归档中补齐
+    支持 limit、before_id（分页，返回ID小于它的记录）、type、start、end 参数"""
     user_id = int(get_jwt_identity())
-    analyses = Analysis.query.filter_by(user_id=user_id).order_by(Analysis.created_at.desc()).limit(20).all()
+    analysis_type = request.args.get('type')
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        before_id = int(request.args['before_id']) if request.args.get('before_id') else None
+        start = parse_datetime(request.args.get('start'))
+        end = parse_datetime(request.args.get('end'), end=True)
+    except ValueError:
+        return jsonify({"error": "参数格式错误"}), 400
+    
+    query = Analysis.query.filter_by(user_id=user_id)
+    if analysis_type:
+        query = query.filter_by(analysis_type=analysis_type)
+    if before_id:
+        query = query.filter(Analysis.id < before_id)
+    if start:
+        query = query.filter(Analysis.created_at >= start)
+    if end:
+        query = query.filter(Analysis.created_at < end)
+    analyses = [(analysis, False) for analysis in query.order_by(Analysis.id.desc()).limit(limit).all()]
+    
+    if len(analyses) < limit and archiver:
+        # 归档记录的ID都小于热表中的记录
+        archive_before = analyses[-1][0].id if analyses else before_id
+        archived = archiver.store.query(user_id, start, end, analysis_type, before_id=archive_before)
+        analyses.extend((analysis, True) for analysis in islice(archived, limit - len(analyses)))
     
     history = []
-    for analysis in analyses:
+    for analysis, is_archived in analyses:
         history.append({
             "id": analysis.id,
             "text": analysis.text[:100] + "..." if len(analysis.text) > 100 else analysis.text,
             "analysis_type": analysis.analysis_type,
             "result": analysis.result,
-            "created_at": analysis.created_at.strftime("%Y-%m-%d %H:%M:%S")
+            "created_at": analysis.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "archived": is_archived
+        })
+    
+    return jsonify({
+        "history": history,
+        "next_before_id": history[-1]["id"] if len(history) == limit else None
+    }), 200
+
+@app.route('/api/history/search', methods=['GET'])
+@jwt_required()
+def search_history():
+    """全文检索分析历史（正文和结果中的情感、关键词、摘要等），按相关度排序
+    支持 q、type、start、end、page、per_page 参数；已归档的记录不参与检索"""
+    user_id = int(get_jwt_identity())
+    query_text = (request.args.get('q') or '').strip()
+    if not query_text:
+        return jsonify({"error": "请提供搜索关键词"}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 20)), 1), 100)
+        start = parse_datetime(request.args.get('start'))
+        end = parse_datetime(request.args.get('end'), end=True)
+    except ValueError:
+        return jsonify({"error": "参数格式错误"}), 400
+    
+    connection = db.session.connection()
+    if not search_index.supported(connection):
+        return jsonify({"error": "当前数据库不支持全文检索"}), 501
+    total, matches = search_index.search(connection, user_id, query_text, request.args.get('type'),
+                                         start, end, limit=per_page, offset=(page - 1) * per_page)
+    
+    analyses = {analysis.id: analysis for analysis in
+                Analysis.query.filter(Analysis.id.in_([analysis_id for analysis_id, _ in matches])).all()}
+    results = []
+    for analysis_id, score in matches:
+        analysis = analyses.get(analysis_id)
+        if analysis is None:
+            continue
+        results.append({
+            "id": analysis.id,
+            "snippet": make_snippet(analysis.text, query_text),
+            "analysis_type": analysis.analysis_type,
+            "result": analysis.result,
+            "created_at": analysis.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "score": round(score, 4)
         })
     
-    return jsonify({"history": history}), 200
+    return jsonify({
+        "results": results,
+        "total": total,
+        "page": page,
+        "per_page": per_page
+    }), 200
+
+@app.route('/api/history/semantic', methods=['GET'])
+@jwt_required()
+@llm_admission
+def semantic_search_history():
+    """按语义检索分析历史：返回与q的向量最相似的k条记录；已归档的记录不参与检索"""
+    user_id = int(get_jwt_identity())
+    query_text = (request.args.get('q') or '').strip()
+    if not query_text:
+        return jsonify({"error": "请提供搜索内容"}), 400
+    try:
+        k = min(max(int(request.args.get('k', 10)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "参数格式错误"}), 400
+    
+    try:
+        matches = semantic_search.search(user_id, query_text, k, load_history_texts)
+    except CircuitOpenError as e:
+        return jsonify({"error": f"向量服务暂不可用: {str(e)}"}), 503
+    except EmbeddingError as e:
+        return jsonify({"error": str(e)}), 503
+    
+    analyses = {analysis.id: analysis for analysis in
+                Analysis.query.filter(Analysis.id.in_([analysis_id for analysis_id, _ in matches])).all()}
+    results = []
+    for analysis_id, score in matches:
+        analysis = analyses.get(analysis_id)
+        if analysis is None:
+            continue
+        results.append({
+            "id": analysis.id,
+            "snippet": analysis.text[:200],
+            "analysis_type": analysis.analysis_type,
+            "result": analysis.result,
+            "created_at": analysis.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "score": round(score, 4)
+        })
+    
+    return jsonify({"results": results, "model": config.OLLAMA_EMBED_MODEL}), 200
+
+@app.route('/api/history/<int:analysis_id>', methods=['GET'])
+@jwt_required()
+def get_history_item(analysis_id):
+    """按ID获取一条完整的分析记录（包括已归档的记录）"""
+    user_id = int(get_jwt_identity())
+    analysis = Analysis.query.filter_by(id=analysis_id, user_id=user_id).first()
+    is_archived = False
+    if analysis is None and archiver:
+        analysis = archiver.store.get(analysis_id, user_id)
+        is_archived = True
+    if analysis is None:
+        return jsonify({"error": "分析记录不存在"}), 404
+    
+    return jsonify({
+        "id": analysis.id,
+        "text": analysis.text,
+        "analysis_type": analysis.analysis_type,
+        "result": analysis.result,
+        "created_at": analysis.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "archived": is_archived
+    }), 200
+
+@app.route('/api/history/export', methods=['GET'])
+@jwt_required()
+def export_history():
+    """流式导出全部分析历史（NDJSON或CSV，可选gzip压缩）"""
+    user_id = int(get_jwt_identity())
+    export_format = request.args.get('format', 'ndjson')
+    analysis_type = request.args.get('type')
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "format只支持ndjson或csv"}), 400
+    try:
+        start = parse_datetime(request.args.get('start'))
+        end = parse_datetime(request.args.get('end'), end=True)
+    except ValueError:
+        return jsonify({"error": "日期格式错误，请使用YYYY-MM-DD或ISO格式"}), 400
+    
+    # 只查询需要的列并使用服务端游标分批读取，内存占用与导出行数无关
+    query = select(Analysis.id, Analysis.analysis_type, Analysis.text, Analysis.result, Analysis.created_at) \
+        .where(Analysis.user_id == user_id)
+    if analysis_type:
+        query = query.where(Analysis.analysis_type == analysis_type)
+    if start:
+        query = query.where(Analysis.created_at >= start)
+    if end:
+        query = query.where(Analysis.created_at < end)
+    query = query.order_by(Analysis.id).execution_options(yield_per=app.config['EXPORT_BATCH_SIZE'])
+    
+    def records():
+        last_archived_id = 0
+        if archiver:
+            # 归档记录的ID都小于热表中的记录，先导出归档部分
+            for record in archiver.store.query(user_id, start, end, analysis_type, newest_first=False):
+                last_archived_id = record.id
+                yield record
+        # 归档段已写入、热表中的行还没删除时，同一条记录在两处都有，热表只导出更新的记录
+        yield from db.session.execute(query.where(Analysis.id > last_archived_id))
+    
+    def generate():
+        rows = records()
+        chunks = iter_ndjson(rows) if export_format == 'ndjson' else iter_csv(rows)
+        if compress:
+            chunks = iter_gzip(chunks)
+        yield from chunks
+    
+    filename = f"history.{export_format}" + ('.gz' if compress else '')
+    if compress:
+        mimetype = 'application/gzip'
+    elif export_format == 'ndjson':
+        mimetype = 'application/x-ndjson'
+    else:
+        mimetype = 'text/csv'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 @app.route('/api/stats', methods=['GET'])
 @jwt_required()
 def get_stats():
     user_id = int(get_jwt_identity())
-    total_analyses = Analysis.query.filter_by(user_id=user_id).count()
+    # 归档记录的计数从归档索引中读取；已归档但还没从热表删除的行只按归档计数
+    segments = archiver.store.segments() if archiver else []
+    archived = archiver.store.counts(user_id, segments) if archiver else {}
+    hot = Analysis.query.filter(Analysis.user_id == user_id,
+                                Analysis.id > (archiver.store.max_id(segments) if archiver else 0))
+    total_analyses = hot.count()
     
     # 按类型统计
-    sentiment_count = Analysis.query.filter_by(user_id=user_id, analysis_type='sentiment').count()
-    keywords_count = Analysis.query.filter_by(user_id=user_id, analysis_type='keywords').count()
-    summary_count = Analysis.query.filter_by(user_id=user_id, analysis_type='summary').count()
-    similarity_count = Analysis.query.filter_by(user_id=user_id, analysis_type='similarity').count()
+    sentiment_count = hot.filter_by(analysis_type='sentiment').count()
+    keywords_count = hot.filter_by(analysis_type='keywords').count()
+    summary_count = hot.filter_by(analysis_type='summary').count()
+    similarity_count = hot.filter_by(analysis_type='similarity').count()
     
     return jsonify({
-        "total_analyses": total_analyses,
-        "sentiment_count": sentiment_count,
-        "keywords_count": keywords_count,
-        "summary_count": summary_count,
-        "similarity_count": similarity_count
+        "total_analyses": total_analyses + sum(archived.values()),
+        "sentiment_count": sentiment_count + archived.get('sentiment', 0),
+        "keywords_count": keywords_count + archived.get('keywords', 0),
+        "summary_count": summary_count + archived.get('summary', 0),
+        "similarity_count": similarity_count + archived.get('similarity', 0),
+        "archived_analyses": sum(archived.values())
+    }), 200
+
+def _trend_params():
+    """趋势接口的公共参数，返回(粒度, 开始时间, 结束时间)"""
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        raise ValueError("granularity只支持hour或day")
+    start = parse_datetime(request.args.get('start'))
+    end = parse_datetime(request.args.get('end'), end=True)
+    return (granularity,) + TrendRollups.default_range(granularity, start, end)
+
+@app.route('/api/trends/keywords', methods=['GET'])
+@jwt_required()
+def keyword_trends():
+    """时间范围内出现次数最多的关键词，以及它们在每个时间桶中的次数（只读取预聚合的时间桶）"""
+    user_id = int(get_jwt_identity())
+    try:
+        granularity, start, end = _trend_params()
+        top_k = min(max(int(request.args.get('top_k', 10)), 1), 100)
+    except ValueError as e:
+        return jsonify({"error": f"参数格式错误: {e}"}), 400
+    
+    connection = db.session.connection()
+    keywords = trend_rollups.top_keywords(connection, user_id, granularity, start, end, top_k)
+    series = trend_rollups.keyword_series(connection, user_id, granularity, start, end,
+                                          [item["word"] for item in keywords])
+    return jsonify({
+        "granularity": granularity,
+        "start": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "end": end.strftime("%Y-%m-%d %H:%M:%S"),
+        "keywords": keywords,
+        "series": series
+    }), 200
+
+@app.route('/api/trends/sentiment', methods=['GET'])
+@jwt_required()
+def sentiment_trends():
+    """每个时间桶的情感统计，可按分析类型过滤（只读取预聚合的时间桶）"""
+    user_id = int(get_jwt_identity())
+    try:
+        granularity, start, end = _trend_params()
+    except ValueError as e:
+        return jsonify({"error": f"参数格式错误: {e}"}), 400
+    
+    series = trend_rollups.sentiment_series(db.session.connection(), user_id, granularity, start, end,
+                                            request.args.get('type'))
+    return jsonify({
+        "granularity": granularity,
+        "start": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "end": end.strftime("%Y-%m-%d %H:%M:%S"),
+        "series": series
     }), 200
 
 # LLM相关API端点
 @app.route('/api/llm/sentiment', methods=['POST'])
 @jwt_required()
+@llm_admission
 def llm_sentiment_analysis():
     user_id = int(get_jwt_identity())
     data = request.get_json()
@@ -328,7 +710,8 @@ def llm_sentiment_analysis():
     if not text:
         return jsonify({"error": "请提供文本内容"}), 400
     
-    result = enhanced_analyzer.sentiment_analysis(text, use_llm=True)
+    result = run_coalesced(text, 'llm_sentiment', {}, enhanced_analyzer.config.LLM_PROVIDER,
+                           lambda: enhanced_analyzer.sentiment_analysis(text, use_llm=True))
     
     # 保存分析记录
     analysis = Analysis(
@@ -340,10 +723,11 @@ def llm_sentiment_analysis():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
 
 @app.route('/api/llm/keywords', methods=['POST'])
 @jwt_required()
+@llm_admission
 def llm_extract_keywords():
     user_id = int(get_jwt_identity())
     data = request.get_json()
@@ -353,7 +737,9 @@ def llm_extract_keywords():
     if not text:
         return jsonify({"error": "请提供文本内容"}), 400
     
-    result = enhanced_analyzer.extract_keywords(text, top_k, use_llm=True)
+    tenant = current_tenant()
+    result = run_coalesced(text, 'llm_keywords', {'top_k': top_k, 'tenant': tenant}, enhanced_analyzer.config.LLM_PROVIDER,
+                           lambda: enhanced_analyzer.extract_keywords(text, top_k, use_llm=True, tenant=tenant))
     
     # 保存分析记录
     analysis = Analysis(
@@ -365,10 +751,11 @@ def llm_extract_keywords():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
 
 @app.route('/api/llm/summary', methods=['POST'])
 @jwt_required()
+@llm_admission
 def llm_generate_summary():
     user_id = int(get_jwt_identity())
     data = request.get_json()
@@ -378,7 +765,8 @@ def llm_generate_summary():
     if not text:
         return jsonify({"error": "请提供文本内容"}), 400
     
-    result = enhanced_analyzer.generate_summary(text, max_length, use_llm=True)
+    result = run_coalesced(text, 'llm_summary', {'max_length': max_length}, enhanced_analyzer.config.LLM_PROVIDER,
+                           lambda: enhanced_analyzer.generate_summary(text, max_length, use_llm=True))
     
     # 保存分析记录
     analysis = Analysis(
@@ -390,10 +778,11 @@ def llm_generate_summary():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
 
 @app.route('/api/llm/comprehensive', methods=['POST'])
 @jwt_required()
+@llm_admission
 def llm_comprehensive_analysis():
     user_id = int(get_jwt_identity())
     data = request.get_json()
@@ -402,7 +791,8 @@ def llm_comprehensive_analysis():
     if not text:
         return jsonify({"error": "请提供文本内容"}), 400
     
-    result = enhanced_analyzer.llm_analysis(text, 'comprehensive')
+    result = run_coalesced(text, 'llm_comprehensive', {}, enhanced_analyzer.config.LLM_PROVIDER,
+                           lambda: enhanced_analyzer.llm_analysis(text, 'comprehensive'))
     
     # 保存分析记录
     analysis = Analysis(
@@ -414,10 +804,11 @@ def llm_comprehensive_analysis():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
 
 @app.route('/api/hybrid/analysis', methods=['POST'])
 @jwt_required()
+@llm_admission
 def hybrid_analysis():
     user_id = int(get_jwt_identity())
     data = request.get_json()
@@ -426,7 +817,10 @@ def hybrid_analysis():
     if not text:
         return jsonify({"error": "请提供文本内容"}), 400
     
-    result = enhanced_analyzer.hybrid_analysis(text)
+    tenant = current_tenant()
+    result = run_coalesced_incremental(text, 'hybrid_analysis', {'tenant': tenant}, enhanced_analyzer.config.LLM_PROVIDER,
+                                       user_id, tenant,
+                                       lambda uid: enhanced_analyzer.hybrid_analysis(text, tenant, user_id=uid))
     
     # 保存分析记录
     analysis = Analysis(
@@ -438,14 +832,67 @@ def hybrid_analysis():
     db.session.add(analysis)
     db.session.commit()
     
-    return jsonify(result), 200
+    return shaped_response(result)
+
+@app.route('/api/pipeline', methods=['POST'])
+@jwt_required()
+def run_pipeline():
+    """一次请求执行多种分析：analyses为分析列表，分词等中间结果只计算一次，相互独立的阶段并发执行"""
+    user_id = int(get_jwt_identity())
+    data = request.get_json()
+    text = data.get('text')
+    
+    if not text:
+        return jsonify({"error": "请提供文本内容"}), 400
+    
+    analyses = data.get('analyses')
+    if analyses is not None and not isinstance(analyses, list):
+        return jsonify({"error": "analyses必须是分析类型列表"}), 400
+    try:
+        plan = analysis_pipeline.plan(analyses)
+        top_k = int(data.get('top_k', 10))
+        max_length = int(data.get('max_length', 200))
+    except (PipelineError, TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    tenant = current_tenant()
+    provider = enhanced_analyzer.config.LLM_PROVIDER if analysis_pipeline.llm_cost(plan) else 'traditional'
+    # LLM阶段实际调用LLM时按当前用户准入
+    with requester(get_jwt_identity(), request_priority()):
+        result = run_coalesced(text, 'pipeline', {'plan': plan, 'top_k': top_k, 'max_length': max_length,
+                                                  'tenant': tenant}, provider,
+                               lambda: analysis_pipeline.run(text, top_k=top_k, max_length=max_length,
+                                                             tenant=tenant, plan=plan))
+    
+    # 所有阶段的结果保存为一条分析记录
+    analysis = Analysis(
+        user_id=user_id,
+        text=text,
+        analysis_type='pipeline',
+        result=str(result)
+    )
+    db.session.add(analysis)
+    db.session.commit()
+    
+    return shaped_response(result)
 
 @app.route('/api/llm/health', methods=['GET'])
 def llm_health_check():
-    """LLM服务健康检查"""
-    return jsonify(enhanced_analyzer.health_check()), 200
+    """LLM服务健康检查（返回后台探测的缓存状态）"""
+    health = enhanced_analyzer.health_check()
+    health["responses"] = get_response_shaper().stats.snapshot()
+    health["embeddings"] = {
+        "cache": enhanced_analyzer.llm_service.embedding_cache.stats(),
+        "index": semantic_search.stats()
+    }
+    return jsonify(health), 200
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        ensure_indexes(db.engine, db.metadata)
+        search_index.prepare(db.engine)
+    enhanced_analyzer.llm_service.health_monitor.start()
+    if archive_scheduler:
+        archive_scheduler.start()
     app.run(debug=True, host='0.0.0.0', port=5002) 
\ No newline at end of file
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析记录的冷数据归档
+超过ARCHIVE_AFTER_DAYS天的分析记录从analysis表移到本地磁盘上的归档段文件中，热表只保留近期数据。
+
+- 段文件只追加、写完后不再修改：由若干独立压缩的数据块组成，每块是若干条记录的NDJSON（zlib压缩）
+- 每个段有一个很小的索引文件：记录ID和时间范围、每块的偏移和范围、每个用户所在的块以及按类型的计数，
+  按ID或时间范围查找时只解压需要的块
+- 后台任务定期归档并合并过小的段；合并后的段在索引中记录被它替代的段，读者一旦看到新段就不再读取旧段
+- 段文件先于热表中的行删除写入，短暂的窗口内同一条记录同时存在于两处：同时读取两处的读者只读取
+  热表中ID大于已读归档记录的行（归档记录的ID都小于热表中的记录）
+
+单独运行一次归档和合并：
+    python archive.py
+    python archive.py --days 30 --no-compact
+"""
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows下不做跨进程加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 索引中的时间统一为固定宽度格式，字符串比较即时间比较
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+
+def format_time(value: datetime) -> str:
+    return value.strftime(TIME_FORMAT)
+
+
+class ArchivedAnalysis(NamedTuple):
+    """归档的分析记录，字段与Analysis模型一致，可直接用于导出"""
+    id: int
+    user_id: int
+    analysis_type: str
+    text: str
+    result: str
+    created_at: datetime
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> 'ArchivedAnalysis':
+        return cls(record['id'], record['user_id'], record['analysis_type'], record['text'], record['result'],
+                   datetime.strptime(record['created_at'], TIME_FORMAT))
+
+
+class BlockInfo(NamedTuple):
+    offset: int
+    length: int
+    records: int
+    first_id: int
+    last_id: int
+    min_created: str
+    max_created: str
+
+
+class SegmentIndex:
+    """一个段文件的索引"""
+
+    def __init__(self, name: str, blocks: List[BlockInfo], users: Dict[int, List[int]],
+                 counts: Dict[int, Dict[str, int]], replaces: Sequence[str] = ()):
+        self.name = name
+        self.blocks = blocks
+        self.users = users
+        self.counts = counts
+        # 合并产生的段：被它替代的段名
+        self.replaces = list(replaces)
+        self.records = sum(block.records for block in blocks)
+        self.min_id = blocks[0].first_id
+        self.max_id = blocks[-1].last_id
+        self.min_created = min(block.min_created for block in blocks)
+        self.max_created = max(block.max_created for block in blocks)
+        self._first_ids = [block.first_id for block in blocks]
+
+    def block_for_id(self, analysis_id: int) -> Optional[int]:
+        if not self.min_id <= analysis_id <= self.max_id:
+            return None
+        i = bisect.bisect_right(self._first_ids, analysis_id) - 1
+        return i if i >= 0 and analysis_id <= self.blocks[i].last_id else None
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "version": INDEX_VERSION,
+            "blocks": [list(block) for block in self.blocks],
+            "users": {str(user): blocks for user, blocks in self.users.items()},
+            "counts": {str(user): counts for user, counts in self.counts.items()},
+            "replaces": self.replaces
+        }
+
+    @classmethod
+    def from_json(cls, name: str, data: Dict[str, Any]) -> 'SegmentIndex':
+        return cls(name, [BlockInfo(*block) for block in data["blocks"]],
+                   {int(user): blocks for user, blocks in data["users"].items()},
+                   {int(user): counts for user, counts in data["counts"].items()},
+                   data.get("replaces", ()))
+
+
+class ArchiveStore:
+    """归档段文件的读写，段列表在内存中，其他进程新增或合并段后自动重新加载"""
+
+    def __init__(self, directory: str, block_records: int = 256, block_cache: int = 32):
+        self.directory = directory
+        self.block_records = block_records
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._segments: List[SegmentIndex] = []
+        self._superseded: List[SegmentIndex] = []
+        self._directory_mtime = None
+        self._blocks: "OrderedDict[tuple, List[Dict[str, Any]]]" = OrderedDict()
+        self._block_cache = block_cache
+        self._reload()
+
+    # ---- 段列表 ----
+
+    def _reload(self) -> None:
+        segments = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(INDEX_SUFFIX):
+                continue
+            name = filename[:-len(INDEX_SUFFIX)]
+            try:
+                with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                    segments.append(SegmentIndex.from_json(name, json.load(f)))
+            except FileNotFoundError:
+                # 刚被合并删除
+                continue
+        # 合并完成后、删除旧段之前，旧段的记录已经包含在新段中
+        replaced = {name for segment in segments for name in segment.replaces}
+        self._superseded = [segment for segment in segments if segment.name in replaced]
+        segments = [segment for segment in segments if segment.name not in replaced]
+        segments.sort(key=lambda segment: segment.min_id)
+        self._segments = segments
+        self._directory_mtime = os.stat(self.directory).st_mtime_ns
+
+    def segments(self) -> List[SegmentIndex]:
+        with self._lock:
+            if os.stat(self.directory).st_mtime_ns != self._directory_mtime:
+                self._reload()
+            return list(self._segments)
+
+    def superseded(self) -> List[SegmentIndex]:
+        """已被合并段替代、但还没有删除的段（合并中途退出时留下）"""
+        self.segments()
+        with self._lock:
+            return list(self._superseded)
+
+    def max_id(self, segments: Optional[Sequence[SegmentIndex]] = None) -> int:
+        """已归档记录的最大ID，没有归档记录时为0"""
+        return max((segment.max_id for segment in (self.segments() if segments is None else segments)), default=0)
+
+    @contextmanager
+    def write_lock(self):
+        """归档和合并在进程间互斥"""
+        with open(os.path.join(self.directory, '.lock'), 'w') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _next_name(self) -> str:
+        existing = [int(filename.split('-')[1].split('.')[0]) for filename in os.listdir(self.directory)
+                    if filename.startswith('segment-') and filename.endswith(INDEX_SUFFIX)]
+        return f"segment-{max(existing, default=0) + 1:08d}"
+
+    # ---- 写入 ----
+
+    def write_segment(self, records: Sequence[Dict[str, Any]], replaces: Sequence[str] = ()) -> SegmentIndex:
+        """把按ID升序排列的记录写成一个新段；先写段文件，索引最后原子地出现，读者看不到写了一半的段
+        replaces为合并时被替代的段名，新段的索引出现后读者即忽略这些段"""
+        name = self._next_name()
+        segment_path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        blocks: List[BlockInfo] = []
+        users: Dict[int, List[int]] = {}
+        counts: Dict[int, Dict[str, int]] = {}
+        with open(segment_path + '.tmp', 'wb') as f:
+            for start in range(0, len(records), self.block_records):
+                chunk = records[start:start + self.block_records]
+                payload = zlib.compress(
+                    ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in chunk).encode('utf-8'), 6)
+                created = [record['created_at'] for record in chunk]
+                blocks.append(BlockInfo(f.tell(), len(payload), len(chunk), chunk[0]['id'], chunk[-1]['id'],
+                                        min(created), max(created)))
+                f.write(payload)
+                block = len(blocks) - 1
+                for record in chunk:
+                    user_blocks = users.setdefault(record['user_id'], [])
+                    if not user_blocks or user_blocks[-1] != block:
+                        user_blocks.append(block)
+                    user_counts = counts.setdefault(record['user_id'], {})
+                    user_counts[record['analysis_type']] = user_counts.get(record['analysis_type'], 0) + 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(segment_path + '.tmp', segment_path)
+
+        index = SegmentIndex(name, blocks, users, counts, replaces)
+        index_path = os.path.join(self.directory, name + INDEX_SUFFIX)
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index.to_json(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path + '.tmp', index_path)
+        logger.info(f"写入归档段 {name}：{index.records}条记录，{len(blocks)}块")
+        return index
+
+    def remove_segments(self, segments: Iterable[SegmentIndex]) -> None:
+        """先删除索引再删除段文件，读者不会找到没有数据的索引"""
+        for segment in segments:
+            for suffix in (INDEX_SUFFIX, SEGMENT_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, segment.name + suffix))
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                for key in [key for key in self._blocks if key[0] == segment.name]:
+                    del self._blocks[key]
+
+    # ---- 读取 ----
+
+    def _read_block(self, segment: SegmentIndex, block: int) -> List[Dict[str, Any]]:
+        key = (segment.name, block)
+        with self._lock:
+            records = self._blocks.get(key)
+            if records is not None:
+                self._blocks.move_to_end(key)
+                return records
+        info = segment.blocks[block]
+        with open(os.path.join(self.directory, segment.name + SEGMENT_SUFFIX), 'rb') as f:
+            f.seek(info.offset)
+            payload = f.read(info.length)
+        records = [json.loads(line) for line in zlib.decompress(payload).decode('utf-8').splitlines()]
+        with self._lock:
+            self._blocks[key] = records
+            while len(self._blocks) > self._block_cache:
+                self._blocks.popitem(last=False)
+        return records
+
+    def _with_retry(self, fn: Callable[[List[SegmentIndex]], Any]) -> Any:
+        """段在读取期间被其他进程合并删除时，重新加载段列表再试一次"""
+        try:
+            return fn(self.segments())
+        except FileNotFoundError:
+            with self._lock:
+                self._reload()
+            return fn(self.segments())
+
+    def get(self, analysis_id: int, user_id: Optional[int] = None) -> Optional[ArchivedAnalysis]:
+        """按ID查找归档记录，指定user_id时只返回该用户的记录"""
+        def find(segments):
+            for segment in segments:
+                block = segment.block_for_id(analysis_id)
+                if block is None or (user_id is not None and block not in segment.users.get(user_id, ())):
+                    continue
+                for record in self._read_block(segment, block):
+                    if record['id'] == analysis_id and (user_id is None or record['user_id'] == user_id):
+                        return ArchivedAnalysis.from_dict(record)
+            return None
+        return self._with_retry(find)
+
+    def contains(self, ids: Iterable[int]) -> Set[int]:
+        """返回已经归档的ID，只解压ID范围覆盖这些ID的块"""
+        found: Set[int] = set()
+        wanted = sorted(set(ids))
+        if not wanted:
+            return found
+
+        def find(segments):
+            for segment in segments:
+                if segment.max_id < wanted[0] or segment.min_id > wanted[-1]:
+                    continue
+                candidates: Dict[int, List[int]] = {}
+                for analysis_id in wanted[bisect.bisect_left(wanted, segment.min_id):
+                                          bisect.bisect_right(wanted, segment.max_id)]:
+                    block = segment.block_for_id(analysis_id)
+                    if block is not None:
+                        candidates.setdefault(block, []).append(analysis_id)
+                for block, block_ids in candidates.items():
+                    stored = {record['id'] for record in self._read_block(segment, block)}
+                    found.update(analysis_id for analysis_id in block_ids if analysis_id in stored)
+            return found
+        return self._with_retry(find)
+
+    def query(self, user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              analysis_type: Optional[str] = None, before_id: Optional[int] = None,
+              newest_first: bool = True, after_id: Optional[int] = None) -> Iterator[ArchivedAnalysis]:
+        """按时间范围查询某个用户的归档记录（[start, end)），按ID排序逐条返回
+        只返回ID在(after_id, before_id)之间的记录，可用于分页"""
+        low = format_time(start) if start else None
+        high = format_time(end) if end else None
+        segments = self.segments()
+        if newest_first:
+            segments.reverse()
+        for segment in segments:
+            blocks = segment.users.get(user_id)
+            if not blocks or (low and segment.max_created < low) or (high and segment.min_created >= high):
+                continue
+            if (before_id is not None and segment.min_id >= before_id) or \
+                    (after_id is not None and segment.max_id <= after_id):
+                continue
+            for block in (reversed(blocks) if newest_first else blocks):
+                info = segment.blocks[block]
+                if (low and info.max_created < low) or (high and info.min_created >= high):
+                    continue
+                if (before_id is not None and info.first_id >= before_id) or \
+                        (after_id is not None and info.last_id <= after_id):
+                    continue
+                try:
+                    records = self._read_block(segment, block)
+                except FileNotFoundError:
+                    # 段已被其他进程合并：重新加载段列表，从最后返回的记录之后继续
+                    with self._lock:
+                        self._reload()
+                    yield from self.query(user_id, start, end, analysis_type, before_id, newest_first, after_id)
+                    return
+                for record in (reversed(records) if newest_first else records):
+                    if record['user_id'] != user_id:
+                        continue
+                    if analysis_type and record['analysis_type'] != analysis_type:
+                        continue
+                    if (low and record['created_at'] < low) or (high and record['created_at'] >= high):
+                        continue
+                    if (before_id is not None and record['id'] >= before_id) or \
+                            (after_id is not None and record['id'] <= after_id):
+                        continue
+                    yield ArchivedAnalysis.from_dict(record)
+                    if newest_first:
+                        before_id = record['id']
+                    else:
+                        after_id = record['id']
+
+    def counts(self, user_id: int, segments: Optional[Sequence[SegmentIndex]] = None) -> Dict[str, int]:
+        """某个用户各分析类型的归档记录数（只读索引，不解压数据），segments为空时使用当前的段列表"""
+        totals: Dict[str, int] = {}
+        for segment in (self.segments() if segments is None else segments):
+            for analysis_type, count in segment.counts.get(user_id, {}).items():
+                totals[analysis_type] = totals.get(analysis_type, 0) + count
+        return totals
+
+    def iter_segment(self, segment: SegmentIndex) -> Iterator[Dict[str, Any]]:
+        for block in range(len(segment.blocks)):
+            yield from self._read_block(segment, block)
+
+    def iter_records(self) -> Iterator[ArchivedAnalysis]:
+        """按ID顺序遍历全部归档记录"""
+        for segment in self.segments():
+            for record in self.iter_segment(segment):
+                yield ArchivedAnalysis.from_dict(record)
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self.segments()
+        return {
+            "segments": len(segments),
+            "records": sum(segment.records for segment in segments),
+            "bytes": sum(os.path.getsize(os.path.join(self.directory, segment.name + SEGMENT_SUFFIX))
+                         for segment in segments
+                         if os.path.exists(os.path.join(self.directory, segment.name + SEGMENT_SUFFIX))),
+            "oldest": segments[0].min_created if segments else None,
+            "newest": max(segment.max_created for segment in segments) if segments else None
+        }
+
+
+class Archiver:
+    """把热表中的冷数据移入归档，并合并过小的段"""
+
+    def __init__(self, store: ArchiveStore, table, after_days: float = 90, segment_records: int = 20000,
+                 delete_batch: int = 500):
+        self.store = store
+        self.table = table
+        self.after_days = after_days
+        self.segment_records = segment_records
+        self.delete_batch = delete_batch
+        self.last_run: Optional[Dict[str, Any]] = None
+        # 删除热表中的行时在同一事务中调用，参数为(连接, ID列表)，用于清理依赖这些行的数据
+        self.on_archived: List[Callable[[Any, List[int]], None]] = []
+
+    @staticmethod
+    def _record(row) -> Dict[str, Any]:
+        return {
+            "id": row.id,
+            "user_id": row.user_id,
+            "analysis_type": row.analysis_type,
+            "text": row.text,
+            "result": row.result,
+            "created_at": format_time(row.created_at)
+        }
+
+    def archive(self, engine: Engine, cutoff: Optional[datetime] = None) -> int:
+        """归档created_at早于cutoff的记录，返回移出热表的行数
+        先持久化段文件再删除热表中的行；中途失败时已归档的行仍留在热表，下次运行时只删除不重复写入"""
+        cutoff = cutoff or datetime.utcnow() - timedelta(days=self.after_days)
+        table = self.table
+        moved = 0
+        with self.store.write_lock():
+            while True:
+                query = select(table).where(table.c.created_at < cutoff).order_by(table.c.id) \
+                    .limit(self.segment_records)
+                with engine.connect() as connection:
+                    rows = connection.execute(query).all()
+                if not rows:
+                    break
+                records = [self._record(row) for row in rows]
+                archived = self.store.contains(record['id'] for record in records)
+                pending = [record for record in records if record['id'] not in archived]
+                if pending:
+                    self.store.write_segment(pending)
+                ids = [record['id'] for record in records]
+                with engine.begin() as connection:
+                    for start in range(0, len(ids), self.delete_batch):
+                        batch = ids[start:start + self.delete_batch]
+                        for callback in self.on_archived:
+                            callback(connection, batch)
+                        connection.execute(table.delete().where(table.c.id.in_(batch)))
+                moved += len(ids)
+                if len(rows) < self.segment_records:
+                    break
+        return moved
+
+    def compact(self) -> int:
+        """把相邻的小段合并为不超过segment_records条记录的段，返回被合并的段数"""
+        merged = 0
+        with self.store.write_lock():
+            # 上次合并中途退出时留下的旧段
+            self.store.remove_segments(self.store.superseded())
+            segments = self.store.segments()
+            group: List[SegmentIndex] = []
+            groups: List[List[SegmentIndex]] = []
+            for segment in segments:
+                if segment.records >= self.segment_records // 2:
+                    if len(group) > 1:
+                        groups.append(group)
+                    group = []
+                    continue
+                if group and sum(s.records for s in group) + segment.records > self.segment_records:
+                    if len(group) > 1:
+                        groups.append(group)
+                    group = []
+                group.append(segment)
+            if len(group) > 1:
+                groups.append(group)
+
+            for group in groups:
+                records: Dict[int, Dict[str, Any]] = {}
+                for segment in group:
+                    for record in self.store.iter_segment(segment):
+                        records.setdefault(record['id'], record)
+                self.store.write_segment([records[key] for key in sorted(records)],
+                                         replaces=[segment.name for segment in group])
+                self.store.remove_segments(group)
+                merged += len(group)
+        return merged
+
+    def run(self, engine: Engine, compact: bool = True) -> Dict[str, Any]:
+        started = time.monotonic()
+        moved = self.archive(engine)
+        merged = self.compact() if compact else 0
+        self.last_run = {
+            "archived": moved,
+            "compacted_segments": merged,
+            "duration": round(time.monotonic() - started, 3),
+            "finished_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if moved or merged:
+            logger.info(f"归档任务完成：移出{moved}条记录，合并{merged}个段")
+        return self.last_run
+
+
+class ArchiveScheduler:
+    """后台定时执行归档任务"""
+
+    def __init__(self, job: Callable[[], Any], interval: float = 3600.0):
+        self.job = job
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """启动后台线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='analysis-archiver', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.job()
+            except Exception as e:
+                logger.error(f"归档任务失败: {e}")
+            self._stop.wait(self.interval)
+
+
+_store: Optional[ArchiveStore] = None
+_store_lock = threading.Lock()
+
+
+def get_archive_store() -> ArchiveStore:
+    """进程内共享的归档存储"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = Config()
+                _store = ArchiveStore(config.ARCHIVE_DIR, block_records=config.ARCHIVE_BLOCK_RECORDS)
+    return _store
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='归档冷数据并合并归档段')
+    parser.add_argument('--days', type=float, default=None, help='归档多少天之前的记录，默认使用ARCHIVE_AFTER_DAYS')
+    parser.add_argument('--no-compact', action='store_true', help='不合并归档段')
+    args = parser.parse_args()
+
+    from app import app, archiver, db
+    if args.days is not None:
+        archiver.after_days = args.days
+    with app.app_context():
+        print(json.dumps(archiver.run(db.engine, compact=not args.no_compact), ensure_ascii=False))
+    print(json.dumps(archiver.store.stats(), ensure_ascii=False))
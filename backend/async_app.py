@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM接口的异步服务
+LLM相关路由几乎全部时间都在等待Ollama/OpenAI的网络响应，这里用asyncio事件循环承载这些请求，
+单个进程即可同时挂起数百个LLM请求。JWT认证和分析记录保存与app.py保持一致。
+
+启动方式：python async_app.py（默认端口5003，可通过ASYNC_PORT修改）
+"""
+
+import asyncio
+import functools
+import json
+import logging
+
+import jwt
+from aiohttp import web
+from flask_jwt_extended import decode_token
+
+from app import app, db, Analysis, enhanced_analyzer, search_index
+from singleflight import AsyncSingleFlight, make_flight_key
+from admission import AdmissionRejected, BATCH, INTERACTIVE, requester
+from database import ensure_indexes
+from response_shaping import get_response_shaper
+
+logger = logging.getLogger(__name__)
+
+# 合并相同的并发分析请求
+analysis_flight = AsyncSingleFlight()
+
+
+def _json_error(message, status):
+    return web.json_response({"error": message}, status=status)
+
+
+def authenticate(request):
+    """校验Authorization头中的JWT，返回(令牌声明, 错误响应)，错误格式与flask_jwt_extended一致"""
+    header = request.headers.get('Authorization', '')
+    if not header:
+        return None, web.json_response({"msg": "Missing Authorization Header"}, status=401)
+    parts = header.split()
+    if len(parts) != 2 or parts[0] != 'Bearer':
+        return None, web.json_response({"msg": "Bad Authorization header. Expected 'Authorization: Bearer <JWT>'"}, status=422)
+
+    try:
+        with app.app_context():
+            claims = decode_token(parts[1])
+    except jwt.ExpiredSignatureError:
+        return None, web.json_response({"msg": "Token has expired"}, status=401)
+    except Exception as e:
+        return None, web.json_response({"msg": str(e)}, status=422)
+
+    if claims.get('type') != 'access':
+        return None, web.json_response({"msg": "Only non-refresh tokens are allowed"}, status=422)
+    return claims, None
+
+
+def _save_analysis(user_id, text, analysis_type, result):
+    """保存分析记录（在线程池中执行）"""
+    with app.app_context():
+        analysis = Analysis(
+            user_id=user_id,
+            text=text,
+            analysis_type=analysis_type,
+            result=str(result)
+        )
+        db.session.add(analysis)
+        db.session.commit()
+
+
+def llm_route(analysis_type, compute, params=None, with_tenant=False):
+    """生成异步LLM路由：认证 -> 参数校验 -> 合并执行分析（实际调用LLM时准入） -> 保存记录
+    with_tenant=True时把租户（与app.current_tenant规则相同）作为tenant参数传给compute"""
+    async def handler(request):
+        claims, error = authenticate(request)
+        if error is not None:
+            return error
+        user_id = int(claims['sub'])
+
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            data = None
+        if not isinstance(data, dict):
+            data = {}
+        text = data.get('text')
+
+        if not text:
+            return _json_error("请提供文本内容", 400)
+
+        call_params = params(data) if params else {}
+        if with_tenant:
+            call_params['tenant'] = claims.get('tenant') or claims['sub']
+        key = make_flight_key(text, analysis_type, call_params, enhanced_analyzer.config.LLM_PROVIDER)
+        priority = BATCH if data.get('priority') == BATCH else INTERACTIVE
+        try:
+            with requester(claims['sub'], priority):
+                result = await analysis_flight.do(key, lambda: compute(text, **call_params))
+        except AdmissionRejected as e:
+            return web.json_response({"error": e.message, "retry_after": e.retry_after}, status=e.status,
+                                     headers={'Retry-After': str(e.retry_after)})
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(_save_analysis, user_id, text, analysis_type, result))
+
+        body, headers = get_response_shaper().shape(result, request.query.get('fields') or data.get('fields'),
+                                                    request.headers.get('Accept-Encoding'), request.path)
+        return web.Response(body=body, headers=headers, content_type='application/json')
+    return handler
+
+
+async def llm_health_check(request):
+    """LLM服务健康检查"""
+    health = enhanced_analyzer.health_check()
+    health["responses"] = get_response_shaper().stats.snapshot()
+    return web.json_response(health)
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*')
+    response.headers['Access-Control-Allow-Headers'] = 'Authorization, Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    return response
+
+
+async def _on_startup(application):
+    enhanced_analyzer.llm_service.health_monitor.start()
+
+
+async def _on_cleanup(application):
+    await enhanced_analyzer.llm_service.close_async()
+
+
+def create_app():
+    application = web.Application(middlewares=[cors_middleware])
+    application.router.add_post('/api/llm/sentiment', llm_route(
+        'llm_sentiment',
+        lambda text: enhanced_analyzer.sentiment_analysis_async(text, use_llm=True)))
+    application.router.add_post('/api/llm/keywords', llm_route(
+        'llm_keywords',
+        lambda text, top_k, tenant: enhanced_analyzer.extract_keywords_async(text, top_k, use_llm=True, tenant=tenant),
+        lambda data: {'top_k': data.get('top_k', 10)}, with_tenant=True))
+    application.router.add_post('/api/llm/summary', llm_route(
+        'llm_summary',
+        lambda text, max_length: enhanced_analyzer.generate_summary_async(text, max_length, use_llm=True),
+        lambda data: {'max_length': data.get('max_length', 200)}))
+    application.router.add_post('/api/llm/comprehensive', llm_route(
+        'llm_comprehensive',
+        lambda text: enhanced_analyzer.llm_analysis_async(text, 'comprehensive')))
+    application.router.add_post('/api/hybrid/analysis', llm_route(
+        'hybrid_analysis',
+        lambda text, tenant: enhanced_analyzer.hybrid_analysis_async(text, tenant),
+        with_tenant=True))
+    application.router.add_get('/api/llm/health', llm_health_check)
+    application.on_startup.append(_on_startup)
+    application.on_cleanup.append(_on_cleanup)
+    return application
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        db.create_all()
+        ensure_indexes(db.engine, db.metadata)
+        search_index.prepare(db.engine)
+    web.run_app(create_app(), host=app.config['ASYNC_HOST'], port=app.config['ASYNC_PORT'])
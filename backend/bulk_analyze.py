@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线批量分析命令行工具
+流式读取JSONL/CSV语料，用多进程运行EnhancedTextAnalyzer的分析，结果增量写入JSONL或Parquet，
+支持断点续跑并定期输出吞吐量。
+
+示例：
+    python bulk_analyze.py comments.jsonl -o results.jsonl --analyses sentiment,keywords
+    python bulk_analyze.py comments.csv -o results.parquet --workers 8 --resume
+"""
+
+import argparse
+import csv
+import json
+import importlib.util
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+AVAILABLE_ANALYSES = ('sentiment', 'keywords', 'summary', 'stats', 'topics')
+
+# ParquetWriter写出的part文件名，目录中的其他文件不受影响
+PART_FILE = re.compile(r'part-(\d{5})\.parquet')
+
+# 工作进程内的分析器，由_init_worker初始化
+_analyzer = None
+_options: Dict[str, Any] = {}
+
+
+def _init_worker(options: Dict[str, Any]) -> None:
+    global _analyzer, _options
+    from enhanced_analyzer import EnhancedTextAnalyzer
+    _analyzer = EnhancedTextAnalyzer()
+    _options = options
+
+
+def _analyze_batch(batch: List[Tuple[Any, Optional[str]]]) -> List[Dict[str, Any]]:
+    """在工作进程中分析一批记录"""
+    analyses = _options['analyses']
+    use_llm = _options['use_llm']
+    results = [{"id": record_id} for record_id, _ in batch]
+    valid = [(i, text) for i, (_, text) in enumerate(batch) if text]
+    for i, (_, text) in enumerate(batch):
+        if not text:
+            results[i]["error"] = "缺少文本内容"
+
+    if 'sentiment' in analyses:
+        # 传统方法和本地模型一次向量化计算整批文本
+        sentiments = _analyzer.batch_sentiment_analysis([text for _, text in valid], use_llm=use_llm)
+        for (i, _), sentiment in zip(valid, sentiments):
+            results[i]["sentiment"] = sentiment
+
+    for i, text in valid:
+        if 'keywords' in analyses:
+            results[i]["keywords"] = _analyzer.extract_keywords(text, _options['top_k'], use_llm=use_llm)
+        if 'summary' in analyses:
+            results[i]["summary"] = _analyzer.generate_summary(text, _options['max_length'], use_llm=use_llm)
+        if 'stats' in analyses:
+            results[i]["stats"] = _analyzer._calculate_text_stats(text)
+        if 'topics' in analyses:
+            results[i]["topics"] = _analyzer._extract_topics(text)
+    return results
+
+
+def read_records(path: str, input_format: str, text_field: str, id_field: str) -> Iterator[Tuple[Any, Optional[str]]]:
+    """逐条读取输入记录，返回(id, 文本)，没有id字段时使用行号"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if input_format == 'csv':
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for index, row in enumerate(rows):
+            yield row.get(id_field, index), row.get(text_field)
+
+
+def batched(iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Checkpoint:
+    """记录已完成的输入条数和输出位置，写入时先写临时文件再原子替换"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state = {"records_done": 0, "output_offset": 0, "parts": 0}
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.state.update(json.load(f))
+        return True
+
+    def save(self) -> None:
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class JsonlWriter:
+    def __init__(self, path: str, checkpoint: Checkpoint, resume: bool):
+        self.path = path
+        self.checkpoint = checkpoint
+        self.file = open(path, 'a+b' if resume else 'wb')
+        if resume:
+            # 丢弃上次中断时写了一半、还没记入断点的结果
+            self.file.truncate(checkpoint.state["output_offset"])
+            self.file.seek(checkpoint.state["output_offset"])
+
+    def write(self, results: List[Dict[str, Any]]) -> None:
+        data = ''.join(json.dumps(result, ensure_ascii=False, default=str) + '\n' for result in results)
+        self.file.write(data.encode('utf-8'))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.checkpoint.state["output_offset"] = self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetWriter:
+    """每批结果写成目录下的一个part文件，读取时把整个目录当作一个数据集"""
+
+    def __init__(self, path: str, checkpoint: Checkpoint, resume: bool):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.pq = pq
+        # 所有part使用同一个固定的表结构：整批出错或某列全为空时列和类型也不变，目录能作为一个数据集读取
+        self.schema = pa.schema(
+            [("id", pa.string()), ("error", pa.string()),
+             ("sentiment_score", pa.float64()), ("sentiment_label", pa.string())] +
+            [(name, pa.string()) for name in AVAILABLE_ANALYSES]
+        )
+        self.path = path
+        self.checkpoint = checkpoint
+        os.makedirs(path, exist_ok=True)
+        keep = checkpoint.state["parts"] if resume else 0
+        for name in os.listdir(path):
+            match = PART_FILE.fullmatch(name)
+            if match and int(match.group(1)) >= keep:
+                os.remove(os.path.join(path, name))
+
+    @staticmethod
+    def _to_row(result: Dict[str, Any]) -> Dict[str, Any]:
+        row = {"id": str(result["id"]), "error": result.get("error")}
+        sentiment = result.get("sentiment") or {}
+        if "score" in sentiment:
+            row["sentiment_score"] = float(sentiment["score"])
+            row["sentiment_label"] = sentiment.get("sentiment")
+        for name in AVAILABLE_ANALYSES:
+            if name in result:
+                row[name] = json.dumps(result[name], ensure_ascii=False, default=str)
+        return row
+
+    def write(self, results: List[Dict[str, Any]]) -> None:
+        part = self.checkpoint.state["parts"]
+        table = self.pa.Table.from_pylist([self._to_row(result) for result in results], schema=self.schema)
+        self.pq.write_table(table, os.path.join(self.path, f"part-{part:05d}.parquet"))
+        self.checkpoint.state["parts"] = part + 1
+
+    def close(self) -> None:
+        pass
+
+
+class ThroughputReporter:
+    def __init__(self, interval: float, start_count: int):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.last_count = start_count
+        self.start_count = start_count
+
+    def update(self, count: int, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        recent = (count - self.last_count) / max(now - self.last_report, 1e-9)
+        overall = (count - self.start_count) / max(now - self.started, 1e-9)
+        print(f"已处理 {count} 条，当前 {recent:.1f} 条/秒，平均 {overall:.1f} 条/秒", file=sys.stderr)
+        self.last_report = now
+        self.last_count = count
+
+
+def run(args) -> int:
+    analyses = [name.strip() for name in args.analyses.split(',') if name.strip()]
+    unknown = set(analyses) - set(AVAILABLE_ANALYSES)
+    if unknown:
+        print(f"不支持的分析类型: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    input_format = args.input_format or ('csv' if args.input.lower().endswith('.csv') else 'jsonl')
+    output_format = args.output_format or ('parquet' if args.output.lower().endswith('.parquet') else 'jsonl')
+
+    if output_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        print("输出Parquet需要安装pyarrow: pip install pyarrow", file=sys.stderr)
+        return 2
+
+    checkpoint = Checkpoint(args.output + '.checkpoint.json')
+    resume = args.resume and checkpoint.load()
+    if not resume and os.path.exists(args.output) and not args.overwrite:
+        print(f"输出已存在: {args.output}，使用 --resume 续跑或 --overwrite 覆盖", file=sys.stderr)
+        return 2
+
+    writer_class = ParquetWriter if output_format == 'parquet' else JsonlWriter
+    writer = writer_class(args.output, checkpoint, resume)
+    done = checkpoint.state["records_done"]
+    if resume:
+        print(f"从第 {done} 条记录继续", file=sys.stderr)
+
+    records = islice(read_records(args.input, input_format, args.text_field, args.id_field), done, None)
+    options = {
+        "analyses": analyses,
+        "use_llm": args.use_llm,
+        "top_k": args.top_k,
+        "max_length": args.max_length
+    }
+    # 在父进程中预先加载词典和情感模型，fork出的工作进程直接共享，不必各自重复加载
+    import jieba
+    from fast_sentiment import get_sentiment_scorer
+    jieba.initialize()
+    get_sentiment_scorer()
+
+    reporter = ThroughputReporter(args.report_interval, done)
+    max_inflight = args.max_inflight or args.workers * 2
+
+    def commit(results):
+        nonlocal done
+        writer.write(results)
+        done += len(results)
+        checkpoint.state["records_done"] = done
+        checkpoint.save()
+        reporter.update(done)
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(options,)) as pool:
+            pending = deque()
+            for batch in batched(records, args.batch_size):
+                pending.append(pool.submit(_analyze_batch, batch))
+                # 限制在途批次数量，保证内存占用与输入规模无关；按提交顺序写出，断点才有意义
+                while len(pending) >= max_inflight:
+                    commit(pending.popleft().result())
+            while pending:
+                commit(pending.popleft().result())
+    finally:
+        writer.close()
+
+    reporter.update(done, force=True)
+    if not args.keep_checkpoint:
+        checkpoint.remove()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="离线批量文本分析")
+    parser.add_argument('input', help="输入文件（.jsonl 或 .csv）")
+    parser.add_argument('-o', '--output', required=True, help="输出路径（.jsonl 文件或 .parquet 目录）")
+    parser.add_argument('--input-format', choices=['jsonl', 'csv'], help="输入格式，默认按扩展名判断")
+    parser.add_argument('--output-format', choices=['jsonl', 'parquet'],
+                        help="输出格式，默认按扩展名判断（parquet需要可选依赖pyarrow）")
+    parser.add_argument('--text-field', default='text', help="文本字段名")
+    parser.add_argument('--id-field', default='id', help="记录ID字段名，缺失时使用行号")
+    parser.add_argument('--analyses', default='sentiment,keywords',
+                        help=f"要运行的分析，逗号分隔，可选：{','.join(AVAILABLE_ANALYSES)}")
+    parser.add_argument('--top-k', type=int, default=10, help="关键词数量")
+    parser.add_argument('--max-length', type=int, default=200, help="摘要最大长度")
+    parser.add_argument('--use-llm', action='store_true', help="使用LLM分析（失败时回退到传统方法）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="工作进程数")
+    parser.add_argument('--batch-size', type=int, default=256, help="每批记录数")
+    parser.add_argument('--max-inflight', type=int, help="最多同时处理的批次数，默认为工作进程数的2倍")
+    parser.add_argument('--resume', action='store_true', help="从断点继续")
+    parser.add_argument('--overwrite', action='store_true', help="覆盖已存在的输出")
+    parser.add_argument('--keep-checkpoint', action='store_true', help="完成后保留断点文件")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="吞吐量报告间隔（秒）")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态时抛出，调用方应直接回退"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} 熔断中，{retry_after:.1f}秒后重试")
+
+
+class CircuitBreaker:
+    """按提供商划分的熔断器：closed -> open -> half_open -> closed"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._total_failures = 0
+        self._total_rejected = 0
+        self._last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        # 打开状态超过恢复时间后进入半开状态，允许少量试探请求
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._half_open_in_flight = 0
+        return self._state
+
+    def before_call(self) -> None:
+        """请求前调用，熔断打开时抛出CircuitOpenError"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return
+            self._total_rejected += 1
+            if state == self.OPEN:
+                retry_after = self.recovery_timeout - (time.monotonic() - self._opened_at)
+            else:
+                retry_after = self.recovery_timeout
+            raise CircuitOpenError(self.name, max(retry_after, 0.0))
+
+    def release(self) -> None:
+        """请求被取消、没有结果时调用，归还半开状态的试探名额"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            if self._state == self.HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+            self._state = self.CLOSED
+
+    def record_failure(self, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            self._total_failures += 1
+            self._last_error = error
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                # 半开试探失败或连续失败达到阈值，重新打开熔断器
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._half_open_in_flight = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self._current_state()
+            snapshot = {
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "total_failures": self._total_failures,
+                "total_rejected": self._total_rejected,
+                "last_error": self._last_error
+            }
+            if state == self.OPEN:
+                snapshot["retry_after"] = round(
+                    max(self.recovery_timeout - (time.monotonic() - self._opened_at), 0.0), 1)
+            return snapshot
+
+
+class LatencyTracker:
+    """记录最近的请求耗时，并根据延迟分位数计算自适应超时"""
+
+    def __init__(self, window: int = 200, percentile: float = 99.0, multiplier: float = 2.0,
+                 min_timeout: float = 5.0, max_timeout: float = 60.0, min_samples: int = 20):
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, elapsed: float) -> None:
+        with self._lock:
+            self._samples.append(elapsed)
+
+    def _percentile(self, samples, pct: float) -> float:
+        ordered = sorted(samples)
+        index = min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+
+    def timeout(self) -> float:
+        """样本不足时使用最大超时，否则取 分位数 × 倍数 并限制在[min, max]之间"""
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < self.min_samples:
+            return self.max_timeout
+        adaptive = self._percentile(samples, self.percentile) * self.multiplier
+        return min(max(adaptive, self.min_timeout), self.max_timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return {"samples": 0, "timeout": round(self.timeout(), 2)}
+        return {
+            "samples": len(samples),
+            "p50": round(self._percentile(samples, 50), 3),
+            "p95": round(self._percentile(samples, 95), 3),
+            "p99": round(self._percentile(samples, 99), 3),
+            "timeout": round(self.timeout(), 2)
+        }
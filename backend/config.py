@@ -9,6 +9,18 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///text_analysis.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # 数据库连接配置（SQLite）：每个连接启用WAL，写入冲突时等待而不是报错
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '15000'))  # 等待写锁的最长时间（毫秒）
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')  # OFF/NORMAL/FULL/EXTRA
+    SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))  # 每个连接的页缓存大小
+    SQLITE_WAL_AUTOCHECKPOINT = int(os.getenv('SQLITE_WAL_AUTOCHECKPOINT', '1000'))  # WAL达到多少页时合并回数据库
+    
+    # 数据库连接池配置（PostgreSQL），每个进程一个连接池
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))  # 常驻连接数
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))  # 高峰时额外允许的连接数
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))  # 等待空闲连接的最长时间（秒）
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # 连接使用多久后重建（秒）
+    
     # JWT配置
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-jwt-secret-key-here-change-this-in-production')
     JWT_ACCESS_TOKEN_EXPIRES = 24 * 60 * 60  # 24小时
@@ -20,16 +32,108 @@ class Config:
     OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
     OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'qwen2.5:7b')  # 推荐使用qwen2.5:7b或llama3.1:8b
     
+    # 文本向量配置：语义相似度和历史记录语义检索使用Ollama的 /api/embed 接口
+    EMBEDDING_PROVIDER = os.getenv('EMBEDDING_PROVIDER', 'ollama')  # ollama, none
+    OLLAMA_EMBED_MODEL = os.getenv('OLLAMA_EMBED_MODEL', 'bge-m3')  # 需要支持中文的向量模型
+    EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', './embeddings.db')  # 按内容哈希持久化的向量缓存
+    EMBEDDING_MEMORY_CACHE_SIZE = int(os.getenv('EMBEDDING_MEMORY_CACHE_SIZE', '10000'))  # 内存中缓存的向量数
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))  # 每次请求向量接口的文本数
+    EMBEDDING_INDEX_MAX_USERS = int(os.getenv('EMBEDDING_INDEX_MAX_USERS', '100'))  # 保留历史向量索引的用户数
+    EMBEDDING_EXACT_THRESHOLD = int(os.getenv('EMBEDDING_EXACT_THRESHOLD', '5000'))  # 记录数超过该值时使用LSH近似检索
+    EMBEDDING_LSH_TABLES = int(os.getenv('EMBEDDING_LSH_TABLES', '8'))
+    EMBEDDING_LSH_BITS = int(os.getenv('EMBEDDING_LSH_BITS', '12'))
+    
     # OpenAI配置（备用）
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
     OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
     
-    # 本地模型配置
+    # 本地模型配置：train_local_models.py 用历史记录训练的scikit-learn模型，支持情感和关键词
     LOCAL_MODEL_PATH = os.getenv('LOCAL_MODEL_PATH', './models')
-    LOCAL_MODEL_NAME = os.getenv('LOCAL_MODEL_NAME', 'chatglm3-6b')
+    LOCAL_MODEL_NAME = os.getenv('LOCAL_MODEL_NAME', 'sklearn-linear')
+    LOCAL_MODEL_MMAP = os.getenv('LOCAL_MODEL_MMAP', 'true').lower() == 'true'  # 以只读内存映射加载，多进程共享模型数组
+    
+    # 提示词输入预算（估算token数），超出时按整句保留开头和结尾
+    PROMPT_BUDGET_SENTIMENT = int(os.getenv('PROMPT_BUDGET_SENTIMENT', '1500'))
+    PROMPT_BUDGET_KEYWORDS = int(os.getenv('PROMPT_BUDGET_KEYWORDS', '3000'))
+    PROMPT_BUDGET_SUMMARY = int(os.getenv('PROMPT_BUDGET_SUMMARY', '6000'))
+    PROMPT_BUDGET_SIMILARITY = int(os.getenv('PROMPT_BUDGET_SIMILARITY', '3000'))  # 两段文本平分
+    PROMPT_BUDGET_DEFAULT = int(os.getenv('PROMPT_BUDGET_DEFAULT', '3000'))
+    
+    # LLM短文本批量处理：窗口期内到达的短文本情感/关键词请求合并为一次调用
+    LLM_MICRO_BATCH_ENABLED = os.getenv('LLM_MICRO_BATCH_ENABLED', 'true').lower() == 'true'
+    LLM_MICRO_BATCH_WINDOW_MS = float(os.getenv('LLM_MICRO_BATCH_WINDOW_MS', '10'))  # 收集请求的等待时间（毫秒）
+    LLM_MICRO_BATCH_MAX_ITEMS = int(os.getenv('LLM_MICRO_BATCH_MAX_ITEMS', '8'))  # 每批最多条数
+    LLM_MICRO_BATCH_MAX_CHARS = int(os.getenv('LLM_MICRO_BATCH_MAX_CHARS', '200'))  # 超过该长度的文本单独请求
+    
+    # LLM准入控制：按用户限流，超出并发的请求排队（交互优先、用户间轮转），过载时快速拒绝
+    LLM_ADMISSION_CONCURRENCY = int(os.getenv('LLM_ADMISSION_CONCURRENCY', '4'))  # 同时执行的LLM请求数
+    LLM_ADMISSION_QUEUE_SIZE = int(os.getenv('LLM_ADMISSION_QUEUE_SIZE', '100'))  # 排队请求上限
+    LLM_USER_RATE = float(os.getenv('LLM_USER_RATE', '1'))  # 每个用户每秒补充的请求额度
+    LLM_USER_BURST = float(os.getenv('LLM_USER_BURST', '20'))  # 每个用户最多积累的请求额度
+    LLM_ADMISSION_MAX_WAIT_INTERACTIVE = float(os.getenv('LLM_ADMISSION_MAX_WAIT_INTERACTIVE', '30'))  # 交互请求最长排队时间（秒）
+    LLM_ADMISSION_MAX_WAIT_BATCH = float(os.getenv('LLM_ADMISSION_MAX_WAIT_BATCH', '300'))  # 批量请求最长排队时间（秒）
+    LLM_ADMISSION_INTERACTIVE_WEIGHT = int(os.getenv('LLM_ADMISSION_INTERACTIVE_WEIGHT', '4'))  # 每调度1个批量请求最多调度的交互请求数
+    
+    # 熔断与自适应超时配置
+    LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv('LLM_BREAKER_FAILURE_THRESHOLD', '5'))  # 连续失败多少次后熔断
+    LLM_BREAKER_RECOVERY_TIMEOUT = float(os.getenv('LLM_BREAKER_RECOVERY_TIMEOUT', '30'))  # 熔断后多少秒进入半开
+    LLM_BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv('LLM_BREAKER_HALF_OPEN_MAX_CALLS', '1'))  # 半开状态允许的试探请求数
+    LLM_TIMEOUT_MIN = float(os.getenv('LLM_TIMEOUT_MIN', '5'))
+    LLM_TIMEOUT_MAX = float(os.getenv('LLM_TIMEOUT_MAX', '60'))
+    LLM_TIMEOUT_PERCENTILE = float(os.getenv('LLM_TIMEOUT_PERCENTILE', '99'))
+    LLM_TIMEOUT_MULTIPLIER = float(os.getenv('LLM_TIMEOUT_MULTIPLIER', '2.0'))
+    LLM_TIMEOUT_MIN_SAMPLES = int(os.getenv('LLM_TIMEOUT_MIN_SAMPLES', '20'))
+    
+    # 健康检查配置
+    LLM_HEALTH_INTERVAL = float(os.getenv('LLM_HEALTH_INTERVAL', '15'))  # 后台探测间隔（秒）
+    LLM_HEALTH_MODELS_INTERVAL = float(os.getenv('LLM_HEALTH_MODELS_INTERVAL', '300'))  # 模型列表刷新间隔（秒）
+    LLM_HEALTH_TIMEOUT = float(os.getenv('LLM_HEALTH_TIMEOUT', '5'))
+    
+    # 异步LLM服务配置（async_app.py）
+    ASYNC_HOST = os.getenv('ASYNC_HOST', '0.0.0.0')
+    ASYNC_PORT = int(os.getenv('ASYNC_PORT', '5003'))
+    LLM_ASYNC_MAX_CONNECTIONS = int(os.getenv('LLM_ASYNC_MAX_CONNECTIONS', '200'))  # 到LLM后端的最大并发连接数
     
     # 分析配置
     MAX_TEXT_LENGTH = int(os.getenv('MAX_TEXT_LENGTH', '10000'))
     DEFAULT_SUMMARY_LENGTH = int(os.getenv('DEFAULT_SUMMARY_LENGTH', '200'))
     DEFAULT_KEYWORDS_COUNT = int(os.getenv('DEFAULT_KEYWORDS_COUNT', '10'))
+    
+    # 分词服务配置
+    SEGMENT_WORKERS = int(os.getenv('SEGMENT_WORKERS', '0'))  # 分词进程数，0表示CPU核数
+    SEGMENT_PARALLEL_THRESHOLD = int(os.getenv('SEGMENT_PARALLEL_THRESHOLD', '20000'))  # 总字数超过该值时使用进程池
+    SEGMENT_CHUNK_SIZE = int(os.getenv('SEGMENT_CHUNK_SIZE', '5000'))  # 长文本按句子切片的目标长度
+    SEGMENT_START_METHOD = os.getenv('SEGMENT_START_METHOD', '')  # 进程启动方式（fork/spawn/forkserver），默认forkserver，不支持时spawn
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))  # 缓存的文档词ID表示数量
+    TOKEN_VOCABULARY_MAX = int(os.getenv('TOKEN_VOCABULARY_MAX', '500000'))  # 词表上限，超过后清空文档缓存并换用新词表
+    INCREMENTAL_ENABLED = os.getenv('INCREMENTAL_ENABLED', 'true').lower() == 'true'  # 按句子增量分析（保留用户上一版文本的中间结果）
+    INCREMENTAL_MAX_USERS = int(os.getenv('INCREMENTAL_MAX_USERS', '1000'))  # 保留增量分析状态的用户数
+    INCREMENTAL_MAX_SENTENCES = int(os.getenv('INCREMENTAL_MAX_SENTENCES', '2000'))  # 每个用户缓存的句子中间结果数
+    INCREMENTAL_MAX_MEMORY_MB = float(os.getenv('INCREMENTAL_MAX_MEMORY_MB', '128'))  # 增量分析状态占用内存上限
+    
+    # 分析流水线：/api/pipeline 中相互独立的阶段并发执行
+    PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '8'))  # 执行流水线传统阶段的线程数
+    PIPELINE_LLM_WORKERS = int(os.getenv('PIPELINE_LLM_WORKERS', '4'))  # 执行流水线LLM阶段的线程数（同时进行的LLM调用上限）
+    
+    # 租户词典配置：每个租户一个目录，包含userdict.txt（jieba用户词典格式）和stopwords.txt
+    TENANT_DICT_DIR = os.getenv('TENANT_DICT_DIR', './tenant_dicts')
+    TENANT_DICT_MAX_TENANTS = int(os.getenv('TENANT_DICT_MAX_TENANTS', '32'))  # 同时驻留内存的租户数
+    TENANT_DICT_MAX_MEMORY_MB = float(os.getenv('TENANT_DICT_MAX_MEMORY_MB', '256'))  # 租户词典占用内存上限
+    
+    # 分析接口响应整形：fields参数投影字段，超过阈值的响应按Accept-Encoding压缩
+    RESPONSE_FAST_JSON = os.getenv('RESPONSE_FAST_JSON', 'true').lower() == 'true'  # 安装了orjson时使用它序列化
+    RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', '1024'))  # 小于该大小的响应不压缩
+    RESPONSE_GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', '6'))
+    RESPONSE_BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', '4'))  # 需要安装brotli
+    
+    # 导出配置
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '500'))  # 导出时每批从数据库读取的行数
+    
+    # 冷数据归档：超过指定天数的分析记录移到压缩的归档段文件，历史、导出和统计接口仍可查询
+    ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'false').lower() == 'true'  # 默认关闭，启用后旧记录会移出数据库
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', './archive')
+    ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '90'))  # 记录保留在热表中的天数
+    ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', '3600'))  # 后台归档任务的运行间隔（秒）
+    ARCHIVE_SEGMENT_RECORDS = int(os.getenv('ARCHIVE_SEGMENT_RECORDS', '20000'))  # 每个归档段最多记录数
+    ARCHIVE_BLOCK_RECORDS = int(os.getenv('ARCHIVE_BLOCK_RECORDS', '256'))  # 每个压缩块的记录数
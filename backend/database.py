@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库连接配置
+- SQLite：每个连接启用WAL日志、设置同步级别和忙等待超时，读写不再互相阻塞，
+  并发写入时排队等待而不是立即报 "database is locked"
+- PostgreSQL：使用连接池，池大小、溢出连接数、获取超时和连接回收时间由Config配置
+
+直接运行时对当前DATABASE_URL做并发写入检查（tests/test_database.py 在SQLite和PostgreSQL上自动运行）：
+    python database.py --threads 16 --writes 50
+"""
+
+import logging
+import sqlite3
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SQLITE_SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def normalize_database_url(url: str) -> str:
+    """部分托管平台提供postgres://开头的地址，SQLAlchemy只识别postgresql://"""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def engine_options(url: str, config: Optional[Config] = None) -> Dict[str, Any]:
+    """按数据库类型返回SQLALCHEMY_ENGINE_OPTIONS"""
+    config = config or Config()
+    if is_sqlite(url):
+        # SQLite使用默认的连接池；连接参数中的timeout是驱动层的锁等待时间，与busy_timeout一致
+        return {"connect_args": {"timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        # 取出连接时先检查是否可用，数据库重启后不会把失效连接交给请求
+        "pool_pre_ping": True,
+    }
+
+
+def sqlite_pragmas(config: Optional[Config] = None) -> Dict[str, Any]:
+    """每个SQLite连接执行的PRAGMA"""
+    config = config or Config()
+    synchronous = config.SQLITE_SYNCHRONOUS.upper()
+    if synchronous not in SQLITE_SYNCHRONOUS_LEVELS:
+        logger.warning(f"无效的SQLITE_SYNCHRONOUS: {config.SQLITE_SYNCHRONOUS}，使用NORMAL")
+        synchronous = 'NORMAL'
+    return {
+        # WAL模式下读不阻塞写、写不阻塞读，写入只在提交时追加日志
+        "journal_mode": "WAL",
+        # WAL模式下NORMAL不会损坏数据库，只在断电时可能丢失最近提交的事务
+        "synchronous": synchronous,
+        "busy_timeout": config.SQLITE_BUSY_TIMEOUT_MS,
+        "temp_store": "MEMORY",
+        # 负数表示KiB
+        "cache_size": -config.SQLITE_CACHE_SIZE_KB,
+        "wal_autocheckpoint": config.SQLITE_WAL_AUTOCHECKPOINT,
+    }
+
+
+_listener_installed = False
+
+
+def install_sqlite_pragmas(config: Optional[Config] = None) -> None:
+    """为所有SQLite连接注册PRAGMA设置，重复调用只注册一次"""
+    global _listener_installed
+    if _listener_installed:
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(Engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if name == 'journal_mode':
+                    mode = cursor.execute(f"PRAGMA journal_mode={value}").fetchone()[0]
+                    # 内存数据库不支持WAL，返回memory
+                    if mode.upper() != value:
+                        logger.debug(f"SQLite journal_mode为{mode}")
+                else:
+                    cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    _listener_installed = True
+
+
+def configure_app(app, config: Optional[Config] = None) -> None:
+    """在创建SQLAlchemy(app)之前调用：规范化数据库地址并设置引擎参数"""
+    config = config or Config()
+    url = normalize_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    options = engine_options(url, config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    if is_sqlite(url):
+        install_sqlite_pragmas(config)
+
+
+def ensure_indexes(engine: Engine, metadata) -> None:
+    """create_all不会给已存在的表补建索引，启动时补建模型中新增的索引"""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def check_concurrent_writes(url: str, threads: int = 16, writes: int = 50) -> Dict[str, Any]:
+    """多个线程同时逐条插入并提交，统计失败数和耗时，用于在SQLite和PostgreSQL上验证配置"""
+    import threading
+    import time
+    from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, func, select
+
+    url = normalize_database_url(url)
+    if is_sqlite(url):
+        install_sqlite_pragmas()
+    options = engine_options(url)
+    if not is_sqlite(url):
+        options["pool_size"] = max(options["pool_size"], threads)
+    engine = create_engine(url, **options)
+    metadata = MetaData()
+    table = Table('concurrency_check', metadata,
+                  Column('id', Integer, primary_key=True),
+                  Column('worker', Integer, nullable=False),
+                  Column('payload', String(200), nullable=False))
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    errors = []
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(index: int) -> None:
+        for i in range(writes):
+            started = time.perf_counter()
+            try:
+                with engine.begin() as connection:
+                    connection.execute(table.insert().values(worker=index, payload=f"{index}-{i}"))
+            except Exception as e:
+                with lock:
+                    errors.append(str(e).splitlines()[0])
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with engine.connect() as connection:
+        rows = connection.execute(select(func.count()).select_from(table)).scalar()
+        journal_mode = (connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+                        if is_sqlite(url) else None)
+    metadata.drop_all(engine)
+    engine.dispose()
+
+    latencies.sort()
+    return {
+        "backend": make_url(url).get_backend_name(),
+        "journal_mode": journal_mode,
+        "writes": threads * writes,
+        "rows": rows,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "elapsed": round(elapsed, 3),
+        "writes_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0,
+        "p99_latency_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2) if latencies else None,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='并发写入检查')
+    parser.add_argument('--url', default=Config.SQLALCHEMY_DATABASE_URI, help='数据库地址，默认使用DATABASE_URL')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=50, help='每个线程的写入次数')
+    args = parser.parse_args()
+
+    result = check_concurrent_writes(args.url, args.threads, args.writes)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    raise SystemExit(1 if result["errors"] or result["rows"] != result["writes"] else 0)
@@ -0,0 +1,303 @@
+"""
+文本向量：持久化的向量缓存和进程内近似最近邻索引
+向量按(模型, 文本内容哈希)缓存在本地SQLite文件中，同一段文本只请求一次向量接口；
+每个用户的历史记录在首次语义检索时建立索引，之后只为新增记录补充向量。
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingError(RuntimeError):
+    """向量接口不可用或返回了无法解析的结果"""
+
+
+def content_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2归一化，归一化后内积即余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingCache:
+    """按内容哈希缓存向量：内存LRU在前，SQLite文件持久化（多个进程可共享同一个文件）"""
+
+    def __init__(self, path: str, memory_size: int = 10000):
+        self.path = path
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=15)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, "
+                "vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [content_key(model, text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+        pending = list(dict.fromkeys(key for key in keys if key not in found))
+        loaded: Dict[str, np.ndarray] = {}
+        connection = self._connection()
+        # SQLite单条语句的参数个数有限制，分批查询
+        for start in range(0, len(pending), 500):
+            batch = pending[start:start + 500]
+            rows = connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for key, blob in rows:
+                loaded[key] = np.frombuffer(blob, dtype=np.float32)
+        with self._lock:
+            for key, vector in loaded.items():
+                self._remember(key, vector)
+            for key in keys:
+                if key in found:
+                    self.hits += 1
+                elif key in loaded:
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+        found.update(loaded)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: np.ndarray) -> None:
+        rows = []
+        now = time.time()
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                vector = np.ascontiguousarray(vector, dtype=np.float32)
+                key = content_key(model, text)
+                self._remember(key, vector)
+                rows.append((key, model, len(vector), vector.tobytes(), now))
+        connection = self._connection()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None
+            }
+
+
+class VectorIndex:
+    """余弦相似度的近似最近邻索引
+    随机超平面LSH：每张表用bits个超平面把向量映射为哈希码，任一张表中与查询的哈希码相同或只差一位的记录作为候选，
+    候选再按精确内积排序。比较哈希码只需要整数运算，比计算全部内积便宜得多；记录数不超过exact_threshold时直接计算全部内积。
+    删除只做标记，已删除的行超过compact_ratio时压缩数组，回收空间。"""
+
+    def __init__(self, dim: int, tables: int = 8, bits: int = 12, exact_threshold: int = 5000, seed: int = 0,
+                 compact_ratio: float = 0.5):
+        self.dim = dim
+        self.bits = bits
+        self.exact_threshold = exact_threshold
+        self.compact_ratio = compact_ratio
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables, bits, dim)).astype(np.float32)
+        self._weights = (1 << np.arange(bits)).astype(np.int64)
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._ids: List[int] = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._codes_store = np.zeros((tables, 0), dtype=np.int64)
+        self._positions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        """(tables, n)的哈希码"""
+        signs = np.einsum('tbd,nd->tnb', self.planes, vectors) > 0
+        return signs.astype(np.int64) @ self._weights
+
+    def _reserve(self, count: int) -> None:
+        needed = self._size + count
+        if needed <= len(self._vectors):
+            return
+        capacity = max(needed, 2 * len(self._vectors), 64)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        codes = np.zeros((len(self.planes), capacity), dtype=np.int64)
+        codes[:, :self._size] = self._codes_store[:, :self._size]
+        self._vectors, self._alive, self._codes_store = vectors, alive, codes
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> None:
+        """vectors需已归一化；已存在的ID先删除再加入"""
+        if len(ids) == 0:
+            return
+        self.remove(ids)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self._reserve(len(ids))
+        start = self._size
+        self._vectors[start:start + len(ids)] = vectors
+        self._alive[start:start + len(ids)] = True
+        self._codes_store[:, start:start + len(ids)] = self._codes(vectors)
+        for offset, item_id in enumerate(ids):
+            self._ids.append(item_id)
+            self._positions[item_id] = start + offset
+        self._size += len(ids)
+
+    def remove(self, ids: Iterable[int]) -> None:
+        """标记删除，查询时按_alive过滤；已删除的行占比超过compact_ratio时压缩"""
+        for item_id in ids:
+            position = self._positions.pop(item_id, None)
+            if position is not None:
+                self._alive[position] = False
+        dead = self._size - len(self._positions)
+        if dead >= 64 and dead > self.compact_ratio * self._size:
+            self._compact()
+
+    def _compact(self) -> None:
+        """只保留未删除的行，按原顺序重新编号"""
+        keep = np.flatnonzero(self._alive[:self._size])
+        self._vectors = self._vectors[keep]
+        self._codes_store = self._codes_store[:, keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._ids = [self._ids[position] for position in keep]
+        self._positions = {item_id: position for position, item_id in enumerate(self._ids)}
+        self._size = len(keep)
+
+    def _candidates(self, query: np.ndarray) -> np.ndarray:
+        diff = self._codes_store[:, :self._size] ^ self._codes(query[None, :])
+        # 汉明距离不超过1：异或结果为0或只有一位为1
+        near = ((diff & (diff - 1)) == 0).any(axis=0)
+        return np.flatnonzero(near & self._alive[:self._size])
+
+    def search(self, query: np.ndarray, k: int = 10) -> List[Tuple[int, float]]:
+        """返回[(ID, 余弦相似度)]，按相似度从高到低"""
+        if not self._positions or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        if len(self._positions) <= self.exact_threshold:
+            candidates = np.flatnonzero(self._alive[:self._size])
+        else:
+            candidates = self._candidates(query)
+            if len(candidates) < k:
+                # 候选不足时退回全量计算，保证返回k条
+                candidates = np.flatnonzero(self._alive[:self._size])
+        scores = self._vectors[candidates] @ query
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self._ids[candidates[i]], float(scores[i])) for i in top]
+
+
+class _UserIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index: Optional[VectorIndex] = None
+        self.synced_id = 0
+
+
+class SemanticSearch:
+    """按用户维护历史记录的向量索引，最多保留max_users个用户的索引（LRU）
+    embed把文本列表转换为归一化向量；load_rows(user_id, after_id)返回ID大于after_id的(ID, 文本)"""
+
+    def __init__(self, embed: Callable[[Sequence[str]], np.ndarray], max_users: int = 100,
+                 batch_size: int = 256, **index_options):
+        self.embed = embed
+        self.max_users = max_users
+        self.batch_size = batch_size
+        self.index_options = index_options
+        self._users: "OrderedDict[int, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user(self, user_id: int) -> _UserIndex:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = _UserIndex()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return entry
+
+    def _sync(self, user_id: int, entry: _UserIndex,
+              load_rows: Callable[[int, int], Sequence[Tuple[int, str]]]) -> None:
+        rows = load_rows(user_id, entry.synced_id)
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            vectors = self.embed([text for _, text in batch])
+            if entry.index is None:
+                entry.index = VectorIndex(vectors.shape[1], **self.index_options)
+            entry.index.add([row_id for row_id, _ in batch], vectors)
+            entry.synced_id = batch[-1][0]
+
+    def search(self, user_id: int, query: str, k: int,
+               load_rows: Callable[[int, int], Sequence[Tuple[int, str]]]) -> List[Tuple[int, float]]:
+        """先为新增的历史记录补充向量，再检索与query最相似的k条"""
+        entry = self._user(user_id)
+        with entry.lock:
+            self._sync(user_id, entry, load_rows)
+            if entry.index is None:
+                return []
+            return entry.index.search(self.embed([query])[0], k)
+
+    def discard(self, ids: Iterable[int]) -> None:
+        """记录被归档或删除后从所有已加载的索引中移除"""
+        ids = list(ids)
+        with self._lock:
+            entries = list(self._users.values())
+        for entry in entries:
+            with entry.lock:
+                if entry.index is not None:
+                    entry.index.remove(ids)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = list(self._users.values())
+        return {
+            "users": len(entries),
+            "vectors": sum(len(entry.index) for entry in entries if entry.index is not None)
+        }
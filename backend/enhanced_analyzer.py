@@ -1,9 +1,16 @@
+import asyncio
+import functools
 import jieba
 import jieba.analyse
 import numpy as np
-from snownlp import SnowNLP
-from typing import Dict, Any, Optional
+from fast_sentiment import get_sentiment_scorer
+from typing import Dict, Any, List, Optional
+from admission import AdmissionRejected
 from llm_service import LLMService
+from segmentation import get_segmenter, textrank_from_pairs, tfidf_from_tokens
+from tenant_dictionaries import get_tenant_registry
+from token_ids import get_document_cache, cosine_similarity, jaccard_similarity
+from incremental import get_incremental_analyzer
 from config import Config
 
 class EnhancedTextAnalyzer:
@@ -28,8 +35,9 @@ class EnhancedTextAnalyzer:
         # 回退到传统方法
         return self._traditional_sentiment_analysis(text)
     
-    def extract_keywords(self, text: str, top_k: int = 10, use_llm: Optional[bool] = None) -> Dict[str, Any]:
-        """关键词提取 - 支持LLM和传统方法"""
+    def extract_keywords(self, text: str, top_k: int = 10, use_llm: Optional[bool] = None,
+                         tenant: Optional[str] = None) -> Dict[str, Any]:
+        """关键词提取 - 支持LLM和传统方法，tenant指定使用的租户词典"""
         if use_llm is None:
             use_llm = self.use_llm
             
@@ -40,7 +48,7 @@ class EnhancedTextAnalyzer:
                 return result
         
         # 回退到传统方法
-        return self._traditional_keywords_extraction(text, top_k)
+        return self._traditional_keywords_extraction(text, top_k, tenant)
     
     def generate_summary(self, text: str, max_length: int = 200, use_llm: Optional[bool] = None) -> Dict[str, Any]:
         """文本摘要生成 - 支持LLM和传统方法"""
@@ -57,32 +65,35 @@ class EnhancedTextAnalyzer:
         return self._traditional_summary_generation(text, max_length)
     
     def calculate_similarity(self, text1: str, text2: str, use_llm: Optional[bool] = None) -> Dict[str, Any]:
-        """计算文本相似度 - 支持LLM和传统方法"""
+        """计算文本相似度 - 支持向量和传统方法"""
         if use_llm is None:
             use_llm = self.use_llm
             
         if use_llm:
-            # 使用LLM进行分析
-            result = self.llm_service.analyze_text(text1, 'similarity', text2=text2)
+            # 比较两段文本的向量（按内容缓存），不调用生成接口
+            result = self.llm_service.embedding_similarity(text1, text2)
             if 'error' not in result:
                 return result
         
         # 回退到传统方法
         return self._traditional_similarity_calculation(text1, text2)
     
-    def advanced_analysis(self, text: str) -> Dict[str, Any]:
+    def advanced_analysis(self, text: str, tenant: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
         """高级文本分析 - 结合多种方法"""
         try:
+            # 关键词和主题共用同一个TextRank共现图
+            ranking = self._textrank_ranking(text, tenant)
+            
             # 基础分析
             sentiment = self.sentiment_analysis(text, use_llm=False)
-            keywords = self.extract_keywords(text, use_llm=False)
+            keywords = self._traditional_keywords_extraction(text, 10, tenant, ranking)
             summary = self.generate_summary(text, use_llm=False)
             
             # 文本统计
-            stats = self._calculate_text_stats(text)
+            stats = self._calculate_text_stats(text, tenant, user_id)
             
             # 主题分析
-            topics = self._extract_topics(text)
+            topics = self._extract_topics(text, tenant, ranking)
             
             return {
                 "sentiment": sentiment,
@@ -118,20 +129,25 @@ class EnhancedTextAnalyzer:
                 # 单一分析
                 return self.llm_service.analyze_text(text, analysis_type, **kwargs)
                 
+        except AdmissionRejected:
+            # 未获准入时由路由返回429/503，不当作分析失败
+            raise
         except Exception as e:
             return {"error": f"LLM分析失败: {str(e)}"}
     
-    def hybrid_analysis(self, text: str, **kwargs) -> Dict[str, Any]:
+    def hybrid_analysis(self, text: str, tenant: Optional[str] = None, user_id: Optional[int] = None, **kwargs) -> Dict[str, Any]:
         """混合分析 - 结合LLM和传统方法"""
         try:
             # 传统方法分析
-            traditional_result = self.advanced_analysis(text)
+            traditional_result = self.advanced_analysis(text, tenant, user_id)
             
             # LLM分析（如果可用）
             llm_result = {}
             if self.use_llm:
                 try:
                     llm_result = self.llm_analysis(text, 'comprehensive', **kwargs)
+                except AdmissionRejected:
+                    raise
                 except Exception as e:
                     llm_result = {"error": f"LLM分析失败: {str(e)}"}
             
@@ -141,35 +157,168 @@ class EnhancedTextAnalyzer:
                 "analysis_method": "hybrid",
                 "recommendation": self._generate_recommendation(traditional_result, llm_result)
             }
+        except AdmissionRejected:
+            raise
         except Exception as e:
             return {"error": f"混合分析失败: {str(e)}"}
     
-    # 传统方法实现
-    def _traditional_sentiment_analysis(self, text: str) -> Dict[str, Any]:
-        """传统情感分析"""
+    # 异步接口：LLM调用在事件循环中等待，CPU密集的传统方法放到线程池执行
+    async def _run_blocking(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+    
+    async def sentiment_analysis_async(self, text: str, use_llm: Optional[bool] = None) -> Dict[str, Any]:
+        """异步情感分析"""
+        if use_llm is None:
+            use_llm = self.use_llm
+            
+        if use_llm:
+            result = await self.llm_service.analyze_text_async(text, 'sentiment')
+            if 'error' not in result:
+                return result
+        
+        return await self._run_blocking(self._traditional_sentiment_analysis, text)
+    
+    async def extract_keywords_async(self, text: str, top_k: int = 10, use_llm: Optional[bool] = None,
+                                     tenant: Optional[str] = None) -> Dict[str, Any]:
+        """异步关键词提取"""
+        if use_llm is None:
+            use_llm = self.use_llm
+            
+        if use_llm:
+            result = await self.llm_service.analyze_text_async(text, 'keywords', top_k=top_k)
+            if 'error' not in result:
+                return result
+        
+        return await self._run_blocking(self._traditional_keywords_extraction, text, top_k, tenant)
+    
+    async def generate_summary_async(self, text: str, max_length: int = 200, use_llm: Optional[bool] = None) -> Dict[str, Any]:
+        """异步文本摘要生成"""
+        if use_llm is None:
+            use_llm = self.use_llm
+            
+        if use_llm:
+            result = await self.llm_service.analyze_text_async(text, 'summary', max_length=max_length)
+            if 'error' not in result:
+                return result
+        
+        return await self._run_blocking(self._traditional_summary_generation, text, max_length)
+    
+    async def llm_analysis_async(self, text: str, analysis_type: str = 'comprehensive', **kwargs) -> Dict[str, Any]:
+        """异步纯LLM分析，综合分析的三个请求并发执行"""
+        if not self.use_llm:
+            return {"error": "LLM服务未启用"}
+        
+        try:
+            if analysis_type == 'comprehensive':
+                sentiment, keywords, summary = await asyncio.gather(
+                    self.llm_service.analyze_text_async(text, 'sentiment'),
+                    self.llm_service.analyze_text_async(text, 'keywords', **kwargs),
+                    self.llm_service.analyze_text_async(text, 'summary', **kwargs)
+                )
+                
+                return {
+                    "sentiment": sentiment,
+                    "keywords": keywords,
+                    "summary": summary,
+                    "analysis_method": "llm",
+                    "provider": self.config.LLM_PROVIDER
+                }
+            else:
+                return await self.llm_service.analyze_text_async(text, analysis_type, **kwargs)
+                
+        except AdmissionRejected:
+            # 未获准入时由路由返回429/503，不当作分析失败
+            raise
+        except Exception as e:
+            return {"error": f"LLM分析失败: {str(e)}"}
+    
+    async def hybrid_analysis_async(self, text: str, tenant: Optional[str] = None, user_id: Optional[int] = None,
+                                    **kwargs) -> Dict[str, Any]:
+        """异步混合分析，传统分析与LLM分析同时进行"""
         try:
-            s = SnowNLP(text)
-            sentiment_score = s.sentiments
-            if sentiment_score > 0.6:
-                sentiment = "积极"
-            elif sentiment_score < 0.4:
-                sentiment = "消极"
+            traditional_task = self._run_blocking(self.advanced_analysis, text, tenant, user_id)
+            if self.use_llm:
+                traditional_result, llm_result = await asyncio.gather(
+                    traditional_task,
+                    self.llm_analysis_async(text, 'comprehensive', **kwargs),
+                    return_exceptions=True
+                )
+                if isinstance(traditional_result, Exception):
+                    raise traditional_result
+                if isinstance(llm_result, AdmissionRejected):
+                    raise llm_result
+                if isinstance(llm_result, Exception):
+                    llm_result = {"error": f"LLM分析失败: {str(llm_result)}"}
             else:
-                sentiment = "中性"
+                traditional_result, llm_result = await traditional_task, {}
+            
             return {
-                "sentiment": sentiment,
-                "score": round(sentiment_score, 3),
-                "confidence": "高" if abs(sentiment_score - 0.5) > 0.2 else "中",
-                "method": "traditional"
+                "traditional": traditional_result,
+                "llm": llm_result,
+                "analysis_method": "hybrid",
+                "recommendation": self._generate_recommendation(traditional_result, llm_result)
             }
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            return {"error": f"混合分析失败: {str(e)}"}
+    
+    # 传统方法实现
+    def _traditional_sentiment_analysis(self, text: str) -> Dict[str, Any]:
+        """传统情感分析"""
+        try:
+            # 复用常驻内存的向量化模型，结果与SnowNLP(text).sentiments一致
+            return self._describe_sentiment(get_sentiment_scorer().score(text))
         except Exception as e:
             return {"error": str(e)}
     
-    def _traditional_keywords_extraction(self, text: str, top_k: int) -> Dict[str, Any]:
-        """传统关键词提取"""
+    def batch_sentiment_analysis(self, texts: List[str], use_llm: bool = False) -> List[Dict[str, Any]]:
+        """批量情感分析，一次向量化计算所有文本的得分；use_llm时先批量调用LLM（本地模型同样向量化），失败的条目回退到传统方法"""
+        if use_llm:
+            results = self.llm_service.analyze_many(texts, 'sentiment')
+            failed = [i for i, result in enumerate(results) if 'error' in result]
+            if failed:
+                for i, result in zip(failed, self.batch_sentiment_analysis([texts[i] for i in failed])):
+                    results[i] = result
+            return results
+        try:
+            scores = get_sentiment_scorer().score_texts(texts)
+            return [self._describe_sentiment(float(score)) for score in scores]
+        except Exception as e:
+            return [{"error": str(e)} for _ in texts]
+    
+    def _describe_sentiment(self, sentiment_score: float) -> Dict[str, Any]:
+        """把情感得分转换为分析结果"""
+        if sentiment_score > 0.6:
+            sentiment = "积极"
+        elif sentiment_score < 0.4:
+            sentiment = "消极"
+        else:
+            sentiment = "中性"
+        return {
+            "sentiment": sentiment,
+            "score": round(sentiment_score, 3),
+            "confidence": "高" if abs(sentiment_score - 0.5) > 0.2 else "中",
+            "method": "traditional"
+        }
+    
+    def _textrank_ranking(self, text: str, tenant: Optional[str] = None) -> List[tuple]:
+        """完整的TextRank排序，按不同的topK截取即可得到关键词和主题"""
+        entry = get_tenant_registry().get(tenant)
+        pairs = get_segmenter().segment(text, pos=True, tenant=tenant)
+        return textrank_from_pairs(pairs, None, entry.textrank if entry else None)
+    
+    def _traditional_keywords_extraction(self, text: str, top_k: int, tenant: Optional[str] = None,
+                                         ranking: Optional[List[tuple]] = None) -> Dict[str, Any]:
+        """传统关键词提取，ranking为已计算的TextRank完整排序"""
         try:
-            keywords_tfidf = jieba.analyse.extract_tags(text, topK=top_k, withWeight=True)
-            keywords_textrank = jieba.analyse.textrank(text, topK=top_k, withWeight=True)
+            entry = get_tenant_registry().get(tenant)
+            stop_words = entry.stop_words if entry else None
+            keywords_tfidf = tfidf_from_tokens(get_segmenter().segment(text, tenant=tenant), top_k, stop_words)
+            if ranking is None:
+                ranking = self._textrank_ranking(text, tenant)
+            keywords_textrank = ranking[:top_k]
             
             return {
                 "tfidf_keywords": [{"word": word, "weight": round(weight, 3)} for word, weight in keywords_tfidf],
@@ -202,38 +351,29 @@ class EnhancedTextAnalyzer:
     def _traditional_similarity_calculation(self, text1: str, text2: str) -> Dict[str, Any]:
         """传统文本相似度计算"""
         try:
-            text1_lower = ''.join(c for c in text1.lower() if c.isalnum() or c == ' ')
-            text2_lower = ''.join(c for c in text2.lower() if c.isalnum() or c == ' ')
-
-            words1 = text1_lower.split()
-            words2 = text2_lower.split()
-
-            all_words = set(words1 + words2)
-            vector1 = [words1.count(word) for word in all_words]
-            vector2 = [words2.count(word) for word in all_words]
-
-            dot_product = sum(a * b for a, b in zip(vector1, vector2))
-            norm_a = np.sqrt(sum(a**2 for a in vector1))
-            norm_b = np.sqrt(sum(b**2 for b in vector2))
+            doc1, doc2 = get_document_cache().get_many([text1, text2])
 
-            if norm_a == 0 or norm_b == 0:
+            if doc1.norm == 0 or doc2.norm == 0:
                 return {"similarity_score": 0.0, "similarity_percentage": 0.0, "interpretation": "无法计算相似度", "method": "traditional"}
 
-            cosine_sim = dot_product / (norm_a * norm_b)
+            cosine_sim = cosine_similarity(doc1, doc2)
             
             return {
                 "similarity_score": round(cosine_sim, 3),
                 "similarity_percentage": round(cosine_sim * 100, 1),
+                "word_overlap": round(jaccard_similarity(doc1, doc2), 3),
                 "interpretation": "高度相似" if cosine_sim > 0.8 else "中度相似" if cosine_sim > 0.5 else "低度相似",
                 "method": "traditional"
             }
         except Exception as e:
             return {"error": str(e)}
     
-    def _calculate_text_stats(self, text: str) -> Dict[str, Any]:
-        """计算文本统计信息"""
+    def _calculate_text_stats(self, text: str, tenant: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """计算文本统计信息，指定user_id时只对修改过的句子重新分词"""
         try:
-            words = jieba.lcut(text)
+            if user_id is not None:
+                return get_incremental_analyzer().text_stats(user_id, text, tenant)
+            words = get_segmenter().segment(text, tenant=tenant)
             sentences = text.split('。')
             sentences = [s for s in sentences if s.strip()]
             
@@ -247,11 +387,14 @@ class EnhancedTextAnalyzer:
         except Exception as e:
             return {"error": str(e)}
     
-    def _extract_topics(self, text: str) -> Dict[str, Any]:
+    def _extract_topics(self, text: str, tenant: Optional[str] = None,
+                        ranking: Optional[List[tuple]] = None) -> Dict[str, Any]:
         """提取主题信息"""
         try:
             # 使用TextRank提取主题词
-            topics = jieba.analyse.textrank(text, topK=5, withWeight=True)
+            if ranking is None:
+                ranking = self._textrank_ranking(text, tenant)
+            topics = ranking[:5]
             
             return {
                 "main_topics": [{"topic": topic, "weight": round(weight, 3)} for topic, weight in topics],
@@ -296,6 +439,10 @@ class EnhancedTextAnalyzer:
         return {
             "analyzer_status": "healthy",
             "llm_status": self.llm_service.health_check(),
+            "circuit_breakers": self.llm_service.breaker_status(),
+            "prompt_usage": self.llm_service.prompt_usage.snapshot(),
+            "micro_batch": self.llm_service.micro_batch_stats(),
+            "admission": self.llm_service.admission.stats(),
             "use_llm": self.use_llm,
             "provider": self.config.LLM_PROVIDER
         }
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于NumPy的批量情感打分
+把SnowNLP训练好的朴素贝叶斯情感模型一次性加载为词表索引和对数概率矩阵，
+对分词后的文本做向量化打分，结果与 SnowNLP(text).sentiments 一致。
+"""
+
+import threading
+from math import log
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from snownlp import sentiment as snownlp_sentiment
+
+
+class BatchSentimentScorer:
+    """SnowNLP情感模型的向量化实现"""
+
+    def __init__(self, classifier: Optional[snownlp_sentiment.Sentiment] = None):
+        self.classifier = classifier or snownlp_sentiment.classifier
+        bayes = self.classifier.classifier
+
+        self.classes = sorted(bayes.d.keys())
+        if 'pos' not in self.classes:
+            raise ValueError("情感模型中缺少pos类别")
+        self.pos_index = self.classes.index('pos')
+
+        # 词表：所有类别出现过的词，最后一个位置留给未登录词
+        words = sorted(set().union(*(bayes.d[k].d.keys() for k in self.classes)))
+        self.vocab: Dict[str, int] = {word: i for i, word in enumerate(words)}
+        self.oov_id = len(words)
+
+        # log_prob[c, i] = log(P(word_i | c))，与AddOneProb.freq一致（未登录词计数为none）
+        self.log_prob = np.empty((len(self.classes), len(words) + 1), dtype=np.float64)
+        for c, k in enumerate(self.classes):
+            prob = bayes.d[k]
+            counts = np.fromiter((prob.d.get(word, prob.none) for word in words), dtype=np.float64, count=len(words))
+            self.log_prob[c, :-1] = np.log(counts) - log(prob.total)
+            self.log_prob[c, -1] = log(prob.none) - log(prob.total)
+        self.log_prior = np.array([log(bayes.d[k].getsum()) - log(bayes.total) for k in self.classes])
+
+    def tokenize(self, text: str) -> List[str]:
+        """与SnowNLP情感模型相同的预处理：分词并去除停用词"""
+        return self.classifier.handle(text)
+
+    def encode(self, tokens: Iterable[str]) -> np.ndarray:
+        vocab = self.vocab
+        oov_id = self.oov_id
+        return np.fromiter((vocab.get(token, oov_id) for token in tokens), dtype=np.int32)
+
+    def score_ids(self, docs: Sequence[np.ndarray]) -> np.ndarray:
+        """对已编码的文档批量打分，返回积极概率"""
+        if not docs:
+            return np.empty(0, dtype=np.float64)
+        lengths = np.fromiter((len(doc) for doc in docs), dtype=np.int64, count=len(docs))
+        ids = np.concatenate(docs) if lengths.sum() else np.empty(0, dtype=np.int32)
+        doc_index = np.repeat(np.arange(len(docs)), lengths)
+
+        # 每个类别的对数似然：按文档对词的对数概率求和
+        log_likelihood = np.stack([
+            np.bincount(doc_index, weights=self.log_prob[c, ids], minlength=len(docs))
+            for c in range(len(self.classes))
+        ])
+        return self.positive_probability(log_likelihood)
+
+    def log_likelihood(self, ids: np.ndarray) -> np.ndarray:
+        """单个文档（或句子）各类别的对数似然，不含先验；多个句子的结果可直接相加"""
+        return self.log_prob[:, ids].sum(axis=1)
+
+    def positive_probability(self, log_likelihood: np.ndarray) -> np.ndarray:
+        """由各类别对数似然（类别×文档，或单个文档的一维数组）计算积极概率"""
+        logits = log_likelihood + (self.log_prior if log_likelihood.ndim == 1 else self.log_prior[:, None])
+        # P(pos) = 1 / Σ_k exp(logit_k - logit_pos)，溢出时概率为0，与SnowNLP的处理相同
+        with np.errstate(over='ignore'):
+            return 1.0 / np.exp(logits - logits[self.pos_index]).sum(axis=0)
+
+    def score_tokens(self, docs: Sequence[Sequence[str]]) -> np.ndarray:
+        """对分词后的文档批量打分"""
+        return self.score_ids([self.encode(doc) for doc in docs])
+
+    def score_texts(self, texts: Sequence[str]) -> np.ndarray:
+        """对原始文本批量打分"""
+        return self.score_tokens([self.tokenize(text) for text in texts])
+
+    def score(self, text: str) -> float:
+        return float(self.score_texts([text])[0])
+
+
+_scorer: Optional[BatchSentimentScorer] = None
+_scorer_lock = threading.Lock()
+
+
+def get_sentiment_scorer() -> BatchSentimentScorer:
+    """进程内共享的打分器，首次使用时加载模型"""
+    global _scorer
+    if _scorer is None:
+        with _scorer_lock:
+            if _scorer is None:
+                _scorer = BatchSentimentScorer()
+    return _scorer
+
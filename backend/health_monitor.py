@@ -0,0 +1,120 @@
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """后台定时探测LLM服务状态，健康检查接口直接返回最近一次的结果"""
+
+    def __init__(self, probe: Callable[[], Dict[str, Any]], fetch_models: Callable[[], Optional[List[Dict[str, Any]]]],
+                 interval: float = 15.0, models_interval: float = 300.0, window: int = 50):
+        self.probe = probe
+        self.fetch_models = fetch_models
+        self.interval = interval
+        self.models_interval = models_interval
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._latencies = deque(maxlen=window)
+
+        self._state: Dict[str, Any] = {"status": "unknown"}
+        self._checked_at: Optional[float] = None
+        self._checked_at_wall: Optional[datetime] = None
+        self._consecutive_failures = 0
+
+        self._models: List[Dict[str, Any]] = []
+        self._models_fingerprint = None
+        self._models_fetched_at = 0.0
+        self._models_updated_at: Optional[datetime] = None
+
+    def start(self) -> None:
+        """启动后台探测线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='llm-health-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def refresh(self) -> None:
+        """执行一次探测并更新缓存状态"""
+        start = time.monotonic()
+        try:
+            state = self.probe()
+        except Exception as e:
+            state = {"status": "error", "error": str(e)}
+        elapsed = time.monotonic() - start
+
+        with self._lock:
+            recovered = self._state.get("status") != "healthy" and state.get("status") == "healthy"
+            version_changed = state.get("version") != self._state.get("version")
+            self._state = state
+            self._checked_at = time.monotonic()
+            self._checked_at_wall = datetime.utcnow()
+            self._latencies.append(elapsed)
+            if state.get("status") == "healthy":
+                self._consecutive_failures = 0
+            else:
+                self._consecutive_failures += 1
+            models_due = time.monotonic() - self._models_fetched_at >= self.models_interval
+
+        # 模型列表只在服务恢复、版本变化或到达刷新周期时重新拉取
+        if state.get("status") == "healthy" and (recovered or version_changed or models_due):
+            self._refresh_models()
+
+    def _refresh_models(self) -> None:
+        try:
+            models = self.fetch_models()
+        except Exception as e:
+            logger.warning(f"模型列表刷新失败: {str(e)}")
+            return
+        if models is None:
+            return
+
+        fingerprint = tuple(sorted((m.get('name'), m.get('digest')) for m in models))
+        with self._lock:
+            self._models_fetched_at = time.monotonic()
+            if fingerprint != self._models_fingerprint:
+                self._models = models
+                self._models_fingerprint = fingerprint
+                self._models_updated_at = datetime.utcnow()
+                logger.info(f"LLM模型列表已更新，共{len(models)}个模型")
+
+    def _latency_stats(self) -> Dict[str, Any]:
+        samples = sorted(self._latencies)
+        if not samples:
+            return {"samples": 0}
+        return {
+            "samples": len(samples),
+            "last": round(self._latencies[-1], 3),
+            "p50": round(samples[len(samples) // 2], 3),
+            "p95": round(samples[min(int(len(samples) * 0.95), len(samples) - 1)], 3),
+            "max": round(samples[-1], 3)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回最近一次探测结果，不发起任何网络请求"""
+        self.start()
+        with self._lock:
+            snapshot = dict(self._state)
+            snapshot["models"] = list(self._models)
+            snapshot["checked_at"] = self._checked_at_wall.strftime("%Y-%m-%d %H:%M:%S") if self._checked_at_wall else None
+            snapshot["age_seconds"] = round(time.monotonic() - self._checked_at, 1) if self._checked_at is not None else None
+            snapshot["consecutive_failures"] = self._consecutive_failures
+            snapshot["models_updated_at"] = self._models_updated_at.strftime("%Y-%m-%d %H:%M:%S") if self._models_updated_at else None
+            snapshot["probe_latency"] = self._latency_stats()
+            return snapshot
@@ -0,0 +1,75 @@
+import ast
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# 导出的字段及顺序
+EXPORT_FIELDS = ('id', 'analysis_type', 'text', 'result', 'created_at')
+
+
+def parse_result(raw: str) -> Any:
+    """分析结果以str(dict)保存，尽量还原为字典，无法解析时返回原字符串"""
+    try:
+        return ast.literal_eval(raw)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return raw
+
+
+def parse_datetime(value: Optional[str], end: bool = False) -> Optional[datetime]:
+    """解析日期参数，支持 YYYY-MM-DD 和ISO格式；只给日期的结束时间包含当天"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def row_to_dict(row) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "analysis_type": row.analysis_type,
+        "text": row.text,
+        "result": parse_result(row.result),
+        "created_at": row.created_at.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def iter_ndjson(rows: Iterable) -> Iterator[bytes]:
+    """逐行生成NDJSON"""
+    for row in rows:
+        yield (json.dumps(row_to_dict(row), ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+
+def iter_csv(rows: Iterable) -> Iterator[bytes]:
+    """逐行生成CSV，result列保留原始字符串"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow([row.id, row.analysis_type, row.text, row.result, row.created_at.strftime("%Y-%m-%d %H:%M:%S")])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_gzip(chunks: Iterable[bytes], level: int = 6, flush_size: int = 64 * 1024) -> Iterator[bytes]:
+    """边生成边压缩为gzip流，攒够flush_size再输出一块"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if data:
+            yield data
+        if pending >= flush_size:
+            data = compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+            pending = 0
+    yield compressor.flush()
@@ -0,0 +1,289 @@
+import contextlib
+import difflib
+import logging
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import jieba.posseg
+import numpy as np
+
+from config import Config
+from fast_sentiment import get_sentiment_scorer
+from segmentation import get_segmenter, tfidf_from_counts, textrank_from_pairs
+from tenant_dictionaries import get_tenant_registry
+
+logger = logging.getLogger(__name__)
+
+# 句子边界：句末标点之后，且下一个字符是汉字、空白或文本结尾。
+# 在这些位置切分时，jieba分词、词性标注和SnowNLP情感分词的结果都与整段处理完全一致。
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[。！？；!?;\n])(?=[\u4e00-\u9fa5\s]|$)')
+
+
+def split_sentences(text: str) -> List[str]:
+    """按句子切分文本，拼接后与原文相同"""
+    return [sentence for sentence in _SENTENCE_BOUNDARY.split(text) if sentence]
+
+
+class SentenceState:
+    """单个句子的中间结果，各字段在首次需要时计算"""
+
+    __slots__ = ('tokens', 'counts', 'pairs', 'log_likelihood', 'memory_bytes')
+
+    def __init__(self):
+        self.tokens: Optional[List[str]] = None
+        self.counts: Optional[Counter] = None
+        self.pairs: Optional[Tuple[jieba.posseg.pair, ...]] = None
+        self.log_likelihood: Optional[np.ndarray] = None
+        self.memory_bytes = 0
+
+    def measure(self) -> None:
+        """估算已计算字段占用的内存（字节），在字段更新后调用"""
+        size = sys.getsizeof(self)
+        if self.tokens is not None:
+            size += sys.getsizeof(self.tokens) + sum(sys.getsizeof(word) for word in self.tokens)
+            size += sys.getsizeof(self.counts)
+        if self.pairs is not None:
+            size += sys.getsizeof(self.pairs) + sum(sys.getsizeof(pair) + sys.getsizeof(pair.word) +
+                                                    sys.getsizeof(pair.flag) for pair in self.pairs)
+        if self.log_likelihood is not None:
+            size += self.log_likelihood.nbytes
+        self.memory_bytes = size
+
+
+class UserDocuments:
+    """一个用户最近提交的文本：上一版的句子及中间结果，以及按句子缓存的中间结果"""
+
+    def __init__(self, max_sentences: int):
+        self.max_sentences = max_sentences
+        self.sentences: List[str] = []
+        self.states: List[SentenceState] = []
+        self.cache: "OrderedDict[str, SentenceState]" = OrderedDict()
+        self.lock = threading.Lock()
+        # 上次计入IncrementalAnalyzer总量时的内存估算
+        self.memory_bytes = 0
+
+    def estimate_memory(self) -> int:
+        """估算缓存的句子及其中间结果占用的内存（字节）"""
+        size = sys.getsizeof(self.cache) + sys.getsizeof(self.sentences) + sys.getsizeof(self.states)
+        return size + sum(sys.getsizeof(sentence) + state.memory_bytes for sentence, state in self.cache.items())
+
+    def update(self, sentences: List[str]) -> Tuple[List[SentenceState], int]:
+        """与上一版逐句比对，返回新版本各句的状态和需要重新计算的句子数"""
+        states: List[Optional[SentenceState]] = [None] * len(sentences)
+        matcher = difflib.SequenceMatcher(None, self.sentences, sentences, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                states[j1:j2] = self.states[i1:i2]
+
+        changed = 0
+        for j, sentence in enumerate(sentences):
+            if states[j] is None:
+                # 修改过的句子也可能是之前版本中出现过的（例如撤销修改或移动句子）
+                state = self.cache.get(sentence)
+                if state is None:
+                    state = SentenceState()
+                    changed += 1
+                states[j] = state
+            self.cache[sentence] = states[j]
+            self.cache.move_to_end(sentence)
+        while len(self.cache) > self.max_sentences:
+            self.cache.popitem(last=False)
+
+        self.sentences = sentences
+        self.states = states
+        return states, changed
+
+
+class IncrementalAnalyzer:
+    """增量分析：只重新计算修改过的句子，再由各句的中间结果汇总出整篇文本的结果。
+    用户第一次提交时只记下用户，不保留状态；再次提交（编辑后重新分析）时才开始缓存，
+    总内存按估算字节数限制，超出时淘汰最久未使用的用户"""
+
+    def __init__(self, max_users: int = 1000, max_sentences: int = 2000,
+                 max_memory_mb: float = 128.0, enabled: bool = True):
+        self.max_users = max_users
+        self.max_sentences = max_sentences
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.enabled = enabled
+        # 按(用户ID, 租户)区分，租户词典不同时分词结果不同
+        self._users: "OrderedDict[tuple, UserDocuments]" = OrderedDict()
+        # 只提交过一次的用户，不占用中间结果的内存
+        self._seen: "OrderedDict[tuple, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_bytes = 0
+        self.sentences_total = 0
+        self.sentences_computed = 0
+
+    def _documents(self, user_id: int, tenant: Optional[str]) -> UserDocuments:
+        """返回用户保留的文本状态；未启用或用户第一次提交时返回用完即弃的空状态"""
+        if not self.enabled:
+            return UserDocuments(self.max_sentences)
+        key = (user_id, tenant)
+        with self._lock:
+            documents = self._users.get(key)
+            if documents is None:
+                if key not in self._seen:
+                    self._seen[key] = None
+                    while len(self._seen) > self.max_users:
+                        self._seen.popitem(last=False)
+                    return UserDocuments(self.max_sentences)
+                del self._seen[key]
+                documents = UserDocuments(self.max_sentences)
+                self._users[key] = documents
+            self._users.move_to_end(key)
+            while len(self._users) > self.max_users:
+                self._evict()
+            return documents
+
+    def _evict(self) -> None:
+        _, documents = self._users.popitem(last=False)
+        self.memory_bytes -= documents.memory_bytes
+
+    def _account(self, key: tuple, documents: UserDocuments) -> None:
+        """更新内存估算，超出上限时淘汰最久未使用的用户（调用方持有documents.lock）"""
+        size = documents.estimate_memory()
+        with self._lock:
+            # 用完即弃的状态和已被淘汰的状态不计入总量
+            if self._users.get(key) is not documents:
+                return
+            self.memory_bytes += size - documents.memory_bytes
+            documents.memory_bytes = size
+            while self._users and self.memory_bytes > self.max_memory_bytes:
+                self._evict()
+
+    @contextlib.contextmanager
+    def _locked(self, user_id: int, tenant: Optional[str]) -> Iterator[UserDocuments]:
+        documents = self._documents(user_id, tenant)
+        with documents.lock:
+            yield documents
+            self._account((user_id, tenant), documents)
+
+    def _prepare(self, documents: UserDocuments, text: str) -> Tuple[List[str], List[SentenceState]]:
+        sentences = split_sentences(text)
+        states, changed = documents.update(sentences)
+        self.sentences_total += len(sentences)
+        self.sentences_computed += changed
+        logger.debug(f"增量分析：共{len(sentences)}句，重新计算{changed}句")
+        return sentences, states
+
+    @staticmethod
+    def _pending(sentences: List[str], states: List[SentenceState], field: str) -> List[int]:
+        # 同一句子在文中出现多次时共享状态，只计算一次
+        seen, pending = set(), []
+        for i, state in enumerate(states):
+            if getattr(state, field) is None and id(state) not in seen:
+                seen.add(id(state))
+                pending.append(i)
+        return pending
+
+    def _ensure_tokens(self, sentences, states, tenant) -> None:
+        pending = self._pending(sentences, states, 'tokens')
+        if pending:
+            token_lists = get_segmenter().segment_many([sentences[i] for i in pending], tenant=tenant)
+            for i, tokens in zip(pending, token_lists):
+                states[i].tokens = tokens
+                states[i].counts = Counter(tokens)
+                states[i].measure()
+
+    def _ensure_pairs(self, sentences, states, tenant) -> None:
+        pending = self._pending(sentences, states, 'pairs')
+        if pending:
+            tagged = get_segmenter().segment_many([sentences[i] for i in pending], pos=True, tenant=tenant)
+            for i, pairs in zip(pending, tagged):
+                states[i].pairs = tuple(jieba.posseg.pair(word, flag) for word, flag in pairs)
+                states[i].measure()
+
+    def _ensure_sentiment(self, sentences, states) -> None:
+        pending = self._pending(sentences, states, 'log_likelihood')
+        if pending:
+            scorer = get_sentiment_scorer()
+            for i in pending:
+                states[i].log_likelihood = scorer.log_likelihood(scorer.encode(scorer.tokenize(sentences[i])))
+                states[i].measure()
+
+    @staticmethod
+    def _merge_counts(states: List[SentenceState]) -> Dict[str, int]:
+        """按句子顺序合并词频，保持词首次出现的顺序"""
+        merged: Dict[str, int] = {}
+        for state in states:
+            for word, count in state.counts.items():
+                merged[word] = merged.get(word, 0) + count
+        return merged
+
+    def sentiment_score(self, user_id: int, text: str, tenant: Optional[str] = None) -> float:
+        """积极概率，与SnowNLP(text).sentiments一致（情感分词不受租户词典影响，tenant只用于共享同一份文本状态）"""
+        with self._locked(user_id, tenant) as documents:
+            sentences, states = self._prepare(documents, text)
+            self._ensure_sentiment(sentences, states)
+            scorer = get_sentiment_scorer()
+            log_likelihood = sum((state.log_likelihood for state in states), np.zeros(len(scorer.classes)))
+        return float(scorer.positive_probability(log_likelihood))
+
+    def keywords(self, user_id: int, text: str, top_k: int = 10,
+                 tenant: Optional[str] = None) -> Tuple[List[tuple], List[tuple]]:
+        """返回(TF-IDF关键词, TextRank关键词)，与整段文本计算的结果一致"""
+        entry = get_tenant_registry().get(tenant)
+        with self._locked(user_id, tenant) as documents:
+            sentences, states = self._prepare(documents, text)
+            self._ensure_tokens(sentences, states, tenant)
+            self._ensure_pairs(sentences, states, tenant)
+            counts = self._merge_counts(states)
+            pairs = [pair for state in states for pair in state.pairs]
+        keywords_tfidf = tfidf_from_counts(counts, top_k, entry.stop_words if entry else None)
+        keywords_textrank = textrank_from_pairs(pairs, top_k, entry.textrank if entry else None)
+        return keywords_tfidf, keywords_textrank
+
+    def text_stats(self, user_id: int, text: str, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """文本统计信息，与EnhancedTextAnalyzer._calculate_text_stats一致"""
+        with self._locked(user_id, tenant) as documents:
+            sentences, states = self._prepare(documents, text)
+            self._ensure_tokens(sentences, states, tenant)
+            word_count = sum(len(state.tokens) for state in states)
+            unique_words = len(self._merge_counts(states))
+        sentence_count = sum(1 for s in text.split('。') if s.strip())
+        return {
+            "char_count": len(text),
+            "word_count": word_count,
+            "sentence_count": sentence_count,
+            "avg_sentence_length": round(word_count / sentence_count, 2) if sentence_count else 0,
+            "unique_words": unique_words
+        }
+
+    def observe(self, user_id: int, text: str, tenant: Optional[str] = None) -> None:
+        """只记录用户提交的新版本（请求合并到他人的计算时），各句中间结果在之后需要时再计算"""
+        with self._locked(user_id, tenant) as documents:
+            documents.update(split_sentences(text))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "documents": len(self._users),
+                "memory_bytes": self.memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "sentences_total": self.sentences_total,
+                "sentences_computed": self.sentences_computed
+            }
+
+
+_incremental: Optional[IncrementalAnalyzer] = None
+_incremental_lock = threading.Lock()
+
+
+def get_incremental_analyzer() -> IncrementalAnalyzer:
+    """进程内共享的增量分析器"""
+    global _incremental
+    if _incremental is None:
+        with _incremental_lock:
+            if _incremental is None:
+                config = Config()
+                _incremental = IncrementalAnalyzer(
+                    max_users=config.INCREMENTAL_MAX_USERS,
+                    max_sentences=config.INCREMENTAL_MAX_SENTENCES,
+                    max_memory_mb=config.INCREMENTAL_MAX_MEMORY_MB,
+                    enabled=config.INCREMENTAL_ENABLED
+                )
+    return _incremental
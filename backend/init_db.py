@@ -5,7 +5,8 @@
 用于创建数据库表结构
 """
 
-from app import app, db
+from app import app, db, search_index
+from database import ensure_indexes
 
 def init_database():
     """初始化数据库"""
@@ -13,6 +14,8 @@ def init_database():
         try:
             # 创建所有表
             db.create_all()
+            ensure_indexes(db.engine, db.metadata)
+            search_index.prepare(db.engine)
             print("✅ 数据库表创建成功！")
             
             # 检查表是否创建成功
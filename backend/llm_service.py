@@ -1,8 +1,26 @@
+import asyncio
+import functools
 import requests
 import json
 import logging
-from typing import Dict, Any, Optional
+import time
+import numpy as np
+from typing import Dict, Any, List, Optional, Sequence
 from config import Config
+from circuit_breaker import CircuitBreaker, CircuitOpenError, LatencyTracker
+from health_monitor import HealthMonitor
+from singleflight import SingleFlight, AsyncSingleFlight, make_flight_key
+from prompts import Prompt, PromptUsage, build_prompt
+from admission import AdmissionController, INTERACTIVE, BATCH
+from micro_batch import (BATCHABLE_TYPES, MicroBatcher, AsyncMicroBatcher, batch_key, build_batch_prompt,
+                         parse_batch_response)
+from embeddings import EmbeddingCache, EmbeddingError, normalize_rows
+from local_models import get_local_models
+
+try:
+    import aiohttp
+except ImportError:  # 仅异步服务需要
+    aiohttp = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,8 +32,178 @@ class LLMService:
         self.config = Config()
         self.provider = self.config.LLM_PROVIDER
         
+        # 每个远程提供商一个熔断器和延迟统计；向量接口单独统计，
+        # 它的延迟远低于文本生成，共用会压低生成请求的自适应超时，向量接口故障也不应熔断文本生成
+        self.breakers = {}
+        self.latency = {}
+        for name in ('ollama', 'openai', 'ollama_embed'):
+            self.breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=self.config.LLM_BREAKER_FAILURE_THRESHOLD,
+                recovery_timeout=self.config.LLM_BREAKER_RECOVERY_TIMEOUT,
+                half_open_max_calls=self.config.LLM_BREAKER_HALF_OPEN_MAX_CALLS
+            )
+            self.latency[name] = LatencyTracker(
+                percentile=self.config.LLM_TIMEOUT_PERCENTILE,
+                multiplier=self.config.LLM_TIMEOUT_MULTIPLIER,
+                min_timeout=self.config.LLM_TIMEOUT_MIN,
+                max_timeout=self.config.LLM_TIMEOUT_MAX,
+                min_samples=self.config.LLM_TIMEOUT_MIN_SAMPLES
+            )
+        
+        # 后台健康探测，/api/llm/health 只读取缓存结果
+        self.health_monitor = HealthMonitor(
+            self.probe_health,
+            self.fetch_models,
+            interval=self.config.LLM_HEALTH_INTERVAL,
+            models_interval=self.config.LLM_HEALTH_MODELS_INTERVAL
+        )
+        
+        # 相同文本、类型、参数和模型的并发请求只调用一次LLM
+        self.flight = SingleFlight()
+        self.async_flight = AsyncSingleFlight()
+        
+        # 提示词token估算值与实际值的累计统计
+        self.prompt_usage = PromptUsage()
+        
+        # 准入控制：所有LLM路由共享后端容量，按用户公平调度
+        self.admission = AdmissionController(
+            concurrency=self.config.LLM_ADMISSION_CONCURRENCY,
+            max_queue=self.config.LLM_ADMISSION_QUEUE_SIZE,
+            user_rate=self.config.LLM_USER_RATE,
+            user_burst=self.config.LLM_USER_BURST,
+            max_wait={INTERACTIVE: self.config.LLM_ADMISSION_MAX_WAIT_INTERACTIVE,
+                      BATCH: self.config.LLM_ADMISSION_MAX_WAIT_BATCH},
+            weights={INTERACTIVE: self.config.LLM_ADMISSION_INTERACTIVE_WEIGHT, BATCH: 1}
+        )
+        
+        # 短文本的情感/关键词请求合并为一个多条目提示词
+        self.micro_batch_enabled = self.config.LLM_MICRO_BATCH_ENABLED
+        window = self.config.LLM_MICRO_BATCH_WINDOW_MS / 1000.0
+        self.batcher = MicroBatcher(self._run_batch, window=window, max_items=self.config.LLM_MICRO_BATCH_MAX_ITEMS)
+        self.async_batcher = AsyncMicroBatcher(self._run_batch_async, window=window,
+                                               max_items=self.config.LLM_MICRO_BATCH_MAX_ITEMS)
+        
+        # 文本向量按内容哈希缓存，相同文本只请求一次向量接口
+        self.embedding_cache = EmbeddingCache(self.config.EMBEDDING_CACHE_PATH,
+                                              self.config.EMBEDDING_MEMORY_CACHE_SIZE)
+        
+        # 异步HTTP会话，首次在事件循环中使用时创建
+        self._session = None
+        self._session_loop = None
+        
+    def _model_name(self) -> str:
+        if self.provider == 'ollama':
+            return self.config.OLLAMA_MODEL
+        if self.provider == 'openai':
+            return self.config.OPENAI_MODEL
+        return self.config.LOCAL_MODEL_NAME
+    
     def analyze_text(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
         """统一的文本分析接口"""
+        key = make_flight_key(text, analysis_type, kwargs, f"{self.provider}:{self._model_name()}")
+        if self._batchable(text, analysis_type, kwargs):
+            return self.flight.do(key, lambda: self._analyze_batched(text, analysis_type, **kwargs))
+        return self.flight.do(key, lambda: self._dispatch(text, analysis_type, **kwargs))
+    
+    def _batchable(self, text: str, analysis_type: str, kwargs: Dict[str, Any]) -> bool:
+        """只有远程提供商的短文本情感/关键词请求参与批量处理"""
+        return (self.micro_batch_enabled and self.provider in ('ollama', 'openai')
+                and analysis_type in BATCHABLE_TYPES and len(text) <= self.config.LLM_MICRO_BATCH_MAX_CHARS
+                and set(kwargs) <= {'top_k'})
+    
+    def _analyze_batched(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """加入批次等待结果，批量结果中这一条解析失败时单独重新请求"""
+        result = self.batcher.submit(batch_key(analysis_type, kwargs), text)
+        if result is None:
+            logger.info("批量结果中的条目无效，单独重试")
+            return self._dispatch(text, analysis_type, **kwargs)
+        return result
+    
+    def _run_batch(self, key, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """执行一个批次，返回每条文本的结果，无效条目为None
+        整批只调用一次LLM，按执行批次的请求者准入一次；未获准入、构建或解析批量请求时出现异常，
+        所有条目返回None，由各调用方单独重试（按各自的请求者准入）"""
+        analysis_type, params = key[0], dict(key[1])
+        if len(texts) == 1:
+            return [self._dispatch(texts[0], analysis_type, **params)]
+        try:
+            prompt = build_batch_prompt(analysis_type, texts, **params)
+            with self.admission.admit_current():
+                completion = self._complete(prompt, max_tokens=self._batch_max_tokens(len(texts)))
+            return self._split_batch(completion, prompt, analysis_type, len(texts))
+        except Exception as e:
+            logger.warning(f"批量请求失败，逐条重试: {str(e)}")
+            return [None] * len(texts)
+    
+    def _batch_max_tokens(self, count: int) -> int:
+        return max(1000, 200 * count)
+    
+    def _split_batch(self, completion: Dict[str, Any], prompt: Prompt, analysis_type: str,
+                     count: int) -> List[Optional[Dict[str, Any]]]:
+        if 'error' in completion:
+            # 请求本身失败（如熔断、超时）时不逐条重试，所有条目返回同一错误
+            return [dict(completion) for _ in range(count)]
+        actual_tokens = completion.get('actual_tokens')
+        self.prompt_usage.record(prompt, actual_tokens)
+        results = parse_batch_response(completion['content'], analysis_type, count)
+        usage = {
+            "estimated": prompt.estimated_tokens,
+            "actual": actual_tokens,
+            "input_estimated": prompt.input_tokens,
+            "truncated": False,
+            "batch_size": count
+        }
+        logger.info(f"批量{analysis_type}：{count}条，有效{sum(r is not None for r in results)}条，"
+                    f"提示词token估算{prompt.estimated_tokens}，实际{actual_tokens}")
+        for result in results:
+            if result is not None:
+                result["prompt_tokens"] = dict(usage)
+        return results
+    
+    def _complete(self, prompt: Prompt, max_tokens: int = 1000) -> Dict[str, Any]:
+        """发送提示词，返回{"content": 模型输出, "actual_tokens": 实际提示词token数}，失败时返回{"error": ...}"""
+        try:
+            if self.provider == 'ollama':
+                response = self._post(
+                    'ollama',
+                    f"{self.config.OLLAMA_BASE_URL}/api/generate",
+                    json=self._ollama_payload(prompt.text, max_tokens)
+                )
+                if response.status_code != 200:
+                    return {"error": f"Ollama API调用失败: {response.status_code}"}
+                result = response.json()
+                return {"content": result.get('response', ''), "actual_tokens": result.get('prompt_eval_count')}
+            if self.provider == 'openai':
+                if not self.config.OPENAI_API_KEY:
+                    return {"error": "OpenAI API密钥未配置"}
+                response = self._post(
+                    'openai',
+                    f"{self.config.OPENAI_BASE_URL}/chat/completions",
+                    headers=self._openai_headers(),
+                    json=self._openai_payload(prompt.text, max_tokens)
+                )
+                if response.status_code != 200:
+                    return {"error": f"OpenAI API调用失败: {response.status_code}"}
+                result = response.json()
+                return {"content": result['choices'][0]['message']['content'],
+                        "actual_tokens": (result.get('usage') or {}).get('prompt_tokens')}
+            return {"error": f"不支持的LLM提供商: {self.provider}"}
+        except CircuitOpenError as e:
+            logger.warning(f"LLM请求被熔断: {str(e)}")
+            return {"error": f"LLM服务暂不可用: {str(e)}", "circuit_state": CircuitBreaker.OPEN}
+        except (requests.exceptions.RequestException, ValueError, KeyError, IndexError) as e:
+            logger.error(f"LLM请求异常: {str(e)}")
+            return {"error": f"LLM请求异常: {str(e)}"}
+    
+    def _dispatch(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """实际调用LLM前按当前请求者准入（合并的重复请求和批次中的其他条目不占用名额），
+        未获准入时抛出AdmissionRejected"""
+        with self.admission.admit_current():
+            return self._call_provider(text, analysis_type, **kwargs)
+    
+    def _call_provider(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """按提供商分发分析请求"""
         try:
             if self.provider == 'ollama':
                 return self._analyze_with_ollama(text, analysis_type, **kwargs)
@@ -25,6 +213,10 @@ class LLMService:
                 return self._analyze_with_local_model(text, analysis_type, **kwargs)
             else:
                 raise ValueError(f"不支持的LLM提供商: {self.provider}")
+        except CircuitOpenError as e:
+            # 熔断打开时不等待超时，直接让调用方回退到传统方法
+            logger.warning(f"LLM请求被熔断: {str(e)}")
+            return {"error": f"LLM服务暂不可用: {str(e)}", "circuit_state": CircuitBreaker.OPEN}
         except Exception as e:
             logger.error(f"LLM分析失败: {str(e)}")
             return {"error": f"LLM分析失败: {str(e)}"}
@@ -36,24 +228,16 @@ class LLMService:
             prompt = self._build_prompt(text, analysis_type, **kwargs)
             
             # 调用Ollama API
-            response = requests.post(
+            response = self._post(
+                'ollama',
                 f"{self.config.OLLAMA_BASE_URL}/api/generate",
-                json={
-                    "model": self.config.OLLAMA_MODEL,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,
-                        "top_p": 0.9,
-                        "max_tokens": 1000
-                    }
-                },
-                timeout=60
+                json=self._ollama_payload(prompt.text)
             )
             
             if response.status_code == 200:
                 result = response.json()
-                return self._parse_ollama_response(result, analysis_type)
+                return self._attach_usage(self._parse_ollama_response(result, analysis_type),
+                                          prompt, result.get('prompt_eval_count'))
             else:
                 logger.error(f"Ollama API调用失败: {response.status_code}")
                 return {"error": f"Ollama API调用失败: {response.status_code}"}
@@ -72,27 +256,17 @@ class LLMService:
             prompt = self._build_prompt(text, analysis_type, **kwargs)
             
             # 调用OpenAI API
-            response = requests.post(
+            response = self._post(
+                'openai',
                 f"{self.config.OPENAI_BASE_URL}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.config.OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": self.config.OPENAI_MODEL,
-                    "messages": [
-                        {"role": "system", "content": "你是一个专业的文本分析助手，请按照要求分析文本。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.1,
-                    "max_tokens": 1000
-                },
-                timeout=60
+                headers=self._openai_headers(),
+                json=self._openai_payload(prompt.text)
             )
             
             if response.status_code == 200:
                 result = response.json()
-                return self._parse_openai_response(result, analysis_type)
+                return self._attach_usage(self._parse_openai_response(result, analysis_type),
+                                          prompt, (result.get('usage') or {}).get('prompt_tokens'))
             else:
                 logger.error(f"OpenAI API调用失败: {response.status_code}")
                 return {"error": f"OpenAI API调用失败: {response.status_code}"}
@@ -101,70 +275,322 @@ class LLMService:
             logger.error(f"OpenAI请求异常: {str(e)}")
             return {"error": f"OpenAI请求异常: {str(e)}"}
     
-    def _analyze_with_local_model(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
-        """使用本地模型进行分析"""
-        # 这里可以集成transformers库来加载本地模型
-        # 为了简化，暂时返回错误信息
-        return {"error": "本地模型集成功能开发中，请使用Ollama或OpenAI"}
-    
-    def _build_prompt(self, text: str, analysis_type: str, **kwargs) -> str:
-        """构建分析提示词"""
-        base_prompt = f"请分析以下文本，要求：\n\n文本内容：{text}\n\n"
+    def _post(self, provider: str, url: str, **kwargs) -> requests.Response:
+        """带熔断和自适应超时的POST请求"""
+        breaker = self.breakers[provider]
+        tracker = self.latency[provider]
+        breaker.before_call()
         
-        if analysis_type == 'sentiment':
-            prompt = base_prompt + """
-请进行情感分析，分析结果请以JSON格式返回，包含以下字段：
-- sentiment: 情感倾向（积极/消极/中性）
-- score: 情感得分（0-1之间的小数）
-- confidence: 置信度（高/中/低）
-- reasoning: 分析理由（简要说明）
-
-请确保返回的是有效的JSON格式。"""
-            
-        elif analysis_type == 'keywords':
-            top_k = kwargs.get('top_k', 10)
-            prompt = base_prompt + f"""
-请提取关键词，要求：
-- 提取{top_k}个最重要的关键词
-- 分析结果请以JSON格式返回，包含以下字段：
-  - keywords: 关键词列表，每个关键词包含word和weight字段
-  - reasoning: 提取理由（简要说明）
-
-请确保返回的是有效的JSON格式。"""
-            
-        elif analysis_type == 'summary':
-            max_length = kwargs.get('max_length', 200)
-            prompt = base_prompt + f"""
-请生成文本摘要，要求：
-- 摘要长度控制在{max_length}字以内
-- 保持原文的核心信息和逻辑结构
-- 分析结果请以JSON格式返回，包含以下字段：
-  - summary: 摘要内容
-  - length: 摘要长度
-  - original_length: 原文长度
-  - compression_ratio: 压缩比
-  - key_points: 关键要点列表
-
-请确保返回的是有效的JSON格式。"""
-            
-        elif analysis_type == 'similarity':
-            text2 = kwargs.get('text2', '')
-            prompt = base_prompt + f"""
-请分析两段文本的相似度，要求：
-- 文本1: {text}
-- 文本2: {text2}
-- 分析结果请以JSON格式返回，包含以下字段：
-  - similarity_score: 相似度得分（0-1之间的小数）
-  - similarity_percentage: 相似度百分比
-  - interpretation: 相似度解释（高度相似/中度相似/低度相似）
-  - reasoning: 分析理由（简要说明）
-
-请确保返回的是有效的JSON格式。"""
-            
+        start = time.monotonic()
+        try:
+            response = requests.post(url, timeout=tracker.timeout(), **kwargs)
+        except requests.exceptions.Timeout as e:
+            # 超时也计入延迟样本，后端整体变慢时超时会随之放宽
+            tracker.record(time.monotonic() - start)
+            breaker.record_failure(f"请求超时: {str(e)}")
+            raise
+        except Exception as e:
+            breaker.record_failure(str(e))
+            raise
+        
+        self._record_outcome(provider, response.status_code, time.monotonic() - start)
+        return response
+    
+    def _record_outcome(self, provider: str, status_code: int, elapsed: float) -> None:
+        """根据HTTP状态更新熔断器和延迟统计"""
+        # 5xx和429说明后端异常或过载，计为失败；其余状态说明后端可达
+        if status_code >= 500 or status_code == 429:
+            self.breakers[provider].record_failure(f"HTTP {status_code}")
         else:
-            prompt = base_prompt + "请进行通用文本分析。"
+            self.breakers[provider].record_success()
+            self.latency[provider].record(elapsed)
+    
+    def _ollama_payload(self, prompt: str, max_tokens: int = 1000) -> Dict[str, Any]:
+        return {
+            "model": self.config.OLLAMA_MODEL,
+            "prompt": prompt,
+            "stream": False,
+            "options": {
+                "temperature": 0.1,
+                "top_p": 0.9,
+                "max_tokens": max_tokens
+            }
+        }
+    
+    def _openai_headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.config.OPENAI_API_KEY}",
+            "Content-Type": "application/json"
+        }
+    
+    def _openai_payload(self, prompt: str, max_tokens: int = 1000) -> Dict[str, Any]:
+        return {
+            "model": self.config.OPENAI_MODEL,
+            "messages": [
+                {"role": "system", "content": "你是一个专业的文本分析助手，请按照要求分析文本。"},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.1,
+            "max_tokens": max_tokens
+        }
+    
+    # 文本向量：语义相似度只需比较两个（通常已缓存的）向量，不再调用生成接口
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """文本的L2归一化向量，形状为(len(texts), dim)；缓存未命中的文本去重后批量请求向量接口"""
+        if self.config.EMBEDDING_PROVIDER != 'ollama':
+            raise EmbeddingError("向量接口未启用")
+        model = self.config.OLLAMA_EMBED_MODEL
+        vectors = self.embedding_cache.get_many(model, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        fetched = {}
+        batch_size = self.config.EMBEDDING_BATCH_SIZE
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            with self.admission.admit_current():
+                batch_vectors = self._embed_with_ollama(model, batch)
+            self.embedding_cache.put_many(model, batch, batch_vectors)
+            fetched.update(zip(batch, batch_vectors))
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([vector if vector is not None else fetched[text] for text, vector in zip(texts, vectors)])
+    
+    def _embed_with_ollama(self, model: str, texts: List[str]) -> np.ndarray:
+        try:
+            response = self._post(
+                'ollama_embed',
+                f"{self.config.OLLAMA_BASE_URL}/api/embed",
+                json={"model": model, "input": texts}
+            )
+        except requests.exceptions.RequestException as e:
+            raise EmbeddingError(f"Ollama向量请求异常: {str(e)}") from e
+        if response.status_code != 200:
+            raise EmbeddingError(f"Ollama向量接口调用失败: {response.status_code}")
+        try:
+            embeddings = response.json()['embeddings']
+        except (ValueError, KeyError) as e:
+            raise EmbeddingError(f"向量响应解析失败: {str(e)}") from e
+        if len(embeddings) != len(texts):
+            raise EmbeddingError(f"向量数量不一致: 请求{len(texts)}条，返回{len(embeddings)}条")
+        return normalize_rows(np.array(embeddings, dtype=np.float32))
+    
+    def embedding_similarity(self, text1: str, text2: str) -> Dict[str, Any]:
+        """基于向量余弦相似度的文本相似度"""
+        try:
+            vectors = self.embed([text1, text2])
+        except CircuitOpenError as e:
+            return {"error": f"LLM服务暂不可用: {str(e)}", "circuit_state": CircuitBreaker.OPEN}
+        except EmbeddingError as e:
+            logger.warning(f"向量计算失败: {str(e)}")
+            return {"error": str(e)}
+        score = min(max(float(vectors[0] @ vectors[1]), 0.0), 1.0)
+        return {
+            "similarity_score": round(score, 3),
+            "similarity_percentage": round(score * 100, 1),
+            "interpretation": "高度相似" if score > 0.8 else "中度相似" if score > 0.5 else "低度相似",
+            "method": "embedding",
+            "model": self.config.OLLAMA_EMBED_MODEL
+        }
+    
+    # 异步接口：供asyncio服务（async_app.py）使用，等待LLM响应时不占用线程
+    async def analyze_text_async(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """统一的异步文本分析接口"""
+        key = make_flight_key(text, analysis_type, kwargs, f"{self.provider}:{self._model_name()}")
+        if self._batchable(text, analysis_type, kwargs):
+            return await self.async_flight.do(key, lambda: self._analyze_batched_async(text, analysis_type, **kwargs))
+        return await self.async_flight.do(key, lambda: self._dispatch_async(text, analysis_type, **kwargs))
+    
+    async def _analyze_batched_async(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        result = await self.async_batcher.submit(batch_key(analysis_type, kwargs), text)
+        if result is None:
+            logger.info("批量结果中的条目无效，单独重试")
+            return await self._dispatch_async(text, analysis_type, **kwargs)
+        return result
+    
+    async def _run_batch_async(self, key, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        analysis_type, params = key[0], dict(key[1])
+        if len(texts) == 1:
+            return [await self._dispatch_async(texts[0], analysis_type, **params)]
+        try:
+            prompt = build_batch_prompt(analysis_type, texts, **params)
+            async with self.admission.admit_current_async():
+                completion = await self._complete_async(prompt, max_tokens=self._batch_max_tokens(len(texts)))
+            return self._split_batch(completion, prompt, analysis_type, len(texts))
+        except Exception as e:
+            logger.warning(f"批量请求失败，逐条重试: {str(e)}")
+            return [None] * len(texts)
+    
+    async def _complete_async(self, prompt: Prompt, max_tokens: int = 1000) -> Dict[str, Any]:
+        """_complete的异步版本"""
+        try:
+            if self.provider == 'ollama':
+                status, result = await self._post_async(
+                    'ollama',
+                    f"{self.config.OLLAMA_BASE_URL}/api/generate",
+                    json=self._ollama_payload(prompt.text, max_tokens)
+                )
+                if status != 200:
+                    return {"error": f"Ollama API调用失败: {status}"}
+                return {"content": result.get('response', ''), "actual_tokens": result.get('prompt_eval_count')}
+            if self.provider == 'openai':
+                if not self.config.OPENAI_API_KEY:
+                    return {"error": "OpenAI API密钥未配置"}
+                status, result = await self._post_async(
+                    'openai',
+                    f"{self.config.OPENAI_BASE_URL}/chat/completions",
+                    headers=self._openai_headers(),
+                    json=self._openai_payload(prompt.text, max_tokens)
+                )
+                if status != 200:
+                    return {"error": f"OpenAI API调用失败: {status}"}
+                return {"content": result['choices'][0]['message']['content'],
+                        "actual_tokens": (result.get('usage') or {}).get('prompt_tokens')}
+            return {"error": f"不支持的LLM提供商: {self.provider}"}
+        except CircuitOpenError as e:
+            logger.warning(f"LLM请求被熔断: {str(e)}")
+            return {"error": f"LLM服务暂不可用: {str(e)}", "circuit_state": CircuitBreaker.OPEN}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, IndexError) as e:
+            logger.error(f"LLM请求异常: {str(e)}")
+            return {"error": f"LLM请求异常: {str(e) or type(e).__name__}"}
+    
+    async def _dispatch_async(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """_dispatch的异步版本"""
+        async with self.admission.admit_current_async():
+            return await self._call_provider_async(text, analysis_type, **kwargs)
+    
+    async def _call_provider_async(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """按提供商分发异步分析请求"""
+        try:
+            if self.provider == 'ollama':
+                return await self._analyze_with_ollama_async(text, analysis_type, **kwargs)
+            elif self.provider == 'openai':
+                return await self._analyze_with_openai_async(text, analysis_type, **kwargs)
+            elif self.provider == 'local':
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    None, functools.partial(self._analyze_with_local_model, text, analysis_type, **kwargs))
+            else:
+                raise ValueError(f"不支持的LLM提供商: {self.provider}")
+        except CircuitOpenError as e:
+            logger.warning(f"LLM请求被熔断: {str(e)}")
+            return {"error": f"LLM服务暂不可用: {str(e)}", "circuit_state": CircuitBreaker.OPEN}
+        except Exception as e:
+            logger.error(f"LLM分析失败: {str(e)}")
+            return {"error": f"LLM分析失败: {str(e)}"}
+    
+    async def _analyze_with_ollama_async(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """使用Ollama进行异步分析"""
+        try:
+            prompt = self._build_prompt(text, analysis_type, **kwargs)
+            status, result = await self._post_async(
+                'ollama',
+                f"{self.config.OLLAMA_BASE_URL}/api/generate",
+                json=self._ollama_payload(prompt.text)
+            )
+            if status == 200:
+                return self._attach_usage(self._parse_ollama_response(result, analysis_type),
+                                          prompt, result.get('prompt_eval_count'))
+            logger.error(f"Ollama API调用失败: {status}")
+            return {"error": f"Ollama API调用失败: {status}"}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Ollama请求异常: {str(e)}")
+            return {"error": f"Ollama请求异常: {str(e) or type(e).__name__}"}
+    
+    async def _analyze_with_openai_async(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """使用OpenAI进行异步分析"""
+        if not self.config.OPENAI_API_KEY:
+            return {"error": "OpenAI API密钥未配置"}
+        try:
+            prompt = self._build_prompt(text, analysis_type, **kwargs)
+            status, result = await self._post_async(
+                'openai',
+                f"{self.config.OPENAI_BASE_URL}/chat/completions",
+                headers=self._openai_headers(),
+                json=self._openai_payload(prompt.text)
+            )
+            if status == 200:
+                return self._attach_usage(self._parse_openai_response(result, analysis_type),
+                                          prompt, (result.get('usage') or {}).get('prompt_tokens'))
+            logger.error(f"OpenAI API调用失败: {status}")
+            return {"error": f"OpenAI API调用失败: {status}"}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"OpenAI请求异常: {str(e)}")
+            return {"error": f"OpenAI请求异常: {str(e) or type(e).__name__}"}
+    
+    async def _get_session(self):
+        """每个事件循环复用一个aiohttp会话和连接池"""
+        if aiohttp is None:
+            raise RuntimeError("异步接口需要安装aiohttp")
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.config.LLM_ASYNC_MAX_CONNECTIONS)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session
+    
+    async def close_async(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _post_async(self, provider: str, url: str, **kwargs):
+        """带熔断和自适应超时的异步POST请求，返回(状态码, JSON内容)"""
+        breaker = self.breakers[provider]
+        tracker = self.latency[provider]
+        breaker.before_call()
+        
+        start = time.monotonic()
+        try:
+            session = await self._get_session()
+            timeout = aiohttp.ClientTimeout(total=tracker.timeout())
+            async with session.post(url, timeout=timeout, **kwargs) as response:
+                status = response.status
+                result = await response.json(content_type=None) if status == 200 else None
+        except asyncio.TimeoutError:
+            tracker.record(time.monotonic() - start)
+            breaker.record_failure("请求超时")
+            raise
+        except asyncio.CancelledError:
+            # 客户端断开导致的取消不计为后端失败，只归还半开试探名额
+            breaker.release()
+            raise
+        except Exception as e:
+            breaker.record_failure(str(e) or type(e).__name__)
+            raise
         
-        return prompt
+        self._record_outcome(provider, status, time.monotonic() - start)
+        return status, result
+    
+    def _analyze_with_local_model(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        """使用本地模型进行分析（只支持情感和关键词，其余类型返回错误由调用方回退到传统方法）"""
+        return get_local_models().analyze(text, analysis_type, **kwargs)
+    
+    def analyze_many(self, texts: List[str], analysis_type: str, **kwargs) -> List[Dict[str, Any]]:
+        """批量分析：本地模型一次向量化计算整批文本，远程提供商逐条调用analyze_text"""
+        if self.provider == 'local':
+            try:
+                return get_local_models().analyze_many(texts, analysis_type, **kwargs)
+            except Exception as e:
+                logger.error(f"本地模型分析失败: {str(e)}")
+                return [{"error": f"LLM分析失败: {str(e)}"} for _ in texts]
+        return [self.analyze_text(text, analysis_type, **kwargs) for text in texts]
+    
+    def _build_prompt(self, text: str, analysis_type: str, **kwargs) -> Prompt:
+        """构建分析提示词，输入文本按分析类型的token预算截断"""
+        return build_prompt(text, analysis_type, **kwargs)
+    
+    def _attach_usage(self, result: Dict[str, Any], prompt: Prompt, actual_tokens: Optional[int]) -> Dict[str, Any]:
+        """记录本次调用的提示词token估算值和实际值，并附加到分析结果中"""
+        self.prompt_usage.record(prompt, actual_tokens)
+        logger.info(f"提示词token：估算{prompt.estimated_tokens}，实际{actual_tokens}"
+                    f"{'，输入已截断' if prompt.truncated else ''}")
+        if isinstance(result, dict):
+            result["prompt_tokens"] = {
+                "estimated": prompt.estimated_tokens,
+                "actual": actual_tokens,
+                "input_estimated": prompt.input_tokens,
+                "truncated": prompt.truncated
+            }
+        return result
     
     def _parse_ollama_response(self, response: Dict[str, Any], analysis_type: str) -> Dict[str, Any]:
         """解析Ollama响应"""
@@ -206,21 +632,49 @@ class LLMService:
             logger.error(f"OpenAI响应解析失败: {str(e)}")
             return {"error": f"响应解析失败: {str(e)}", "raw_response": str(response)}
     
-    def health_check(self) -> Dict[str, Any]:
-        """健康检查"""
+    def micro_batch_stats(self) -> Dict[str, Any]:
+        return {"sync": self.batcher.stats(), "async": self.async_batcher.stats()}
+    
+    def breaker_status(self) -> Dict[str, Any]:
+        """各提供商的熔断状态和延迟统计"""
+        return {
+            name: {**breaker.snapshot(), "latency": self.latency[name].stats()}
+            for name, breaker in self.breakers.items()
+        }
+    
+    def probe_health(self) -> Dict[str, Any]:
+        """探测LLM服务状态（由后台健康监控定时调用）"""
         try:
             if self.provider == 'ollama':
-                response = requests.get(f"{self.config.OLLAMA_BASE_URL}/api/tags", timeout=10)
+                # /api/version 开销很小，只用于存活探测；模型列表由fetch_models单独刷新
+                response = requests.get(f"{self.config.OLLAMA_BASE_URL}/api/version", timeout=self.config.LLM_HEALTH_TIMEOUT)
                 if response.status_code == 200:
-                    return {"status": "healthy", "provider": "ollama", "models": response.json().get('models', [])}
+                    return {"status": "healthy", "provider": "ollama", "version": response.json().get('version')}
                 else:
                     return {"status": "unhealthy", "provider": "ollama", "error": f"HTTP {response.status_code}"}
             elif self.provider == 'openai':
                 if not self.config.OPENAI_API_KEY:
                     return {"status": "unhealthy", "provider": "openai", "error": "API密钥未配置"}
                 return {"status": "healthy", "provider": "openai"}
+            elif self.provider == 'local':
+                models = get_local_models()
+                return {"status": "healthy" if models.available else "unhealthy", "provider": "local",
+                        **models.status()}
             else:
                 return {"status": "unknown", "provider": self.provider}
                 
         except Exception as e:
             return {"status": "error", "provider": self.provider, "error": str(e)}
+    
+    def fetch_models(self) -> Optional[list]:
+        """获取可用模型列表，非Ollama提供商返回None"""
+        if self.provider != 'ollama':
+            return None
+        response = requests.get(f"{self.config.OLLAMA_BASE_URL}/api/tags", timeout=self.config.LLM_HEALTH_TIMEOUT)
+        if response.status_code != 200:
+            return None
+        return response.json().get('models', [])
+    
+    def health_check(self) -> Dict[str, Any]:
+        """健康检查，返回后台监控缓存的最近状态"""
+        return self.health_monitor.snapshot()
@@ -0,0 +1,171 @@
+"""
+本地（仅CPU）分析模型，供 LLM_PROVIDER=local 使用
+用历史分析记录训练的scikit-learn流水线：情感是TF-IDF加逻辑回归的三分类模型，
+关键词是在历史语料上拟合的TF-IDF（领域IDF，语料中没有出现过的词按最稀有的词计算）。
+模型用joblib不压缩保存，加载时以只读内存映射打开，同一台机器上的多个工作进程共享模型数组；
+情感按批向量化推理。训练命令见 train_local_models.py。
+"""
+
+import json
+import logging
+import os
+import threading
+from math import log
+from typing import Any, Dict, List, Optional, Sequence
+
+import jieba
+import jieba.analyse
+import joblib
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SENTIMENT_FILE = 'sentiment.joblib'
+KEYWORDS_FILE = 'keywords.joblib'
+METADATA_FILE = 'metadata.json'
+
+SENTIMENT_LABELS = ('积极', '中性', '消极')
+SUPPORTED_TYPES = ('sentiment', 'keywords')
+
+
+def tokenize(text: str) -> List[str]:
+    """情感模型的分词：保留除空白外的所有词（标点也带有情感信息，如感叹号）"""
+    return [token for token in jieba.lcut(text) if token.strip()]
+
+
+def keyword_tokenize(text: str) -> List[str]:
+    """关键词候选词：与jieba TF-IDF相同，去掉单字和停用词，另外去掉不含字母数字的符号串"""
+    stop_words = jieba.analyse.default_tfidf.stop_words
+    return [token for token in jieba.lcut(text)
+            if len(token.strip()) >= 2 and token.lower() not in stop_words and any(c.isalnum() for c in token)]
+
+
+def save_models(directory: str, sentiment=None, keywords=None, metadata: Optional[Dict[str, Any]] = None) -> None:
+    """写入临时文件后替换，正在运行的进程读到的总是完整的模型文件；不压缩以便内存映射加载"""
+    os.makedirs(directory, exist_ok=True)
+    for filename, model in ((SENTIMENT_FILE, sentiment), (KEYWORDS_FILE, keywords)):
+        if model is None:
+            continue
+        path = os.path.join(directory, filename)
+        joblib.dump(model, path + '.tmp', compress=0)
+        os.replace(path + '.tmp', path)
+    path = os.path.join(directory, METADATA_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(metadata or {}, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class LocalModels:
+    """加载并执行本地模型；目录中缺少某个模型文件时对应的分析返回错误，调用方回退到传统方法"""
+
+    def __init__(self, directory: str, mmap: bool = True, name: str = 'local'):
+        self.directory = directory
+        self.mmap = mmap
+        self.name = name
+        self.sentiment = None
+        self.keywords = None
+        self.metadata: Dict[str, Any] = {}
+        self._oov_idf = 0.0
+        self.load()
+
+    def load(self) -> None:
+        mmap_mode = 'r' if self.mmap else None
+        sentiment_path = os.path.join(self.directory, SENTIMENT_FILE)
+        keywords_path = os.path.join(self.directory, KEYWORDS_FILE)
+        metadata_path = os.path.join(self.directory, METADATA_FILE)
+        self.sentiment = joblib.load(sentiment_path, mmap_mode=mmap_mode) if os.path.exists(sentiment_path) else None
+        self.keywords = joblib.load(keywords_path, mmap_mode=mmap_mode) if os.path.exists(keywords_path) else None
+        if os.path.exists(metadata_path):
+            with open(metadata_path, encoding='utf-8') as f:
+                self.metadata = json.load(f)
+        if self.keywords is not None:
+            # 与TfidfVectorizer(smooth_idf=True)相同的公式，文档频率为0
+            self._oov_idf = log(self.metadata.get('keywords', {}).get('documents', 1) + 1) + 1
+            self._vocabulary = self.keywords.named_steps['tfidf'].vocabulary_
+            self._idf = self.keywords.named_steps['tfidf'].idf_
+        logger.info("本地模型已加载: 情感=%s 关键词=%s", self.sentiment is not None, self.keywords is not None)
+
+    @property
+    def available(self) -> List[str]:
+        return [name for name, model in (('sentiment', self.sentiment), ('keywords', self.keywords))
+                if model is not None]
+
+    def sentiment_batch(self, texts: Sequence[str]) -> List[Dict[str, Any]]:
+        """一次predict_proba计算整批文本；score为积极概率加一半的中性概率，与传统方法的0-1得分含义一致"""
+        if self.sentiment is None:
+            return [{"error": "本地情感模型未训练"} for _ in texts]
+        if not texts:
+            return []
+        probabilities = self.sentiment.predict_proba(list(texts))
+        classes = list(self.sentiment.classes_)
+        results = []
+        for row in probabilities:
+            by_label = {label: float(row[classes.index(label)]) if label in classes else 0.0
+                        for label in SENTIMENT_LABELS}
+            score = by_label['积极'] + 0.5 * by_label['中性']
+            best = max(by_label.values())
+            results.append({
+                "sentiment": max(SENTIMENT_LABELS, key=by_label.get),
+                "score": round(score, 3),
+                "confidence": "高" if best > 0.8 else "中" if best > 0.5 else "低",
+                "probabilities": {label: round(value, 3) for label, value in by_label.items()},
+                "method": "local",
+                "model": self.name
+            })
+        return results
+
+    def keywords_batch(self, texts: Sequence[str], top_k: int = 10) -> List[Dict[str, Any]]:
+        if self.keywords is None:
+            return [{"error": "本地关键词模型未训练"} for _ in texts]
+        analyzer = self.keywords.named_steps['tfidf'].build_analyzer()
+        results = []
+        for text in texts:
+            counts: Dict[str, int] = {}
+            for token in analyzer(text):
+                counts[token] = counts.get(token, 0) + 1
+            total = sum(counts.values()) or 1
+            weights = []
+            for word, count in counts.items():
+                index = self._vocabulary.get(word)
+                idf = float(self._idf[index]) if index is not None else self._oov_idf
+                weights.append((word, count / total * idf))
+            weights.sort(key=lambda item: item[1], reverse=True)
+            top = weights[:top_k]
+            # 权重缩放到0-1，与LLM关键词的权重范围一致
+            scale = top[0][1] if top else 1.0
+            results.append({
+                "keywords": [{"word": word, "weight": round(weight / scale, 3)} for word, weight in top],
+                "method": "local",
+                "model": self.name
+            })
+        return results
+
+    def analyze_many(self, texts: Sequence[str], analysis_type: str, **kwargs) -> List[Dict[str, Any]]:
+        if analysis_type == 'sentiment':
+            return self.sentiment_batch(texts)
+        if analysis_type == 'keywords':
+            return self.keywords_batch(texts, int(kwargs.get('top_k', 10)))
+        return [{"error": f"本地模型不支持{analysis_type}分析"} for _ in texts]
+
+    def analyze(self, text: str, analysis_type: str, **kwargs) -> Dict[str, Any]:
+        return self.analyze_many([text], analysis_type, **kwargs)[0]
+
+    def status(self) -> Dict[str, Any]:
+        return {"directory": self.directory, "available": self.available, "metadata": self.metadata}
+
+
+_models: Optional[LocalModels] = None
+_models_lock = threading.Lock()
+
+
+def get_local_models() -> LocalModels:
+    """进程内共享的本地模型，每个工作进程首次使用时加载一次"""
+    global _models
+    if _models is None:
+        with _models_lock:
+            if _models is None:
+                config = Config()
+                _models = LocalModels(config.LOCAL_MODEL_PATH, mmap=config.LOCAL_MODEL_MMAP,
+                                      name=config.LOCAL_MODEL_NAME)
+    return _models
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence
+
+from prompts import TEMPLATES, Prompt, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 支持批量处理的分析类型
+BATCHABLE_TYPES = ('sentiment', 'keywords')
+
+_BATCH_INSTRUCTIONS = {
+    'sentiment': "请分别对下面编号的每条文本进行情感分析。",
+    'keywords': "请分别提取下面编号的每条文本中最重要的{top_k}个关键词。",
+}
+
+# 批量提示词参数的默认值，与单条提示词（prompts.build_prompt）一致
+BATCH_DEFAULTS = {
+    'keywords': {'top_k': 10},
+}
+
+_SENTIMENTS = ('积极', '消极', '中性')
+
+
+def _with_defaults(analysis_type: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    return {**BATCH_DEFAULTS.get(analysis_type, {}), **params}
+
+
+def batch_key(analysis_type: str, params: Dict[str, Any]) -> Hashable:
+    """批次键：参数补齐默认值，省略参数和显式传入默认值的请求进入同一批次"""
+    return analysis_type, tuple(sorted(_with_defaults(analysis_type, params).items()))
+
+
+def build_batch_prompt(analysis_type: str, texts: Sequence[str], **params) -> Prompt:
+    """把多条短文本打包成一个编号的提示词，要求模型按编号返回JSON数组"""
+    template = TEMPLATES[analysis_type]
+    header = _BATCH_INSTRUCTIONS[analysis_type].format(**_with_defaults(analysis_type, params))
+    items = "\n".join(f"[{i}] {text}" for i, text in enumerate(texts, 1))
+    fields = "\n".join(f"- {field}" for field in ["id: 文本编号"] + template.fields)
+    prompt = (f"{header}\n\n{items}\n\n"
+              f"分析结果请以JSON数组格式返回，每条文本对应一个对象，包含以下字段：\n{fields}\n\n"
+              f"请确保返回的是有效的JSON数组，共{len(texts)}个对象。")
+    input_tokens = sum(estimate_tokens(text) for text in texts)
+    return Prompt(prompt, estimate_tokens(prompt), input_tokens, False)
+
+
+def _valid_item(analysis_type: str, item: Any) -> bool:
+    """检查单条结果是否包含该分析类型要求的字段"""
+    if not isinstance(item, dict):
+        return False
+    if analysis_type == 'sentiment':
+        score = item.get('score')
+        return (item.get('sentiment') in _SENTIMENTS and isinstance(score, (int, float))
+                and not isinstance(score, bool) and 0 <= score <= 1)
+    if analysis_type == 'keywords':
+        keywords = item.get('keywords')
+        return isinstance(keywords, list) and all(isinstance(k, dict) and k.get('word') for k in keywords)
+    return True
+
+
+def parse_batch_response(content: str, analysis_type: str, count: int) -> List[Optional[Dict[str, Any]]]:
+    """按编号拆分批量结果，缺失或不合法的条目为None（由调用方单独重试）"""
+    results: List[Optional[Dict[str, Any]]] = [None] * count
+    start, end = content.find('['), content.rfind(']') + 1
+    if start == -1 or end <= start:
+        return results
+    try:
+        items = json.loads(content[start:end])
+    except json.JSONDecodeError:
+        return results
+    if not isinstance(items, list):
+        return results
+
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        # 优先使用模型返回的编号，没有编号时按顺序对应
+        index = item.get('id', position + 1)
+        if isinstance(index, str) and index.strip().isdigit():
+            index = int(index)
+        if not isinstance(index, int) or not 1 <= index <= count or results[index - 1] is not None:
+            continue
+        if _valid_item(analysis_type, item):
+            result = dict(item)
+            result.pop('id', None)
+            results[index - 1] = result
+    return results
+
+
+class _Batch:
+    __slots__ = ('items', 'full', 'results', 'error', 'done')
+
+    def __init__(self, full, done):
+        self.items: List[str] = []
+        self.full = full
+        self.done = done
+        self.results: Optional[list] = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    """收集短时间内到达的同类请求合并为一批执行（多线程版本）
+    每批第一个到达的线程负责等待窗口结束并执行整批，其他线程等待结果。"""
+
+    def __init__(self, run_batch: Callable[[Hashable, List[str]], list], window: float = 0.01, max_items: int = 16):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._open: Dict[Hashable, _Batch] = {}
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, key: Hashable, item: str):
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch(threading.Event(), threading.Event())
+                self._open[key] = batch
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_items:
+                # 批次已满，后续请求进入新的批次
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                self.batches += 1
+                self.items += len(batch.items)
+            try:
+                batch.results = self.run_batch(key, batch.items)
+            except BaseException as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0
+            }
+
+
+class AsyncMicroBatcher:
+    """MicroBatcher的asyncio版本，每个批次由独立的任务在窗口结束后执行，调用方取消不影响同批的其他请求"""
+
+    def __init__(self, run_batch: Callable[[Hashable, List[str]], Awaitable[list]], window: float = 0.01,
+                 max_items: int = 16):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_items = max_items
+        self._open: Dict[Hashable, _Batch] = {}
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, key: Hashable, item: str):
+        batch = self._open.get(key)
+        if batch is None:
+            loop = asyncio.get_running_loop()
+            batch = _Batch(asyncio.Event(), loop.create_future())
+            self._open[key] = batch
+            loop.create_task(self._flush(key, batch))
+        index = len(batch.items)
+        batch.items.append(item)
+        if len(batch.items) >= self.max_items:
+            del self._open[key]
+            batch.full.set()
+
+        results = await asyncio.shield(batch.done)
+        return results[index]
+
+    async def _flush(self, key: Hashable, batch: _Batch) -> None:
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self._open.get(key) is batch:
+            del self._open[key]
+        self.batches += 1
+        self.items += len(batch.items)
+        try:
+            batch.done.set_result(await self.run_batch(key, batch.items))
+        except asyncio.CancelledError:
+            batch.done.cancel()
+            raise
+        except Exception as e:
+            batch.done.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0
+        }
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+声明式分析流水线
+客户端在一个请求中列出需要的分析，规划器把它们展开为阶段依赖图：分词和词性标注各只做一次，
+TF-IDF、统计复用分词结果，TextRank关键词和主题共用同一个共现图的排序，相互独立的阶段（包括LLM调用）并发执行。
+LLM阶段在单独的线程池中执行，长时间等待远程调用不会占满传统阶段的线程。
+结果的结构与高级分析一致（LLM结果放在llm下），并附带每个阶段的耗时。
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from config import Config
+from fast_sentiment import get_sentiment_scorer
+from segmentation import get_segmenter, textrank_from_pairs, tfidf_from_tokens
+from tenant_dictionaries import get_tenant_registry
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineRequest(NamedTuple):
+    """一次流水线执行的输入"""
+    text: str
+    top_k: int = 10
+    max_length: int = 200
+    tenant: Optional[str] = None
+
+
+class Stage(NamedTuple):
+    """流水线阶段：run(request, results)读取依赖阶段的结果，返回本阶段的结果"""
+    name: str
+    deps: Tuple[str, ...]
+    run: Callable[[PipelineRequest, Dict[str, Any]], Any]
+    llm: bool = False
+
+
+class PipelineError(ValueError):
+    """请求的分析不存在等无法规划的情况"""
+
+
+def _stop_words(tenant: Optional[str]):
+    entry = get_tenant_registry().get(tenant)
+    return entry.stop_words if entry else None
+
+
+def _textrank(tenant: Optional[str]):
+    entry = get_tenant_registry().get(tenant)
+    return entry.textrank if entry else None
+
+
+class AnalysisPipeline:
+    """按依赖图执行分析阶段的流水线，analyzer提供传统方法的结果格式和LLM服务
+    传统阶段提交到executor，LLM阶段提交到llm_executor（未指定时与executor相同）"""
+
+    # 可请求的分析 -> 需要的阶段
+    ANALYSES = {
+        'sentiment': ('sentiment',),
+        'keywords': ('tfidf', 'textrank'),
+        'tfidf': ('tfidf',),
+        'textrank': ('textrank',),
+        'summary': ('summary',),
+        'statistics': ('statistics',),
+        'topics': ('topics',),
+        'llm_sentiment': ('llm_sentiment',),
+        'llm_keywords': ('llm_keywords',),
+        'llm_summary': ('llm_summary',),
+    }
+    DEFAULT_ANALYSES = ('sentiment', 'keywords', 'summary', 'statistics', 'topics')
+
+    def __init__(self, analyzer, executor: ThreadPoolExecutor, llm_executor: Optional[ThreadPoolExecutor] = None):
+        self.analyzer = analyzer
+        self.executor = executor
+        self.llm_executor = llm_executor or executor
+        self.stages: Dict[str, Stage] = {stage.name: stage for stage in (
+            Stage('tokens', (), self._tokens),
+            Stage('pos', (), self._pos),
+            Stage('tfidf', ('tokens',), self._tfidf),
+            Stage('ranking', ('pos',), self._ranking),
+            Stage('textrank', ('ranking',), self._textrank_keywords),
+            Stage('statistics', ('tokens',), self._statistics),
+            Stage('topics', ('ranking',), self._topics),
+            Stage('sentiment', (), self._sentiment),
+            Stage('summary', (), self._summary),
+            Stage('llm_sentiment', (), self._llm('sentiment'), llm=True),
+            Stage('llm_keywords', (), self._llm('keywords'), llm=True),
+            Stage('llm_summary', (), self._llm('summary'), llm=True),
+        )}
+
+    # 各阶段实现
+    def _tokens(self, request: PipelineRequest, results: Dict[str, Any]) -> List[str]:
+        """精确模式分词，不从pos阶段的结果派生：词性标注对字母数字串的切分与精确模式不同
+        （例如"123abc"切成"123"和"abc"），派生的词会使TF-IDF和统计结果与单独的接口不一致；
+        只需要分词的计划也不必承担更慢的词性标注。两个阶段相互独立，并发执行"""
+        return get_segmenter().segment(request.text, tenant=request.tenant)
+
+    def _pos(self, request: PipelineRequest, results: Dict[str, Any]) -> List[Tuple[str, str]]:
+        return get_segmenter().segment(request.text, pos=True, tenant=request.tenant)
+
+    def _tfidf(self, request: PipelineRequest, results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        keywords = tfidf_from_tokens(results['tokens'], request.top_k, _stop_words(request.tenant))
+        return [{"word": word, "weight": round(weight, 3)} for word, weight in keywords]
+
+    def _ranking(self, request: PipelineRequest, results: Dict[str, Any]) -> List[tuple]:
+        """完整的TextRank排序，关键词和主题按各自的topK截取"""
+        return textrank_from_pairs(results['pos'], None, _textrank(request.tenant))
+
+    def _textrank_keywords(self, request: PipelineRequest, results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        keywords = results['ranking'][:request.top_k]
+        return [{"word": word, "weight": round(weight, 3)} for word, weight in keywords]
+
+    def _statistics(self, request: PipelineRequest, results: Dict[str, Any]) -> Dict[str, Any]:
+        """与EnhancedTextAnalyzer._calculate_text_stats一致"""
+        words = results['tokens']
+        sentence_count = sum(1 for s in request.text.split('。') if s.strip())
+        return {
+            "char_count": len(request.text),
+            "word_count": len(words),
+            "sentence_count": sentence_count,
+            "avg_sentence_length": round(len(words) / sentence_count, 2) if sentence_count else 0,
+            "unique_words": len(set(words))
+        }
+
+    def _topics(self, request: PipelineRequest, results: Dict[str, Any]) -> Dict[str, Any]:
+        """与EnhancedTextAnalyzer._extract_topics一致"""
+        topics = results['ranking'][:5]
+        return {
+            "main_topics": [{"topic": topic, "weight": round(weight, 3)} for topic, weight in topics],
+            "topic_count": len(topics)
+        }
+
+    def _sentiment(self, request: PipelineRequest, results: Dict[str, Any]) -> Dict[str, Any]:
+        return self.analyzer._describe_sentiment(get_sentiment_scorer().score(request.text))
+
+    def _summary(self, request: PipelineRequest, results: Dict[str, Any]) -> Dict[str, Any]:
+        return self.analyzer._traditional_summary_generation(request.text, request.max_length)
+
+    def _llm(self, analysis_type: str):
+        def run(request: PipelineRequest, results: Dict[str, Any]) -> Dict[str, Any]:
+            if not self.analyzer.use_llm:
+                return {"error": "LLM服务未启用"}
+            if analysis_type == 'keywords':
+                return self.analyzer.llm_service.analyze_text(request.text, analysis_type, top_k=request.top_k)
+            if analysis_type == 'summary':
+                return self.analyzer.llm_service.analyze_text(request.text, analysis_type,
+                                                              max_length=request.max_length)
+            return self.analyzer.llm_service.analyze_text(request.text, analysis_type)
+        return run
+
+    def plan(self, analyses: Optional[Sequence[str]] = None) -> List[str]:
+        """把请求的分析展开为阶段列表（含依赖），按拓扑顺序返回"""
+        analyses = list(analyses or self.DEFAULT_ANALYSES)
+        unknown = [name for name in analyses if name not in self.ANALYSES]
+        if unknown:
+            raise PipelineError(f"不支持的分析类型：{', '.join(map(str, unknown))}，"
+                                f"可选：{', '.join(self.ANALYSES)}")
+        ordered: List[str] = []
+
+        def visit(name: str) -> None:
+            if name in ordered:
+                return
+            for dep in self.stages[name].deps:
+                visit(dep)
+            ordered.append(name)
+
+        for analysis in analyses:
+            for name in self.ANALYSES[analysis]:
+                visit(name)
+        return ordered
+
+    def llm_cost(self, plan: Sequence[str]) -> int:
+        """计划中的LLM调用数"""
+        return sum(1 for name in plan if self.stages[name].llm)
+
+    def execute(self, request: PipelineRequest, plan: Sequence[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """依赖满足的阶段立即提交到线程池，返回(各阶段结果, 各阶段计时)
+        阶段抛出异常时结果为{"error": ...}，依赖它的阶段不再执行"""
+        results: Dict[str, Any] = {}
+        failed: Dict[str, str] = {}
+        timings: Dict[str, Dict[str, float]] = {}
+        waiting = {name: set(self.stages[name].deps) for name in plan}
+        running: Dict[Future, str] = {}
+        started = time.perf_counter()
+
+        def timed(stage: Stage) -> Tuple[Any, float, float]:
+            begin = time.perf_counter()
+            value = stage.run(request, results)
+            return value, begin, time.perf_counter()
+
+        while waiting or running:
+            for name in [name for name, deps in waiting.items() if not deps - results.keys() - failed.keys()]:
+                deps = waiting.pop(name)
+                broken = [dep for dep in deps if dep in failed]
+                if broken:
+                    failed[name] = f"依赖的阶段{broken[0]}失败"
+                    continue
+                stage = self.stages[name]
+                executor = self.llm_executor if stage.llm else self.executor
+                # 复制上下文：LLM阶段按当前请求者准入
+                running[executor.submit(contextvars.copy_context().run, timed, stage)] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    value, begin, end = future.result()
+                except Exception as e:
+                    logger.warning("流水线阶段%s失败: %s", name, e)
+                    failed[name] = str(e)
+                    continue
+                results[name] = value
+                timings[name] = {
+                    "start_ms": round((begin - started) * 1000, 3),
+                    "duration_ms": round((end - begin) * 1000, 3)
+                }
+
+        for name, message in failed.items():
+            results[name] = {"error": message}
+        return results, timings
+
+    def run(self, text: str, analyses: Optional[Sequence[str]] = None, top_k: int = 10, max_length: int = 200,
+            tenant: Optional[str] = None, plan: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """执行流水线并组装结果"""
+        started = time.perf_counter()
+        plan = plan or self.plan(analyses)
+        results, timings = self.execute(PipelineRequest(text, top_k, max_length, tenant), plan)
+
+        output: Dict[str, Any] = {}
+        if 'tfidf' in results or 'textrank' in results:
+            keywords: Dict[str, Any] = {"method": "traditional"}
+            for name in ('tfidf', 'textrank'):
+                if name in results:
+                    keywords[f"{name}_keywords"] = results[name]
+            output["keywords"] = keywords
+        for name in ('sentiment', 'summary', 'statistics', 'topics'):
+            if name in results:
+                output[name] = results[name]
+        llm = {name[len('llm_'):]: results[name] for name in plan if self.stages[name].llm}
+        if llm:
+            output["llm"] = llm
+        output["analysis_method"] = "pipeline"
+        output["stages"] = list(plan)
+        output["timings"] = {
+            "stages": timings,
+            "total_ms": round((time.perf_counter() - started) * 1000, 3)
+        }
+        return output
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_llm_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_pipeline_executor() -> ThreadPoolExecutor:
+    """进程内共享的流水线线程池（传统阶段）"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config().PIPELINE_WORKERS,
+                                               thread_name_prefix='pipeline')
+    return _executor
+
+
+def get_pipeline_llm_executor() -> ThreadPoolExecutor:
+    """进程内共享的LLM阶段线程池，线程数即同时进行的流水线LLM调用数上限"""
+    global _llm_executor
+    if _llm_executor is None:
+        with _executor_lock:
+            if _llm_executor is None:
+                _llm_executor = ThreadPoolExecutor(max_workers=Config().PIPELINE_LLM_WORKERS,
+                                                   thread_name_prefix='pipeline-llm')
+    return _llm_executor
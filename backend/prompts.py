@@ -0,0 +1,218 @@
+import math
+import re
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from config import Config
+
+# 估算token数：汉字（及全角标点）约1个token，英文单词每4个字母约1.3个token，数字约每3位1个token，其余符号各1个
+_CJK = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+_LATIN_WORD = re.compile(r'[A-Za-z]+')
+_DIGITS = re.compile(r'\d+')
+_SYMBOL = re.compile(r'[^\sA-Za-z\d\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+_SENTENCE = re.compile(r'[^。！？；!?;\n]*(?:[。！？；!?;\n]+|$)')
+
+TRUNCATION_MARK = "\n……（中间内容已省略）……\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数，中英文混合文本误差一般在20%以内"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    words = sum(math.ceil(len(word) / 4) for word in _LATIN_WORD.findall(text)) * 1.3
+    digits = sum(math.ceil(len(number) / 3) for number in _DIGITS.findall(text))
+    symbols = len(_SYMBOL.findall(text))
+    return int(math.ceil(cjk + words + digits + symbols))
+
+
+def _cut_tokens(text: str, budget: int, from_end: bool = False) -> str:
+    """按token预算从开头（或结尾）截取，用于单句超长的情况"""
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        piece = text[-middle:] if from_end else text[:middle]
+        if estimate_tokens(piece) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    if not low:
+        return ''
+    return text[-low:] if from_end else text[:low]
+
+
+def truncate_text(text: str, budget: int, head_ratio: float = 0.7) -> Tuple[str, bool]:
+    """把文本压缩到token预算内：按整句保留开头和结尾，中间用省略标记代替
+    返回(处理后的文本, 是否被截断)"""
+    if estimate_tokens(text) <= budget:
+        return text, False
+    budget = max(budget - estimate_tokens(TRUNCATION_MARK), 1)
+    sentences = [s for s in _SENTENCE.findall(text) if s]
+    costs = [estimate_tokens(s) for s in sentences]
+
+    head_budget = int(budget * head_ratio)
+    head, used, i = [], 0, 0
+    while i < len(sentences) and used + costs[i] <= head_budget:
+        head.append(sentences[i])
+        used += costs[i]
+        i += 1
+    if not head:
+        # 第一句就超出预算时截取它的开头
+        head.append(_cut_tokens(sentences[0], head_budget))
+        used = estimate_tokens(head[0])
+        i = 1
+
+    tail, j = [], len(sentences) - 1
+    tail_budget = budget - used
+    while j >= i and costs[j] <= tail_budget:
+        tail.append(sentences[j])
+        tail_budget -= costs[j]
+        j -= 1
+    if not tail and j >= i and tail_budget > 0:
+        tail.append(_cut_tokens(sentences[j], tail_budget, from_end=True))
+    return ''.join(head) + TRUNCATION_MARK + ''.join(reversed(tail)), True
+
+
+class PromptUsage:
+    """累计的提示词token统计：估算值与LLM返回的实际值"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.truncated = 0
+        self.estimated_tokens = 0
+        self.input_tokens = 0
+        self.measured_calls = 0
+        self.measured_estimated_tokens = 0
+        self.actual_tokens = 0
+
+    def record(self, prompt: 'Prompt', actual_tokens: Optional[int]) -> None:
+        with self._lock:
+            self.calls += 1
+            self.truncated += int(prompt.truncated)
+            self.estimated_tokens += prompt.estimated_tokens
+            self.input_tokens += prompt.input_tokens
+            if actual_tokens:
+                self.measured_calls += 1
+                self.measured_estimated_tokens += prompt.estimated_tokens
+                self.actual_tokens += actual_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "truncated_calls": self.truncated,
+                "estimated_prompt_tokens": self.estimated_tokens,
+                "input_text_tokens": self.input_tokens,
+                "actual_prompt_tokens": self.actual_tokens,
+                # 实际/估算，用于校准估算方法；只统计返回了实际token数的调用
+                "actual_to_estimated": round(self.actual_tokens / self.measured_estimated_tokens, 3)
+                if self.measured_estimated_tokens else None
+            }
+
+
+class Prompt(NamedTuple):
+    """构建好的提示词及其token估算"""
+    text: str
+    estimated_tokens: int
+    input_tokens: int
+    truncated: bool
+
+
+class PromptTemplate:
+    """预先拼好固定部分的提示词模板，调用时只拼接文本和少量参数"""
+
+    HEADER_CACHE_SIZE = 256
+
+    def __init__(self, instructions: str, fields: List[str], head_ratio: float = 0.7,
+                 inputs: Tuple[str, ...] = ("文本内容",)):
+        self.instructions = instructions
+        self.fields = fields
+        self.head_ratio = head_ratio
+        self.inputs = inputs
+        self.suffix = "\n分析结果请以JSON格式返回，包含以下字段：\n" + "\n".join(
+            f"- {field}" for field in fields) + "\n\n请确保返回的是有效的JSON格式。"
+        self._headers: Dict[Tuple[Tuple[str, Any], ...], str] = {}
+
+    def header(self, **params) -> str:
+        """参数代入后的说明部分，相同参数只格式化一次；参数不可哈希时直接格式化，不缓存"""
+        try:
+            key = tuple(sorted(params.items()))
+            header = self._headers.get(key)
+        except TypeError:
+            return self.instructions.format(**params) + "\n\n"
+        if header is None:
+            header = self.instructions.format(**params) + "\n\n"
+            # 参数组合很少（top_k、max_length），超过上限说明参数来自任意输入，不再缓存新的组合
+            if len(self._headers) < self.HEADER_CACHE_SIZE:
+                self._headers[key] = header
+        return header
+
+    def render(self, texts: Tuple[str, ...], budget: int, **params) -> Prompt:
+        header = self.header(**params)
+        # 多段文本平分输入预算
+        share = max(budget // len(texts), 1)
+        parts, input_tokens, truncated = [], 0, False
+        for label, text in zip(self.inputs, texts):
+            input_tokens += estimate_tokens(text)
+            text, cut = truncate_text(text, share, self.head_ratio)
+            truncated = truncated or cut
+            parts.append(f"{label}：\n{text}\n")
+        prompt = header + "\n".join(parts) + self.suffix
+        return Prompt(prompt, estimate_tokens(prompt), input_tokens, truncated)
+
+
+TEMPLATES: Dict[str, PromptTemplate] = {
+    'sentiment': PromptTemplate(
+        "请对下面的文本进行情感分析。",
+        ["sentiment: 情感倾向（积极/消极/中性）",
+         "score: 情感得分（0-1之间的小数）",
+         "confidence: 置信度（高/中/低）",
+         "reasoning: 分析理由（简要说明）"],
+        head_ratio=0.5),
+    'keywords': PromptTemplate(
+        "请提取下面文本中最重要的{top_k}个关键词。",
+        ["keywords: 关键词列表，每个关键词包含word和weight字段",
+         "reasoning: 提取理由（简要说明）"]),
+    'summary': PromptTemplate(
+        "请为下面的文本生成摘要，摘要长度控制在{max_length}字以内，保持原文的核心信息和逻辑结构。",
+        ["summary: 摘要内容",
+         "length: 摘要长度",
+         "original_length: 原文长度",
+         "compression_ratio: 压缩比",
+         "key_points: 关键要点列表"]),
+    'similarity': PromptTemplate(
+        "请分析下面两段文本的相似度。",
+        ["similarity_score: 相似度得分（0-1之间的小数）",
+         "similarity_percentage: 相似度百分比",
+         "interpretation: 相似度解释（高度相似/中度相似/低度相似）",
+         "reasoning: 分析理由（简要说明）"],
+        head_ratio=0.8, inputs=("文本1", "文本2")),
+}
+
+GENERAL_TEMPLATE = PromptTemplate("请对下面的文本进行通用文本分析。", ["analysis: 分析结果"])
+
+
+def input_budget(analysis_type: str, config: Optional[Config] = None) -> int:
+    """各分析类型的输入文本token预算"""
+    config = config or Config()
+    budgets = {
+        'sentiment': config.PROMPT_BUDGET_SENTIMENT,
+        'keywords': config.PROMPT_BUDGET_KEYWORDS,
+        'summary': config.PROMPT_BUDGET_SUMMARY,
+        'similarity': config.PROMPT_BUDGET_SIMILARITY,
+    }
+    return budgets.get(analysis_type, config.PROMPT_BUDGET_DEFAULT)
+
+
+def build_prompt(text: str, analysis_type: str, budget: Optional[int] = None, **kwargs) -> Prompt:
+    """按分析类型构建提示词，输入文本超出预算时截断"""
+    budget = budget or input_budget(analysis_type)
+    template = TEMPLATES.get(analysis_type, GENERAL_TEMPLATE)
+    if analysis_type == 'keywords':
+        return template.render((text,), budget, top_k=kwargs.get('top_k', 10))
+    if analysis_type == 'summary':
+        return template.render((text,), budget, max_length=kwargs.get('max_length', 200))
+    if analysis_type == 'similarity':
+        return template.render((text, kwargs.get('text2', '')), budget)
+    return template.render((text,), budget)
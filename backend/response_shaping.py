@@ -0,0 +1,217 @@
+import gzip
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import Config
+
+try:
+    import orjson
+except ImportError:  # 未安装时使用标准库json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # 未安装时只协商gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 投影时始终保留的字段
+ALWAYS_INCLUDED = ('error',)
+
+
+def parse_fields(value: Any) -> Optional[List[Tuple[str, ...]]]:
+    """解析fields参数：逗号分隔的字符串或字符串列表，每项是用点分隔的字段路径，例如 sentiment.score"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        return None
+    paths = [tuple(part for part in str(item).strip().split('.') if part) for item in value]
+    paths = [path for path in paths if path]
+    return paths or None
+
+
+def project(data: Any, paths: Sequence[Tuple[str, ...]]) -> Any:
+    """只保留指定路径的字段；路径经过列表时对列表中每个元素投影"""
+    if isinstance(data, list):
+        return [project(item, paths) for item in data]
+    if not isinstance(data, dict):
+        return data
+    children: Dict[str, List[Tuple[str, ...]]] = {}
+    whole = set(key for key in ALWAYS_INCLUDED if key in data)
+    for path in paths:
+        if path[0] not in data:
+            continue
+        if len(path) == 1:
+            whole.add(path[0])
+        else:
+            children.setdefault(path[0], []).append(path[1:])
+    shaped = {}
+    for key in data:
+        if key in whole:
+            shaped[key] = data[key]
+        elif key in children:
+            shaped[key] = project(data[key], children[key])
+    return shaped
+
+
+def _default(value: Any) -> Any:
+    # numpy标量等
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def dumps(data: Any, fast: bool = True) -> bytes:
+    """序列化为UTF-8编码的紧凑JSON，可用时使用orjson"""
+    if fast and orjson is not None:
+        return orjson.dumps(data, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """按Accept-Encoding选择br或gzip，q值相同时优先br"""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            weights[coding] = q
+    candidates = [coding for coding in ('br', 'gzip') if coding != 'br' or brotli is not None]
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = weights.get(coding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class ResponseStats:
+    """各路由的响应大小和耗时统计，耗时分位数按最近window次计算"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, route: str, payload: int, sent: int, serialize_ms: float, compress_ms: float) -> None:
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {
+                    "responses": 0, "payload_bytes": 0, "sent_bytes": 0,
+                    "serialize_ms": deque(maxlen=self.window), "compress_ms": deque(maxlen=self.window)
+                }
+            entry["responses"] += 1
+            entry["payload_bytes"] += payload
+            entry["sent_bytes"] += sent
+            entry["serialize_ms"].append(serialize_ms)
+            entry["compress_ms"].append(compress_ms)
+
+    @staticmethod
+    def _percentile(values: Sequence[float], percentile: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)], 3)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {}
+            for route, entry in self._routes.items():
+                count = entry["responses"]
+                snapshot[route] = {
+                    "responses": count,
+                    "avg_payload_bytes": entry["payload_bytes"] // count,
+                    "avg_sent_bytes": entry["sent_bytes"] // count,
+                    # 压缩后实际发送的字节数占JSON大小的比例
+                    "sent_ratio": round(entry["sent_bytes"] / entry["payload_bytes"], 3)
+                    if entry["payload_bytes"] else None,
+                    "serialize_ms_p50": self._percentile(entry["serialize_ms"], 50),
+                    "serialize_ms_p99": self._percentile(entry["serialize_ms"], 99),
+                    "compress_ms_p99": self._percentile(entry["compress_ms"], 99)
+                }
+            return snapshot
+
+
+class ResponseShaper:
+    """分析接口的响应整形：字段投影 -> 序列化 -> 按协商结果压缩，并生成计时和大小响应头"""
+
+    def __init__(self, fast_json: bool = True, compress_min_bytes: int = 1024, gzip_level: int = 6,
+                 brotli_quality: int = 4):
+        self.fast_json = fast_json
+        self.compress_min_bytes = compress_min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.stats = ResponseStats()
+
+    def shape(self, data: Any, fields: Any = None, accept_encoding: Optional[str] = None,
+              route: str = '') -> Tuple[bytes, Dict[str, str]]:
+        """返回(响应体, 响应头)"""
+        started = time.perf_counter()
+        paths = parse_fields(fields)
+        body = dumps(project(data, paths) if paths else data, self.fast_json)
+        serialize_ms = (time.perf_counter() - started) * 1000
+
+        payload = len(body)
+        headers = {"X-Payload-Bytes": str(payload)}
+        timing = [f"serialize;dur={serialize_ms:.2f}"]
+        compress_ms = 0.0
+        if payload >= self.compress_min_bytes:
+            # 响应内容随Accept-Encoding变化，缓存需要区分
+            headers["Vary"] = "Accept-Encoding"
+            encoding = negotiate_encoding(accept_encoding)
+            if encoding is not None:
+                started = time.perf_counter()
+                body = compress(body, encoding, self.gzip_level, self.brotli_quality)
+                compress_ms = (time.perf_counter() - started) * 1000
+                headers["Content-Encoding"] = encoding
+                timing.append(f"compress;dur={compress_ms:.2f}")
+        headers["Server-Timing"] = ", ".join(timing)
+        self.stats.record(route, payload, len(body), serialize_ms, compress_ms)
+        return body, headers
+
+
+_shaper: Optional[ResponseShaper] = None
+_shaper_lock = threading.Lock()
+
+
+def get_response_shaper() -> ResponseShaper:
+    """进程内共享的响应整形器"""
+    global _shaper
+    if _shaper is None:
+        with _shaper_lock:
+            if _shaper is None:
+                config = Config()
+                _shaper = ResponseShaper(
+                    fast_json=config.RESPONSE_FAST_JSON,
+                    compress_min_bytes=config.RESPONSE_COMPRESS_MIN_BYTES,
+                    gzip_level=config.RESPONSE_GZIP_LEVEL,
+                    brotli_quality=config.RESPONSE_BROTLI_QUALITY
+                )
+                if config.RESPONSE_FAST_JSON and orjson is None:
+                    logger.info("未安装orjson，使用标准库json序列化响应")
+    return _shaper
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+关键词与情感趋势的预聚合
+保存分析记录时（同一事务中）解析结果，把关键词频次和情感得分累加到按小时和按天划分的时间桶中，
+趋势接口只读取时间桶，不再逐条解析历史记录。
+
+为已有历史（包括已归档的记录）重建时间桶：
+    python rollups.py --backfill
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, event, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+
+from history_export import parse_result
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('hour', 'day')
+SENTIMENT_LABELS = {'积极': 'positive', '中性': 'neutral', '消极': 'negative'}
+HISTOGRAM_BINS = 10
+MAX_WORD_LENGTH = 100
+
+# 支持INSERT ... ON CONFLICT DO UPDATE的数据库
+_UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def bucket_start(created_at: datetime, granularity: str) -> datetime:
+    if granularity == 'hour':
+        return created_at.replace(minute=0, second=0, microsecond=0)
+    return created_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def extract_sentiment(result: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+    """取出结果中的情感倾向和得分；综合和混合分析依次查找传统分析和LLM分析的结果"""
+    candidates = [result, result.get('sentiment')]
+    for key in ('traditional', 'llm'):
+        nested = result.get(key)
+        if isinstance(nested, dict):
+            candidates.append(nested.get('sentiment'))
+    for candidate in candidates:
+        if not isinstance(candidate, dict):
+            continue
+        label, score = candidate.get('sentiment'), candidate.get('score')
+        if isinstance(label, str) and label in SENTIMENT_LABELS and isinstance(score, (int, float)) \
+                and not isinstance(score, bool):
+            return label, min(max(float(score), 0.0), 1.0)
+    return None
+
+
+def extract_keywords(result: Dict[str, Any]) -> Dict[str, float]:
+    """取出结果中的关键词及权重，同一个词取最大权重；优先使用TF-IDF关键词"""
+    sources = [result]
+    for key in ('keywords', 'traditional', 'llm'):
+        nested = result.get(key)
+        if isinstance(nested, dict):
+            sources.append(nested)
+            if key != 'keywords' and isinstance(nested.get('keywords'), dict):
+                sources.append(nested['keywords'])
+
+    keywords: Dict[str, float] = {}
+    for source in sources:
+        items = source.get('tfidf_keywords')
+        if not isinstance(items, list):
+            items = source.get('keywords')
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get('word'), str) or not item['word'].strip():
+                continue
+            word = item['word'].strip()[:MAX_WORD_LENGTH]
+            weight = item.get('weight')
+            weight = float(weight) if isinstance(weight, (int, float)) and not isinstance(weight, bool) else 0.0
+            keywords[word] = max(keywords.get(word, 0.0), weight)
+    return keywords
+
+
+class RollupBatch:
+    """待写入的时间桶增量，相同键的增量先在内存中合并"""
+
+    def __init__(self):
+        self.keywords: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+        self.sentiment: Dict[tuple, List[float]] = defaultdict(lambda: [0] * (5 + HISTOGRAM_BINS))
+
+    def add(self, user_id: int, analysis_type: str, result: Any, created_at: datetime) -> None:
+        if isinstance(result, str):
+            result = parse_result(result)
+        if not isinstance(result, dict) or 'error' in result:
+            return
+        sentiment = extract_sentiment(result)
+        keywords = extract_keywords(result)
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(created_at, granularity)
+            for word, weight in keywords.items():
+                entry = self.keywords[(user_id, granularity, bucket, word)]
+                entry[0] += 1
+                entry[1] += weight
+            if sentiment is not None:
+                label, score = sentiment
+                entry = self.sentiment[(user_id, granularity, bucket, analysis_type)]
+                entry[0] += 1
+                entry[1] += score
+                entry[2 + ('positive', 'neutral', 'negative').index(SENTIMENT_LABELS[label])] += 1
+                entry[5 + min(int(score * HISTOGRAM_BINS), HISTOGRAM_BINS - 1)] += 1
+
+    def __len__(self) -> int:
+        return len(self.keywords) + len(self.sentiment)
+
+
+class TrendRollups:
+    """趋势时间桶的表结构、增量维护和查询"""
+
+    def __init__(self, metadata: MetaData):
+        self.keyword_table = Table(
+            'keyword_rollup', metadata,
+            Column('user_id', Integer, primary_key=True),
+            Column('granularity', String(8), primary_key=True),
+            Column('bucket', DateTime, primary_key=True),
+            Column('word', String(MAX_WORD_LENGTH), primary_key=True),
+            Column('count', Integer, nullable=False),  # 包含该关键词的分析次数
+            Column('weight', Float, nullable=False),  # 权重之和
+        )
+        self.sentiment_table = Table(
+            'sentiment_rollup', metadata,
+            Column('user_id', Integer, primary_key=True),
+            Column('granularity', String(8), primary_key=True),
+            Column('bucket', DateTime, primary_key=True),
+            Column('analysis_type', String(50), primary_key=True),
+            Column('count', Integer, nullable=False),
+            Column('score_sum', Float, nullable=False),
+            Column('positive', Integer, nullable=False),
+            Column('neutral', Integer, nullable=False),
+            Column('negative', Integer, nullable=False),
+            # 得分直方图，第i列统计得分在[i/10, (i+1)/10)之间的次数
+            *[Column(f'bin_{i}', Integer, nullable=False) for i in range(HISTOGRAM_BINS)]
+        )
+        self._sentiment_columns = ['count', 'score_sum', 'positive', 'neutral', 'negative'] + \
+            [f'bin_{i}' for i in range(HISTOGRAM_BINS)]
+
+    # ---- 写入 ----
+
+    def _upsert(self, connection: Connection, table: Table, rows: List[Dict[str, Any]], columns: List[str]) -> None:
+        """按主键累加，已有时间桶时各计数列加上增量"""
+        if not rows:
+            return
+        make_insert = _UPSERT_INSERTS.get(connection.dialect.name)
+        if make_insert is not None:
+            statement = make_insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=[column.name for column in table.primary_key.columns],
+                set_={column: table.c[column] + statement.excluded[column] for column in columns})
+            connection.execute(statement, rows)
+            return
+        # 其他数据库：先更新，没有对应时间桶时插入
+        for row in rows:
+            condition = [table.c[column.name] == row[column.name] for column in table.primary_key.columns]
+            updated = connection.execute(update(table).where(*condition).values(
+                {column: table.c[column] + row[column] for column in columns}))
+            if not updated.rowcount:
+                connection.execute(insert(table).values(row))
+
+    def write(self, connection: Connection, batch: RollupBatch) -> None:
+        keyword_rows = [
+            {"user_id": user_id, "granularity": granularity, "bucket": bucket, "word": word,
+             "count": count, "weight": weight}
+            for (user_id, granularity, bucket, word), (count, weight) in batch.keywords.items()]
+        sentiment_rows = [
+            dict(zip(self._sentiment_columns, values), user_id=user_id, granularity=granularity, bucket=bucket,
+                 analysis_type=analysis_type)
+            for (user_id, granularity, bucket, analysis_type), values in batch.sentiment.items()]
+        # 按主键排序写入，并发事务按相同顺序加锁，避免PostgreSQL死锁
+        keyword_rows.sort(key=lambda row: (row["granularity"], row["bucket"], row["word"]))
+        sentiment_rows.sort(key=lambda row: (row["granularity"], row["bucket"], row["analysis_type"]))
+        self._upsert(connection, self.keyword_table, keyword_rows, ['count', 'weight'])
+        self._upsert(connection, self.sentiment_table, sentiment_rows, self._sentiment_columns)
+
+    def install(self, model) -> None:
+        """插入分析记录时在同一事务中更新时间桶"""
+        @event.listens_for(model, 'after_insert')
+        def _rollup_analysis(mapper, connection, target):
+            batch = RollupBatch()
+            batch.add(target.user_id, target.analysis_type, target.result, target.created_at)
+            if len(batch):
+                self.write(connection, batch)
+
+    def backfill(self, engine: Engine, table, archived: Iterable = (), batch_size: int = 1000) -> int:
+        """清空并按全部历史重建时间桶，archived为按ID顺序排列的已归档记录，返回处理的记录数"""
+        processed = 0
+        with engine.begin() as connection:
+            connection.execute(self.keyword_table.delete())
+            connection.execute(self.sentiment_table.delete())
+
+            batch = RollupBatch()
+            last_archived_id = 0
+            for row in archived:
+                last_archived_id = row.id
+                batch.add(row.user_id, row.analysis_type, row.result, row.created_at)
+                processed += 1
+                if processed % batch_size == 0:
+                    self.write(connection, batch)
+                    batch = RollupBatch()
+
+            # 已归档但还没从热表删除的行只按归档记录计入
+            query = select(table.c.user_id, table.c.analysis_type, table.c.result, table.c.created_at) \
+                .where(table.c.id > last_archived_id) \
+                .order_by(table.c.id).execution_options(yield_per=batch_size)
+            for row in connection.execute(query):
+                batch.add(row.user_id, row.analysis_type, row.result, row.created_at)
+                processed += 1
+                if processed % batch_size == 0:
+                    self.write(connection, batch)
+                    batch = RollupBatch()
+            self.write(connection, batch)
+        return processed
+
+    # ---- 查询 ----
+
+    @staticmethod
+    def default_range(granularity: str, start: Optional[datetime], end: Optional[datetime]) -> Tuple[datetime, datetime]:
+        """未指定时间范围时：按小时查询最近48小时，按天查询最近7天"""
+        end = end or datetime.utcnow()
+        start = start or end - (timedelta(hours=48) if granularity == 'hour' else timedelta(days=7))
+        return bucket_start(start, granularity), end
+
+    def top_keywords(self, connection: Connection, user_id: int, granularity: str, start: datetime, end: datetime,
+                     top_k: int = 10) -> List[Dict[str, Any]]:
+        table = self.keyword_table
+        count = func.sum(table.c.count).label('count')
+        query = select(table.c.word, count, func.sum(table.c.weight).label('weight')) \
+            .where(table.c.user_id == user_id, table.c.granularity == granularity,
+                   table.c.bucket >= start, table.c.bucket < end) \
+            .group_by(table.c.word).order_by(count.desc(), table.c.word).limit(top_k)
+        return [{"word": row.word, "count": int(row.count), "weight": round(float(row.weight), 3)}
+                for row in connection.execute(query)]
+
+    def keyword_series(self, connection: Connection, user_id: int, granularity: str, start: datetime, end: datetime,
+                       words: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """指定关键词在每个时间桶中的出现次数"""
+        table = self.keyword_table
+        query = select(table.c.word, table.c.bucket, table.c.count) \
+            .where(table.c.user_id == user_id, table.c.granularity == granularity,
+                   table.c.bucket >= start, table.c.bucket < end, table.c.word.in_(words)) \
+            .order_by(table.c.bucket)
+        series: Dict[str, List[Dict[str, Any]]] = {word: [] for word in words}
+        for row in connection.execute(query):
+            series[row.word].append({"bucket": row.bucket.strftime("%Y-%m-%d %H:%M:%S"), "count": row.count})
+        return series
+
+    def sentiment_series(self, connection: Connection, user_id: int, granularity: str, start: datetime,
+                         end: datetime, analysis_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """每个时间桶的情感统计：次数、平均得分、各倾向次数和得分直方图；不指定类型时合并所有类型"""
+        table = self.sentiment_table
+        query = select(table).where(table.c.user_id == user_id, table.c.granularity == granularity,
+                                    table.c.bucket >= start, table.c.bucket < end)
+        if analysis_type:
+            query = query.where(table.c.analysis_type == analysis_type)
+        buckets: Dict[datetime, List[float]] = {}
+        for row in connection.execute(query.order_by(table.c.bucket)):
+            values = buckets.setdefault(row.bucket, [0] * len(self._sentiment_columns))
+            for i, column in enumerate(self._sentiment_columns):
+                values[i] += row._mapping[column]
+
+        series = []
+        for bucket, values in buckets.items():
+            item = dict(zip(self._sentiment_columns, values))
+            series.append({
+                "bucket": bucket.strftime("%Y-%m-%d %H:%M:%S"),
+                "count": item["count"],
+                "avg_score": round(item["score_sum"] / item["count"], 3) if item["count"] else None,
+                "positive": item["positive"],
+                "neutral": item["neutral"],
+                "negative": item["negative"],
+                "histogram": [item[f'bin_{i}'] for i in range(HISTOGRAM_BINS)]
+            })
+        return series
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='趋势时间桶')
+    parser.add_argument('--backfill', action='store_true', help='按全部历史（包括已归档记录）重建时间桶')
+    args = parser.parse_args()
+
+    from app import app, db, Analysis, archiver, trend_rollups
+    with app.app_context():
+        if args.backfill:
+            db.create_all()
+            archived = archiver.store.iter_records() if archiver else ()
+            print(f"✅ 已处理 {trend_rollups.backfill(db.engine, Analysis.__table__, archived)} 条记录")
+        else:
+            parser.print_help()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分析历史全文检索
+分析文本和结果中的关键字段（情感、关键词、摘要等）经jieba搜索模式分词后写入倒排索引：
+- SQLite：FTS5虚拟表，按bm25排序
+- PostgreSQL：tsvector列加GIN索引，按ts_rank排序
+
+索引在插入分析记录时（同一事务中）增量维护，记录被归档时删除对应索引。
+为已有数据建立索引：
+    python search_index.py --rebuild
+"""
+
+import logging
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import jieba
+from sqlalchemy import event, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from history_export import parse_result
+
+logger = logging.getLogger(__name__)
+
+# 索引中的时间统一为固定宽度格式，字符串比较即时间比较
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# 结果中参与索引的字段（嵌套的traditional、llm等结果会逐层查找这些字段）
+RESULT_FIELDS = frozenset({
+    'sentiment', 'summary', 'keywords', 'tfidf_keywords', 'textrank_keywords', 'topics', 'key_points',
+    'interpretation',
+})
+
+_WORD = re.compile(r'\w')
+
+
+def tokenize(value: str) -> List[str]:
+    """jieba搜索模式分词（长词同时输出其中的短词），去掉标点和空白，英文转小写"""
+    return [token.lower() for token in jieba.cut_for_search(value) if _WORD.search(token)]
+
+
+def result_terms(result: Any) -> List[str]:
+    """从分析结果中取出需要索引的文本"""
+    terms: List[str] = []
+
+    def walk(value: Any, indexed: bool) -> None:
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(item, indexed or key in RESULT_FIELDS)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                walk(item, indexed)
+        elif indexed and isinstance(value, str):
+            terms.append(value)
+
+    walk(parse_result(result) if isinstance(result, str) else result, False)
+    return terms
+
+
+def build_document(text_value: str, result: Any) -> str:
+    """索引文档：空格分隔的词序列"""
+    tokens = tokenize(text_value)
+    for term in result_terms(result):
+        tokens.extend(tokenize(term))
+    return ' '.join(tokens)
+
+
+def _quote(token: str) -> str:
+    return '"' + token.replace('"', '""') + '"'
+
+
+class _SQLiteBackend:
+    """FTS5：owner列只存用户标记，用列过滤把用户条件并入倒排索引查询"""
+
+    def create(self, connection: Connection) -> bool:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='analysis_fts'").first()
+        if exists:
+            return False
+        connection.exec_driver_sql(
+            "CREATE VIRTUAL TABLE analysis_fts USING fts5("
+            "tokens, owner, analysis_type UNINDEXED, created_at UNINDEXED, tokenize='unicode61')")
+        return True
+
+    def insert(self, connection: Connection, rows: List[Dict[str, Any]]) -> None:
+        connection.execute(text(
+            "INSERT OR REPLACE INTO analysis_fts(rowid, tokens, owner, analysis_type, created_at) "
+            "VALUES (:id, :document, :owner, :analysis_type, :created_at)"
+        ), [dict(row, owner=f"u{row['user_id']}") for row in rows])
+
+    def delete(self, connection: Connection, ids: List[int]) -> None:
+        connection.execute(text("DELETE FROM analysis_fts WHERE rowid = :id"), [{"id": i} for i in ids])
+
+    def search(self, connection: Connection, user_id: int, tokens: List[str], filters: Dict[str, Any],
+               limit: int, offset: int) -> Tuple[int, List[Tuple[int, float]]]:
+        match = f"owner:u{user_id} AND tokens:({' AND '.join(_quote(token) for token in tokens)})"
+        where = ["analysis_fts MATCH :match"]
+        params: Dict[str, Any] = {"match": match, "limit": limit, "offset": offset}
+        if filters.get("analysis_type"):
+            where.append("analysis_type = :analysis_type")
+            params["analysis_type"] = filters["analysis_type"]
+        if filters.get("start"):
+            where.append("created_at >= :start")
+            params["start"] = filters["start"]
+        if filters.get("end"):
+            where.append("created_at < :end")
+            params["end"] = filters["end"]
+        condition = " AND ".join(where)
+        total = connection.execute(text(f"SELECT count(*) FROM analysis_fts WHERE {condition}"), params).scalar()
+        # bm25越小越相关；owner等列权重为0，只按正文计算
+        rows = connection.execute(text(
+            f"SELECT rowid, bm25(analysis_fts, 1.0, 0.0) AS rank FROM analysis_fts WHERE {condition} "
+            f"ORDER BY rank, rowid DESC LIMIT :limit OFFSET :offset"
+        ), params).all()
+        return total, [(row[0], -row[1]) for row in rows]
+
+
+class _PostgresBackend:
+    """tsvector + GIN索引，使用simple配置（分词已由jieba完成）"""
+
+    def create(self, connection: Connection) -> bool:
+        exists = connection.exec_driver_sql("SELECT to_regclass('analysis_search')").scalar()
+        if exists:
+            return False
+        connection.exec_driver_sql(
+            "CREATE TABLE analysis_search ("
+            "analysis_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, analysis_type VARCHAR(50) NOT NULL, "
+            "created_at VARCHAR(26) NOT NULL, document TSVECTOR NOT NULL)")
+        connection.exec_driver_sql("CREATE INDEX ix_analysis_search_document ON analysis_search USING GIN (document)")
+        connection.exec_driver_sql("CREATE INDEX ix_analysis_search_user ON analysis_search (user_id, created_at)")
+        return True
+
+    def insert(self, connection: Connection, rows: List[Dict[str, Any]]) -> None:
+        connection.execute(text(
+            "INSERT INTO analysis_search (analysis_id, user_id, analysis_type, created_at, document) "
+            "VALUES (:id, :user_id, :analysis_type, :created_at, to_tsvector('simple', :document)) "
+            "ON CONFLICT (analysis_id) DO UPDATE SET document = EXCLUDED.document"
+        ), rows)
+
+    def delete(self, connection: Connection, ids: List[int]) -> None:
+        connection.execute(text("DELETE FROM analysis_search WHERE analysis_id = ANY(:ids)"), {"ids": list(ids)})
+
+    def search(self, connection: Connection, user_id: int, tokens: List[str], filters: Dict[str, Any],
+               limit: int, offset: int) -> Tuple[int, List[Tuple[int, float]]]:
+        where = ["user_id = :user_id", "document @@ plainto_tsquery('simple', :query)"]
+        params: Dict[str, Any] = {"user_id": user_id, "query": ' '.join(tokens), "limit": limit, "offset": offset}
+        if filters.get("analysis_type"):
+            where.append("analysis_type = :analysis_type")
+            params["analysis_type"] = filters["analysis_type"]
+        if filters.get("start"):
+            where.append("created_at >= :start")
+            params["start"] = filters["start"]
+        if filters.get("end"):
+            where.append("created_at < :end")
+            params["end"] = filters["end"]
+        condition = " AND ".join(where)
+        total = connection.execute(text(f"SELECT count(*) FROM analysis_search WHERE {condition}"), params).scalar()
+        rows = connection.execute(text(
+            f"SELECT analysis_id, ts_rank(document, plainto_tsquery('simple', :query)) AS rank "
+            f"FROM analysis_search WHERE {condition} ORDER BY rank DESC, analysis_id DESC LIMIT :limit OFFSET :offset"
+        ), params).all()
+        return total, [(row[0], float(row[1])) for row in rows]
+
+
+_BACKENDS = {'sqlite': _SQLiteBackend, 'postgresql': _PostgresBackend}
+
+
+class SearchIndex:
+    """分析记录的全文索引"""
+
+    def __init__(self, table):
+        self.table = table
+        self._backends: Dict[str, Any] = {}
+        # 已确认索引表存在的数据库
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    def _backend(self, connection: Connection):
+        name = connection.dialect.name
+        backend = self._backends.get(name)
+        if backend is None:
+            backend_class = _BACKENDS.get(name)
+            if backend_class is None:
+                return None
+            backend = self._backends[name] = backend_class()
+        return backend
+
+    def supported(self, connection: Connection) -> bool:
+        return connection.dialect.name in _BACKENDS
+
+    def ensure_schema(self, connection: Connection) -> bool:
+        """创建索引表，返回是否新建"""
+        key = str(connection.engine.url)
+        if key in self._ready:
+            return False
+        backend = self._backend(connection)
+        if backend is None:
+            return False
+        with self._lock:
+            created = backend.create(connection)
+            self._ready.add(key)
+        return created
+
+    @staticmethod
+    def _row(analysis_id: int, user_id: int, analysis_type: str, text_value: str, result: Any,
+             created_at: datetime) -> Dict[str, Any]:
+        return {
+            "id": analysis_id,
+            "user_id": user_id,
+            "analysis_type": analysis_type,
+            "created_at": created_at.strftime(TIME_FORMAT),
+            "document": build_document(text_value, result)
+        }
+
+    def add(self, connection: Connection, analysis_id: int, user_id: int, analysis_type: str, text_value: str,
+            result: Any, created_at: datetime) -> None:
+        backend = self._backend(connection)
+        if backend is None:
+            return
+        self.ensure_schema(connection)
+        backend.insert(connection, [self._row(analysis_id, user_id, analysis_type, text_value, result, created_at)])
+
+    def delete(self, connection: Connection, ids: List[int]) -> None:
+        backend = self._backend(connection)
+        if backend is not None and ids:
+            self.ensure_schema(connection)
+            backend.delete(connection, ids)
+
+    def install(self, model) -> None:
+        """插入分析记录时在同一事务中写入索引"""
+        @event.listens_for(model, 'after_insert')
+        def _index_analysis(mapper, connection, target):
+            self.add(connection, target.id, target.user_id, target.analysis_type, target.text, target.result,
+                     target.created_at)
+
+    def prepare(self, engine: Engine) -> int:
+        """启动时调用：创建索引表，新建时为已有记录建立索引"""
+        with engine.begin() as connection:
+            if not self.supported(connection) or not self.ensure_schema(connection):
+                return 0
+        indexed = self.rebuild(engine)
+        logger.info(f"全文索引已建立，索引{indexed}条记录")
+        return indexed
+
+    def rebuild(self, engine: Engine, batch_size: int = 500) -> int:
+        """为热表中的全部记录重建索引，返回索引的记录数"""
+        table = self.table
+        indexed = 0
+        last_id = 0
+        with engine.begin() as connection:
+            self.ensure_schema(connection)
+        while True:
+            query = select(table.c.id, table.c.user_id, table.c.analysis_type, table.c.text, table.c.result,
+                           table.c.created_at).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+            with engine.begin() as connection:
+                rows = connection.execute(query).all()
+                if not rows:
+                    break
+                self._backend(connection).insert(connection, [self._row(*row) for row in rows])
+            indexed += len(rows)
+            last_id = rows[-1].id
+        return indexed
+
+    def search(self, connection: Connection, user_id: int, query: str, analysis_type: Optional[str] = None,
+               start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = 20,
+               offset: int = 0) -> Tuple[int, List[Tuple[int, float]]]:
+        """返回(匹配总数, [(分析记录ID, 相关度)])，查询词之间是“与”的关系"""
+        backend = self._backend(connection)
+        if backend is None:
+            raise NotImplementedError(f"{connection.dialect.name}数据库不支持全文检索")
+        tokens = [token.lower() for token in jieba.cut(query) if _WORD.search(token)]
+        if not tokens:
+            return 0, []
+        self.ensure_schema(connection)
+        filters = {
+            "analysis_type": analysis_type,
+            "start": start.strftime(TIME_FORMAT) if start else None,
+            "end": end.strftime(TIME_FORMAT) if end else None
+        }
+        return backend.search(connection, user_id, list(dict.fromkeys(tokens)), filters, limit, offset)
+
+
+def make_snippet(text_value: str, query: str, width: int = 60) -> str:
+    """截取正文中第一个查询词附近的片段"""
+    if len(text_value) <= width * 2:
+        return text_value
+    positions = [text_value.find(token) for token in jieba.cut(query) if _WORD.search(token)]
+    positions = [position for position in positions if position >= 0]
+    if not positions:
+        return text_value[:width * 2] + "..."
+    begin = max(min(positions) - width // 2, 0)
+    snippet = text_value[begin:begin + width * 2]
+    return ("..." if begin else "") + snippet + ("..." if begin + width * 2 < len(text_value) else "")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='分析历史全文索引')
+    parser.add_argument('--rebuild', action='store_true', help='为热表中的全部记录重建索引')
+    args = parser.parse_args()
+
+    from app import app, db, search_index
+    with app.app_context():
+        if args.rebuild:
+            print(f"✅ 已索引 {search_index.rebuild(db.engine)} 条记录")
+        else:
+            parser.print_help()
@@ -0,0 +1,201 @@
+import atexit
+import logging
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from operator import itemgetter
+from typing import AbstractSet, Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import jieba
+import jieba.analyse
+import jieba.posseg
+
+from config import Config
+from tenant_dictionaries import get_tenant_registry
+from textrank import SparseTextRank
+
+logger = logging.getLogger(__name__)
+
+# 在这些字符之后切分长文本：它们都不属于jieba的切词字符集，切分前后的分词结果完全一致
+_CHUNK_BOUNDARY = re.compile(r'(?<=[。！？；!?;\n])')
+
+
+def _segment_chunks(chunks: List[str], pos: bool, tenant: Optional[str] = None) -> List[list]:
+    """执行分词，pos=True时返回(词, 词性)元组；指定租户时使用租户词典（在各工作进程中懒加载）"""
+    entry = get_tenant_registry().get(tenant) if tenant is not None else None
+    if pos:
+        pos_tokenizer = entry.pos_tokenizer if entry else jieba.posseg.dt
+        return [[(pair.word, pair.flag) for pair in pos_tokenizer.cut(chunk)] for chunk in chunks]
+    tokenizer = entry.tokenizer if entry else jieba.dt
+    return [tokenizer.lcut(chunk) for chunk in chunks]
+
+
+def _init_worker() -> None:
+    # spawn/forkserver方式启动的工作进程在这里加载词典
+    jieba.initialize()
+
+
+def default_start_method() -> str:
+    """进程池默认的启动方式：服务进程中有多个线程（Web请求、后台探测等），
+    fork可能复制其他线程持有的锁导致工作进程死锁，因此优先使用forkserver，不支持时使用spawn"""
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def split_chunks(text: str, chunk_size: int) -> List[str]:
+    """按句子边界把长文本切成不超过chunk_size（单句过长时除外）的片段"""
+    if len(text) <= chunk_size:
+        return [text]
+    chunks, current, current_len = [], [], 0
+    for sentence in _CHUNK_BOUNDARY.split(text):
+        if current and current_len + len(sentence) > chunk_size:
+            chunks.append(''.join(current))
+            current, current_len = [], 0
+        current.append(sentence)
+        current_len += len(sentence)
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+
+class SegmentationService:
+    """分词服务：短文本在当前线程分词，长文本和大批量文本分发到进程池并行分词"""
+
+    def __init__(self, workers: int = 0, parallel_threshold: int = 20000, chunk_size: int = 5000,
+                 start_method: Optional[str] = None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.parallel_threshold = parallel_threshold
+        self.chunk_size = chunk_size
+        self.start_method = start_method or default_start_method()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                if self.start_method == 'fork':
+                    # 显式使用fork时先在父进程加载词典，工作进程共享同一份内存
+                    jieba.initialize()
+                context = multiprocessing.get_context(self.start_method)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                 initializer=_init_worker)
+                logger.info(f"分词进程池已启动，工作进程数: {self.workers}")
+            return self._pool
+
+    def _reset_pool(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def _run_parallel(self, chunks: List[str], pos: bool, tenant: Optional[str]) -> List[list]:
+        # 每个任务包含若干片段，减少进程间通信次数
+        per_task = max(1, len(chunks) // (self.workers * 4))
+        tasks = [chunks[i:i + per_task] for i in range(0, len(chunks), per_task)]
+        for attempt in range(2):
+            try:
+                pool = self._get_pool()
+                results = []
+                for part in pool.map(_segment_chunks, tasks, [pos] * len(tasks), [tenant] * len(tasks)):
+                    results.extend(part)
+                return results
+            except BrokenProcessPool:
+                # 工作进程异常退出时重建进程池并重试一次
+                logger.warning("分词进程池异常，正在重建")
+                self._reset_pool()
+                if attempt:
+                    raise
+        return []
+
+    def segment(self, text: str, pos: bool = False, tenant: Optional[str] = None) -> list:
+        """对单个文本分词，结果与jieba.lcut / jieba.posseg.cut一致"""
+        return self.segment_many([text], pos=pos, tenant=tenant)[0]
+
+    def segment_many(self, texts: Sequence[str], pos: bool = False, tenant: Optional[str] = None) -> List[list]:
+        """批量分词，总长度超过阈值时使用进程池"""
+        if sum(len(text) for text in texts) < self.parallel_threshold or self.workers <= 1:
+            return _segment_chunks(list(texts), pos, tenant)
+
+        # 长文本按句子边界切片，记录每个片段属于哪个文本，分词后再拼接
+        chunks, owners = [], []
+        for index, text in enumerate(texts):
+            for chunk in split_chunks(text, self.chunk_size):
+                chunks.append(chunk)
+                owners.append(index)
+        results: List[list] = [[] for _ in texts]
+        for owner, tokens in zip(owners, self._run_parallel(chunks, pos, tenant)):
+            results[owner].extend(tokens)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "pool_started": self._pool is not None,
+            "parallel_threshold": self.parallel_threshold,
+            "chunk_size": self.chunk_size
+        }
+
+
+def normalize_tokens(tokens: Sequence[str]) -> List[str]:
+    """相似度计算用的词：转小写、只保留字母数字，丢弃空白和标点"""
+    words = (''.join(c for c in token.lower() if c.isalnum()) for token in tokens)
+    return [word for word in words if word]
+
+
+def tfidf_from_tokens(tokens: Sequence[str], top_k: int = 20, stop_words: Optional[AbstractSet[str]] = None) -> List[tuple]:
+    """基于已分词结果的TF-IDF关键词，与jieba.analyse.extract_tags(withWeight=True)结果一致
+    stop_words为额外的停用词（如租户停用词表）"""
+    counts: Dict[str, int] = {}
+    for word in tokens:
+        counts[word] = counts.get(word, 0) + 1
+    return tfidf_from_counts(counts, top_k, stop_words)
+
+
+def tfidf_from_counts(counts: Mapping[str, int], top_k: int = 20, stop_words: Optional[AbstractSet[str]] = None) -> List[tuple]:
+    """基于词频的TF-IDF关键词，counts需按词首次出现的顺序排列，权重相同时的顺序才与jieba一致"""
+    tfidf = jieba.analyse.default_tfidf
+    extra_stop_words = stop_words or frozenset()
+    freq: Dict[str, float] = {}
+    for word, count in counts.items():
+        if len(word.strip()) < 2 or word.lower() in tfidf.stop_words or word.lower() in extra_stop_words:
+            continue
+        freq[word] = float(count)
+    total = sum(freq.values())
+    for word in freq:
+        freq[word] *= tfidf.idf_freq.get(word, tfidf.median_idf) / total
+    tags = sorted(freq.items(), key=itemgetter(1), reverse=True)
+    return tags[:top_k] if top_k else tags
+
+
+def textrank_from_pairs(pairs: Sequence[Tuple[str, str]], top_k: Optional[int] = 20,
+                        textrank: Optional[jieba.analyse.TextRank] = None) -> List[tuple]:
+    """基于已有词性标注结果的TextRank关键词（稀疏矩阵实现），停用词取自textrank；top_k为空时返回完整排序"""
+    return SparseTextRank.from_jieba(textrank).extract(pairs, top_k)
+
+
+_segmenter: Optional[SegmentationService] = None
+_segmenter_lock = threading.Lock()
+
+
+def get_segmenter() -> SegmentationService:
+    """进程内共享的分词服务，按Config配置创建"""
+    global _segmenter
+    if _segmenter is None:
+        with _segmenter_lock:
+            if _segmenter is None:
+                config = Config()
+                _segmenter = SegmentationService(
+                    workers=config.SEGMENT_WORKERS,
+                    parallel_threshold=config.SEGMENT_PARALLEL_THRESHOLD,
+                    chunk_size=config.SEGMENT_CHUNK_SIZE,
+                    start_method=config.SEGMENT_START_METHOD or None
+                )
+                atexit.register(_segmenter.shutdown)
+    return _segmenter
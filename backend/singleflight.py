@@ -0,0 +1,114 @@
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def make_flight_key(text: str, analysis_type: str, params: Optional[Dict[str, Any]] = None, provider: str = 'traditional') -> str:
+    """由文本哈希、分析类型、参数和提供商生成合并键"""
+    text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    meta = json.dumps([analysis_type, provider, params or {}], sort_keys=True, ensure_ascii=False, default=str)
+    return f"{text_hash}:{hashlib.sha256(meta.encode('utf-8')).hexdigest()}"
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并相同的并发请求：同一个键同时只执行一次，其余调用等待并共享结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # 每个等待者拿到独立副本，避免调用方修改共享结果
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return copy.deepcopy(call.result) if call.waiters else call.result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._calls), "executed": self.executed, "coalesced": self.coalesced}
+
+
+class _AsyncCall:
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 1
+        self.shared = False
+
+
+class AsyncSingleFlight:
+    """SingleFlight的asyncio版本，只能在同一个事件循环中使用。
+    计算在独立的任务中执行，不属于任何一个等待者：某个等待者断开时计算继续，所有等待者都断开后才取消"""
+
+    def __init__(self):
+        self._calls: Dict[str, _AsyncCall] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def _forget(self, key: str, call: _AsyncCall) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is not None:
+            call.waiters += 1
+            call.shared = True
+            self.coalesced += 1
+        else:
+            call = _AsyncCall(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            self.executed += 1
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+
+        try:
+            # shield：某个等待者被取消时不影响正在执行的计算
+            result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+            raise
+        # 多个等待者共享结果时各自拿到独立副本
+        return copy.deepcopy(result) if call.shared else result
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "executed": self.executed, "coalesced": self.coalesced}
@@ -0,0 +1,212 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import ChainMap, OrderedDict
+from typing import Any, Dict, FrozenSet, Optional
+
+import jieba
+import jieba.analyse
+import jieba.posseg
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_TENANT_NAME = re.compile(r'^[A-Za-z0-9_\-]+$')
+
+
+class OverlayTokenizer(jieba.Tokenizer):
+    """在共享的默认词典上叠加租户词条的分词器
+    默认词典只读共享（ChainMap的底层），租户新增的词条只写入第一层，不会影响全局jieba。"""
+
+    def __init__(self, base: jieba.Tokenizer):
+        super().__init__(base.dictionary)
+        base.check_initialized()
+        self.FREQ = ChainMap({}, base.FREQ)
+        self.total = base.total
+        self.initialized = True
+
+    def initialize(self, dictionary=None):
+        # 已基于共享词典完成初始化，不重新加载
+        pass
+
+    def add_word(self, word, freq=None, tag=None):
+        """与jieba.Tokenizer.add_word相同，但freq为0时不修改全局HMM的强制切分表"""
+        word = jieba.strdecode(word)
+        freq = int(freq) if freq is not None else self.suggest_freq(word, False)
+        self.FREQ[word] = freq
+        self.total += freq
+        if tag:
+            self.user_word_tag_tab[word] = tag
+        for ch in range(len(word)):
+            wfrag = word[:ch + 1]
+            if wfrag not in self.FREQ:
+                self.FREQ[wfrag] = 0
+
+    @property
+    def overlay(self) -> Dict[str, int]:
+        return self.FREQ.maps[0]
+
+
+class OverlayPOSTokenizer(jieba.posseg.POSTokenizer):
+    """共享默认词性表的词性标注分词器"""
+
+    def __init__(self, tokenizer: OverlayTokenizer, base: jieba.posseg.POSTokenizer):
+        self.tokenizer = tokenizer
+        self.word_tag_tab = ChainMap({}, base.word_tag_tab)
+
+    def initialize(self, dictionary=None):
+        pass
+
+
+class TenantDictionary:
+    """一个租户已加载的分词器、词性分词器、停用词和TextRank实例"""
+
+    def __init__(self, tenant: str, directory: str):
+        self.tenant = tenant
+        self.directory = directory
+        self.signature = self._signature(directory)
+        self.tokenizer = OverlayTokenizer(jieba.dt)
+        self.pos_tokenizer = OverlayPOSTokenizer(self.tokenizer, jieba.posseg.dt)
+        self.stop_words: FrozenSet[str] = frozenset()
+
+        userdict = os.path.join(directory, 'userdict.txt')
+        if os.path.exists(userdict):
+            self.tokenizer.load_userdict(userdict)
+        stopwords = os.path.join(directory, 'stopwords.txt')
+        if os.path.exists(stopwords):
+            with open(stopwords, 'r', encoding='utf-8') as f:
+                self.stop_words = frozenset(line.strip() for line in f if line.strip())
+
+        self.textrank = jieba.analyse.TextRank()
+        self.textrank.tokenizer = self.textrank.postokenizer = self.pos_tokenizer
+        self.textrank.stop_words = self.textrank.stop_words | self.stop_words
+        self.memory_bytes = self._estimate_memory()
+        self.loaded_at = time.time()
+
+    @staticmethod
+    def _signature(directory: str):
+        """词典文件的修改时间和大小，用于判断是否需要重新加载"""
+        signature = []
+        for name in ('userdict.txt', 'stopwords.txt'):
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                signature.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def is_stale(self) -> bool:
+        return self._signature(self.directory) != self.signature
+
+    def _estimate_memory(self) -> int:
+        # 只统计租户独有的数据，共享的默认词典不计入
+        overlay = self.tokenizer.overlay
+        size = sys.getsizeof(overlay) + sum(sys.getsizeof(word) + 28 for word in overlay)
+        tags = dict(self.pos_tokenizer.word_tag_tab.maps[0])
+        tags.update(self.tokenizer.user_word_tag_tab)
+        size += sys.getsizeof(tags) + sum(sys.getsizeof(word) + sys.getsizeof(tag) for word, tag in tags.items())
+        size += sys.getsizeof(self.stop_words) + sum(sys.getsizeof(word) for word in self.stop_words)
+        return size
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "tenant": self.tenant,
+            "words": len(self.tokenizer.overlay),
+            "stop_words": len(self.stop_words),
+            "memory_bytes": self.memory_bytes,
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded_at))
+        }
+
+
+class TenantDictionaryRegistry:
+    """按租户懒加载词典，最近最少使用的租户在超出数量或内存上限时被淘汰"""
+
+    def __init__(self, dict_dir: str, max_tenants: int = 32, max_memory_mb: float = 256.0):
+        self.dict_dir = dict_dir
+        self.max_tenants = max_tenants
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self._entries: "OrderedDict[str, TenantDictionary]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self.memory_bytes = 0
+
+    def _directory(self, tenant: str) -> Optional[str]:
+        if not self.dict_dir or not _TENANT_NAME.match(tenant):
+            return None
+        directory = os.path.join(self.dict_dir, tenant)
+        return directory if os.path.isdir(directory) else None
+
+    def get(self, tenant: Optional[str]) -> Optional[TenantDictionary]:
+        """返回租户词典，租户没有自定义词典时返回None（使用全局默认分词器）"""
+        if tenant is None:
+            return None
+        tenant = str(tenant)
+        directory = self._directory(tenant)
+        if directory is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is not None and not entry.is_stale():
+                self._entries.move_to_end(tenant)
+                return entry
+            loading = self._loading.setdefault(tenant, threading.Lock())
+
+        # 同一租户只加载一次，其他请求等待加载完成
+        with loading:
+            with self._lock:
+                entry = self._entries.get(tenant)
+                if entry is not None and not entry.is_stale():
+                    return entry
+            start = time.monotonic()
+            entry = TenantDictionary(tenant, directory)
+            logger.info(f"租户词典已加载: {tenant}，{len(entry.tokenizer.overlay)}个词条，"
+                        f"耗时{time.monotonic() - start:.2f}秒")
+            with self._lock:
+                old = self._entries.pop(tenant, None)
+                if old is not None:
+                    self.memory_bytes -= old.memory_bytes
+                self._entries[tenant] = entry
+                self.memory_bytes += entry.memory_bytes
+                self._evict()
+                self._loading.pop(tenant, None)
+        return entry
+
+    def _evict(self) -> None:
+        # 至少保留刚加载的租户
+        while len(self._entries) > 1 and (len(self._entries) > self.max_tenants or
+                                          self.memory_bytes > self.max_memory_bytes):
+            tenant, entry = self._entries.popitem(last=False)
+            self.memory_bytes -= entry.memory_bytes
+            logger.info(f"租户词典已淘汰: {tenant}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tenants": [entry.info() for entry in self._entries.values()],
+                "memory_bytes": self.memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "max_tenants": self.max_tenants
+            }
+
+
+_registry: Optional[TenantDictionaryRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_tenant_registry() -> TenantDictionaryRegistry:
+    """进程内共享的租户词典注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                config = Config()
+                _registry = TenantDictionaryRegistry(
+                    config.TENANT_DICT_DIR,
+                    max_tenants=config.TENANT_DICT_MAX_TENANTS,
+                    max_memory_mb=config.TENANT_DICT_MAX_MEMORY_MB
+                )
+    return _registry
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 后端模块按扁平结构互相导入（from config import Config），测试从backend目录导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from archive import ArchiveStore, Archiver, format_time
+
+
+def _records(first_id, count, user_id=1):
+    created = datetime(2024, 1, 1)
+    return [{"id": i, "user_id": user_id, "analysis_type": "sentiment", "text": f"文本{i}",
+             "result": "{}", "created_at": format_time(created + timedelta(minutes=i))}
+            for i in range(first_id, first_id + count)]
+
+
+def _ids(store):
+    return [record.id for record in store.iter_records()]
+
+
+def test_merged_segment_hides_replaced_segments(tmp_path):
+    store = ArchiveStore(str(tmp_path), block_records=4)
+    first = store.write_segment(_records(1, 5))
+    second = store.write_segment(_records(6, 5))
+    # 合并段已写入、旧段还没删除（或合并中途退出）：读者只看到合并段
+    store.write_segment(_records(1, 10), replaces=[first.name, second.name])
+    assert _ids(ArchiveStore(str(tmp_path))) == list(range(1, 11))
+    assert store.counts(1) == {"sentiment": 10}
+    assert [segment.name for segment in store.superseded()] == [first.name, second.name]
+
+
+def test_compact_merges_and_cleans_up(tmp_path):
+    store = ArchiveStore(str(tmp_path), block_records=4)
+    for first_id in (1, 4, 7):
+        store.write_segment(_records(first_id, 3))
+    archiver = Archiver(store, table=None, segment_records=100)
+    assert archiver.compact() == 3
+    assert len(store.segments()) == 1
+    assert store.superseded() == []
+    assert _ids(store) == list(range(1, 10))
+    assert store.max_id() == 9
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from database import check_concurrent_writes, engine_options, normalize_database_url, sqlite_pragmas
+
+POSTGRES_URL = os.getenv('TEST_POSTGRES_URL')
+
+
+def _backends():
+    yield pytest.param('sqlite', id='sqlite')
+    yield pytest.param('postgresql', id='postgresql', marks=pytest.mark.skipif(
+        not POSTGRES_URL, reason="设置TEST_POSTGRES_URL后在PostgreSQL上运行"))
+
+
+@pytest.fixture(params=list(_backends()))
+def database_url(request, tmp_path):
+    if request.param == 'sqlite':
+        return f"sqlite:///{tmp_path / 'concurrency.db'}"
+    return POSTGRES_URL
+
+
+def test_concurrent_writes_do_not_fail(database_url):
+    result = check_concurrent_writes(database_url, threads=8, writes=25)
+    assert result["errors"] == 0, result["first_error"]
+    assert result["rows"] == result["writes"] == 200
+    if result["backend"] == 'sqlite':
+        assert result["journal_mode"] == 'wal'
+
+
+def test_sqlite_pragmas_do_not_change_constraint_behavior():
+    # 外键约束保持SQLite默认（关闭），已有数据中悬空的user_id不影响更新和删除
+    assert 'foreign_keys' not in sqlite_pragmas()
+
+
+def test_postgres_url_and_pool_options():
+    url = normalize_database_url('postgres://user:secret@db/app')
+    assert url == 'postgresql://user:secret@db/app'
+    options = engine_options(url)
+    assert options["pool_pre_ping"] is True
+    assert options["pool_size"] > 0
@@ -0,0 +1,23 @@
+import numpy as np
+
+from embeddings import VectorIndex, normalize_rows
+
+
+def test_removed_rows_are_compacted():
+    rng = np.random.default_rng(1)
+    vectors = normalize_rows(rng.standard_normal((1000, 16)).astype(np.float32))
+    index = VectorIndex(16, exact_threshold=100)
+    # 反复重新加入同一批记录（例如重建索引），数组不应无限增长
+    for _ in range(10):
+        index.add(list(range(1000)), vectors)
+    assert len(index) == 1000
+    assert index._size < 2000
+
+    index.remove(range(0, 1000, 2))
+    assert len(index) == 500
+    assert index._size <= 1000
+    query = vectors[501]
+    assert index.search(query, 1)[0][0] == 501
+    expected = sorted(range(1, 1000, 2), key=lambda i: -float(vectors[i] @ query))[:5]
+    index.exact_threshold = 1000
+    assert [item_id for item_id, _ in index.search(query, 5)] == expected
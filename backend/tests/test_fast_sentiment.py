@@ -0,0 +1,40 @@
+from typing import Sequence
+
+import numpy as np
+from snownlp import sentiment as snownlp_sentiment
+
+from fast_sentiment import get_sentiment_scorer
+
+CORPUS = [
+    "今天天气非常好，阳光明媚，我心情愉悦。",
+    "这个产品质量太差了，非常失望，再也不买了。",
+    "会议定于下午三点召开。",
+    "",
+    "。。。",
+    "服务态度很好，但是价格有点贵，总体来说还可以。",
+    "The quality is great and I love it!",
+    "垃圾垃圾垃圾垃圾垃圾垃圾垃圾垃圾垃圾垃圾垃圾垃圾垃圾垃圾",
+    "物流很快，包装完好，客服回复及时，五星好评。",
+    "等了两个小时还没上菜，服务员态度冷漠，环境嘈杂。",
+]
+
+
+def verify_against_snownlp(texts: Sequence[str], tolerance: float = 1e-9) -> float:
+    """与SnowNLP逐条打分结果（即SnowNLP(text).sentiments）对比，返回最大误差，超出容差时断言失败"""
+    expected = np.array([snownlp_sentiment.classify(text) for text in texts])
+    actual = get_sentiment_scorer().score_texts(texts)
+    max_diff = float(np.max(np.abs(expected - actual))) if len(texts) else 0.0
+    assert max_diff <= tolerance, f"与SnowNLP结果不一致，最大误差{max_diff}"
+    return max_diff
+
+
+def test_matches_snownlp_on_fixed_corpus():
+    verify_against_snownlp(CORPUS)
+
+
+def test_batch_equals_single_text_scores():
+    scorer = get_sentiment_scorer()
+    batch = scorer.score_texts(CORPUS)
+    single = np.array([scorer.score(text) for text in CORPUS])
+    assert np.max(np.abs(batch - single)) <= 1e-12
+
@@ -0,0 +1,48 @@
+from fast_sentiment import get_sentiment_scorer
+from incremental import IncrementalAnalyzer
+
+VERSIONS = [
+    "今天天气非常好，阳光明媚。我们去公园散步。公园里的花开得非常漂亮。",
+    "今天天气非常好，阳光明媚。我们去公园散步，还带了午饭。公园里的花开得非常漂亮。",
+    "今天天气非常好，阳光明媚。我们去公园散步，还带了午饭。公园里的花开得非常漂亮！大家都很开心。",
+]
+
+
+def test_results_match_full_computation_across_versions():
+    analyzer = IncrementalAnalyzer()
+    scorer = get_sentiment_scorer()
+    for text in VERSIONS:
+        assert abs(analyzer.sentiment_score(1, text) - scorer.score(text)) <= 1e-12
+
+
+def test_state_kept_only_after_second_submission():
+    analyzer = IncrementalAnalyzer()
+    analyzer.sentiment_score(1, VERSIONS[0])
+    assert analyzer.stats()["documents"] == 0
+    assert analyzer.stats()["memory_bytes"] == 0
+
+    analyzer.sentiment_score(1, VERSIONS[1])
+    assert analyzer.stats()["documents"] == 1
+    assert analyzer.stats()["memory_bytes"] > 0
+
+    computed = analyzer.sentences_computed
+    analyzer.sentiment_score(1, VERSIONS[2])
+    # 第三版只重新计算修改和新增的句子
+    assert analyzer.sentences_computed - computed == 2
+
+
+def test_memory_limit_evicts_least_recently_used_users():
+    analyzer = IncrementalAnalyzer(max_memory_mb=0.01)
+    for user_id in range(20):
+        for text in VERSIONS[:2]:
+            analyzer.keywords(user_id, text * 5)
+    stats = analyzer.stats()
+    assert 0 < stats["documents"] < 20
+    assert stats["memory_bytes"] <= stats["max_memory_bytes"]
+
+
+def test_disabled_keeps_no_state():
+    analyzer = IncrementalAnalyzer(enabled=False)
+    for text in VERSIONS:
+        analyzer.sentiment_score(1, text)
+    assert analyzer.stats()["documents"] == 0
@@ -0,0 +1,109 @@
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_service as llm_service_module
+from admission import requester
+from config import Config
+from enhanced_analyzer import EnhancedTextAnalyzer
+
+TEXTS = ["今天天气很好，心情愉快", "这个产品质量太差了", "会议下午三点开始"]
+
+
+def _item(prompt: str) -> dict:
+    if '关键词' in prompt:
+        return {"keywords": [{"word": "测试", "weight": 0.9}], "reasoning": "测试"}
+    if '摘要' in prompt:
+        return {"summary": "测试摘要", "length": 4}
+    return {"sentiment": "积极", "score": 0.8, "confidence": "高", "reasoning": "测试"}
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    prompts = []
+
+    def _reply(self, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply({"version": "0.0.0", "models": []})
+
+    def do_POST(self):
+        prompt = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['prompt']
+        self.prompts.append(prompt)
+        numbered = re.findall(r'^\[(\d+)\] ', prompt, re.M)
+        if 'JSON数组' in prompt:
+            content = [dict(_item(prompt), id=int(number)) for number in numbered]
+        else:
+            content = _item(prompt)
+        self._reply({"response": json.dumps(content, ensure_ascii=False), "prompt_eval_count": 10})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def analyzer(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeOllama.prompts = []
+    monkeypatch.setattr(Config, 'LLM_PROVIDER', 'ollama')
+    monkeypatch.setattr(Config, 'OLLAMA_BASE_URL', f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(Config, 'LLM_MICRO_BATCH_ENABLED', True)
+    # 较长的收集窗口保证并发请求进入同一批次
+    monkeypatch.setattr(Config, 'LLM_MICRO_BATCH_WINDOW_MS', 300)
+    monkeypatch.setattr(Config, 'LLM_ADMISSION_CONCURRENCY', 2)
+    yield EnhancedTextAnalyzer()
+    server.shutdown()
+
+
+def _comprehensive(analyzer):
+    with ThreadPoolExecutor(max_workers=len(TEXTS)) as pool:
+        return list(pool.map(lambda text: analyzer.llm_analysis(text, 'comprehensive'), TEXTS))
+
+
+def _assert_valid(results):
+    for result in results:
+        assert 'error' not in result
+        assert result["sentiment"]["sentiment"] == "积极"
+        assert result["keywords"]["keywords"][0]["word"] == "测试"
+        assert 'error' not in result["summary"]
+
+
+def test_concurrent_comprehensive_calls_without_top_k(analyzer):
+    _assert_valid(_comprehensive(analyzer))
+    batched = [prompt for prompt in FakeOllama.prompts if 'JSON数组' in prompt]
+    # 省略top_k的关键词请求按默认值批量处理
+    assert any('最重要的10个关键词' in prompt for prompt in batched)
+
+
+def test_batch_failure_falls_back_to_single_requests(analyzer, monkeypatch):
+    def broken(*args, **kwargs):
+        raise KeyError('top_k')
+    monkeypatch.setattr(llm_service_module, 'build_batch_prompt', broken)
+    _assert_valid(_comprehensive(analyzer))
+    assert not any('JSON数组' in prompt for prompt in FakeOllama.prompts)
+
+
+def test_admission_counts_llm_calls_not_waiting_requests(analyzer):
+    texts = [f"第{i}条评论，服务很好" for i in range(8)] * 2
+
+    def call(args):
+        user, text = args
+        with requester(user):
+            return analyzer.sentiment_analysis(text, use_llm=True)
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        results = list(pool.map(call, enumerate(texts)))
+    assert all(result["sentiment"] == "积极" for result in results)
+    # 重复文本合并执行，8条不同文本合并为一批：准入名额少于批次大小也只调用一次LLM
+    assert len(FakeOllama.prompts) == 1
+    assert analyzer.llm_service.admission.stats()["admitted"] == 1
@@ -0,0 +1,44 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from enhanced_analyzer import EnhancedTextAnalyzer
+from pipeline import AnalysisPipeline
+
+TEXT = "今天天气非常好，阳光明媚，我们去公园散步。公园里的花开得非常漂亮。"
+
+
+def test_llm_stages_do_not_starve_traditional_stages():
+    analyzer = EnhancedTextAnalyzer()
+    analyzer.use_llm = True
+    release = threading.Event()
+
+    def slow_llm(text, analysis_type, **kwargs):
+        release.wait(10)
+        return {"sentiment": "积极", "score": 0.9}
+    analyzer.llm_service.analyze_text = slow_llm
+
+    executor, llm_executor = ThreadPoolExecutor(2), ThreadPoolExecutor(2)
+    pipeline = AnalysisPipeline(analyzer, executor, llm_executor)
+    with ThreadPoolExecutor(4) as callers:
+        # 占满LLM线程池的流水线
+        blocked = [callers.submit(pipeline.run, TEXT, ['llm_sentiment']) for _ in range(3)]
+        time.sleep(0.1)
+        started = time.perf_counter()
+        result = pipeline.run(TEXT, ['sentiment', 'keywords', 'statistics'])
+        elapsed = time.perf_counter() - started
+        release.set()
+        assert all(future.result()["llm"]["sentiment"]["sentiment"] == "积极" for future in blocked)
+    assert elapsed < 5
+    assert 'error' not in result["sentiment"]
+    assert result["keywords"]["tfidf_keywords"]
+    executor.shutdown()
+    llm_executor.shutdown()
+
+
+def test_statistics_match_standalone_analysis_for_alphanumeric_text():
+    analyzer = EnhancedTextAnalyzer()
+    text = "Hello world, 机器学习 is great 123abc。今天发布了版本v2。"
+    with ThreadPoolExecutor(2) as executor:
+        result = AnalysisPipeline(analyzer, executor).run(text, ['statistics', 'textrank'])
+    assert result["statistics"] == analyzer._calculate_text_stats(text)
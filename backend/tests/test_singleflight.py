@@ -0,0 +1,45 @@
+import asyncio
+
+from singleflight import AsyncSingleFlight
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    async def scenario():
+        flight, runs = AsyncSingleFlight(), []
+
+        async def compute():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            return {"score": 0.9}
+
+        leader = asyncio.ensure_future(flight.do('key', compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do('key', compute))
+        await asyncio.sleep(0.01)
+        # 第一个请求的客户端断开
+        leader.cancel()
+        assert await waiter == {"score": 0.9}
+        assert leader.cancelled()
+        assert runs == [1]
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_computation_cancelled_when_all_waiters_leave():
+    async def scenario():
+        flight, finished = AsyncSingleFlight(), []
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            finished.append(1)
+
+        callers = [asyncio.ensure_future(flight.do('key', compute)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.sleep(0.1)
+        assert finished == []
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import jieba.analyse
+import jieba.posseg
+
+from segmentation import textrank_from_pairs
+from textrank import SparseTextRank
+
+SAMPLES = [
+    "今天天气很好。我们去公园散步！你觉得呢？",
+    "今天天气非常好，阳光明媚，我们去公园散步。公园里的花开得非常漂亮，孩子们在草地上奔跑，大家都很开心。",
+    "自然语言处理是人工智能领域的重要方向，它研究计算机如何理解和生成人类语言。"
+    "文本分析系统可以提取关键词、生成摘要、判断情感倾向，广泛应用于舆情监测和客户服务。",
+    "这个产品质量太差了，客服态度也不好，退货流程非常麻烦，再也不会购买这个品牌的产品了。",
+    "会议定于下午三点召开。",
+    "",
+]
+
+
+def _pairs(text):
+    return [(pair.word, pair.flag) for pair in jieba.posseg.dt.cut(text)]
+
+
+def _jieba_ranking(text):
+    # 单独的实例：textrank()会修改实例的pos_filt，不影响全局的default_textrank
+    return jieba.analyse.TextRank().textrank(text, topK=None, withWeight=True)
+
+
+def test_ranking_matches_jieba_textrank_exactly():
+    for text in SAMPLES + ["".join(SAMPLES) * 20]:
+        expected = _jieba_ranking(text)
+        actual = SparseTextRank.from_jieba().extract(_pairs(text), None)
+        assert [word for word, _ in actual] == [word for word, _ in expected], text[:20]
+        assert all(abs(weight - reference) < 1e-12 for (_, weight), (_, reference) in zip(actual, expected))
+
+
+def test_order_on_fixed_text():
+    ranking = SparseTextRank.from_jieba().extract(_pairs(SAMPLES[0]), None)
+    assert [word for word, _ in ranking] == ['觉得', '散步', '公园']
+    assert [round(weight, 4) for _, weight in ranking] == [1.0, 0.9967, 0.993]
+
+
+def test_full_ranking_is_shared_by_top_k():
+    pairs = _pairs(SAMPLES[1])
+    ranking = textrank_from_pairs(pairs, None)
+    assert textrank_from_pairs(pairs, 3) == ranking[:3]
@@ -0,0 +1,24 @@
+from token_ids import DocumentCache, Vocabulary, cosine_similarity
+
+
+def test_vocabulary_is_bounded_by_generations():
+    cache = DocumentCache(Vocabulary(), capacity=100, max_vocabulary=20)
+    for i in range(50):
+        cache.get(f"第{i}段文本包含词语{i * 7}和数字{i * 13}")
+    stats = cache.stats()
+    assert stats["generation"] > 0
+    # 上限是软上限：超出后的下一次查询换代，一次查询最多多出该批文本的新词
+    assert stats["vocabulary_size"] < 20 + 10
+
+
+def test_similarity_is_stable_across_rotation():
+    text1 = "今天天气很好，我们去公园散步"
+    text2 = "今天天气不错，我们去公园跑步"
+    reference = cosine_similarity(*DocumentCache(Vocabulary()).get_many([text1, text2]))
+
+    cache = DocumentCache(Vocabulary(), max_vocabulary=5)
+    cache.get(text1)
+    # text1命中旧一代的缓存，text2触发换代，两者必须按同一个词表编码
+    doc1, doc2 = cache.get_many([text1, "完全不同的一段新文本内容", text2])[0::2]
+    assert cache.generation >= 1
+    assert abs(cosine_similarity(doc1, doc2) - reference) < 1e-12
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于SciPy稀疏矩阵的TextRank关键词提取
+候选词过滤、共现窗口、阻尼系数、迭代方式和权重归一化与 jieba.analyse.TextRank 相同，
+但共现图是一次构建的稀疏矩阵，每轮迭代是一次稀疏三角求解，不再逐节点循环。
+输入是已有的词性标注结果，同一个图的完整排序可以按不同的topK同时用于关键词和主题。
+"""
+
+from typing import AbstractSet, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import jieba.analyse
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve_triangular
+
+DEFAULT_ALLOW_POS = ('ns', 'n', 'vn', 'v')
+
+
+class TextRankGraph(NamedTuple):
+    """共现图：words[i]是第i个节点，matrix为对称的边权矩阵"""
+    words: List[str]
+    matrix: sparse.csr_matrix
+
+
+class SparseTextRank:
+    """TextRank引擎，stop_words和span通常取自jieba的TextRank实例（租户词典有自己的停用词）"""
+
+    def __init__(self, stop_words: Optional[AbstractSet[str]] = None, allow_pos: Iterable[str] = DEFAULT_ALLOW_POS,
+                 span: int = 5, damping: float = 0.85, iterations: int = 10):
+        self.stop_words = stop_words if stop_words is not None else jieba.analyse.default_textrank.stop_words
+        self.allow_pos = frozenset(allow_pos)
+        self.span = span
+        self.damping = damping
+        self.iterations = iterations
+
+    @classmethod
+    def from_jieba(cls, textrank: Optional[jieba.analyse.TextRank] = None, **options) -> 'SparseTextRank':
+        textrank = textrank or jieba.analyse.default_textrank
+        return cls(stop_words=textrank.stop_words, span=textrank.span, **options)
+
+    def _keep(self, word: str, flag: str) -> bool:
+        return flag in self.allow_pos and len(word.strip()) >= 2 and word.lower() not in self.stop_words
+
+    def build_graph(self, pairs: Sequence) -> TextRankGraph:
+        """pairs为(词, 词性)序列；窗口内两个候选词各共现一次边权加1，与jieba一样没有共现的候选词不进入图"""
+        vocab = {}
+        node_at = np.full(len(pairs), -1, dtype=np.int64)
+        for position, (word, flag) in enumerate(pairs):
+            if self._keep(word, flag):
+                node_at[position] = vocab.setdefault(word, len(vocab))
+        positions = np.flatnonzero(node_at >= 0)
+
+        sources, targets = [], []
+        for offset in range(1, self.span):
+            ahead = positions[positions + offset < len(pairs)]
+            ahead = ahead[node_at[ahead + offset] >= 0]
+            sources.append(ahead)
+            targets.append(ahead + offset)
+        if not positions.size or not sum(len(s) for s in sources):
+            return TextRankGraph([], sparse.csr_matrix((0, 0)))
+        sources, targets = np.concatenate(sources), np.concatenate(targets)
+        # 按jieba遍历共现词对的顺序排列边，节点按首次出现的顺序编号，排序时同分的词与jieba顺序一致
+        order = np.lexsort((targets, sources))
+        sequence = np.column_stack((node_at[sources[order]], node_at[targets[order]])).ravel()
+        nodes, first = np.unique(sequence, return_index=True)
+        nodes = nodes[np.argsort(first)]
+        remap = np.full(len(vocab), -1, dtype=np.int64)
+        remap[nodes] = np.arange(len(nodes))
+
+        rows, cols = remap[node_at[sources]], remap[node_at[targets]]
+        counts = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(nodes), len(nodes))).tocsr()
+        words = list(vocab)
+        return TextRankGraph([words[node] for node in nodes], (counts + counts.T).tocsr())
+
+    def rank_graph(self, graph: TextRankGraph) -> List[Tuple[str, float]]:
+        """完整的(词, 权重)排序，权重按jieba的方式归一化
+        与jieba一样固定迭代iterations轮，每轮按词的字典序逐个原地更新（Gauss-Seidel）：
+        排在前面的词用本轮已更新的分数，其余（包括自身）用上一轮的分数。
+        把转移矩阵按字典序拆成严格下三角L和其余部分U，一轮更新即求解 (I - dL)x' = (1 - d) + dUx"""
+        count = len(graph.words)
+        if not count:
+            return []
+        order = sorted(range(count), key=graph.words.__getitem__)
+        matrix = graph.matrix[order][:, order]
+        out_sum = np.asarray(matrix.sum(axis=1)).ravel()
+        transition = sparse.csr_matrix(matrix.multiply(1.0 / out_sum[np.newaxis, :]))
+        lower = sparse.identity(count, format='csr') - self.damping * sparse.tril(transition, k=-1, format='csr')
+        upper = self.damping * sparse.triu(transition, k=0, format='csr')
+        scores = np.full(count, 1.0 / count)
+        for _ in range(self.iterations):
+            scores = spsolve_triangular(lower, (1 - self.damping) + upper @ scores, lower=True, unit_diagonal=True)
+        ranked = np.empty(count)
+        ranked[order] = scores
+        low, high = ranked.min(), ranked.max()
+        weights = (ranked - low / 10.0) / (high - low / 10.0)
+        positions = np.argsort(-weights, kind='stable')
+        return [(graph.words[i], float(weights[i])) for i in positions]
+
+    def rank(self, pairs: Sequence) -> List[Tuple[str, float]]:
+        return self.rank_graph(self.build_graph(pairs))
+
+    def extract(self, pairs: Sequence, top_k: Optional[int] = 20) -> List[Tuple[str, float]]:
+        """与 textrank.textrank(withWeight=True, topK=top_k) 对应，top_k为空时返回全部"""
+        ranking = self.rank(pairs)
+        return ranking[:top_k] if top_k else ranking
+
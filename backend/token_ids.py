@@ -0,0 +1,163 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from config import Config
+from segmentation import get_segmenter, normalize_tokens
+
+
+class Vocabulary:
+    """词表：把词映射为整数ID，同一个词在所有文档中只保存一份字符串
+    词表只增不减，DocumentCache在词数超过上限时换用新词表，旧词表随缓存的文档一起释放"""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._words: List[str] = []
+        self._lock = threading.Lock()
+
+    def intern(self, tokens: Iterable[str]) -> np.ndarray:
+        """把词序列转换为ID数组，新词追加到词表末尾"""
+        ids = self._ids
+        tokens = list(tokens)
+        missing = [token for token in tokens if token not in ids]
+        if missing:
+            with self._lock:
+                for token in missing:
+                    if token not in ids:
+                        ids[token] = len(self._words)
+                        self._words.append(token)
+        return np.fromiter((ids[token] for token in tokens), dtype=np.int32, count=len(tokens))
+
+    def lookup(self, ids: Iterable[int]) -> List[str]:
+        return [self._words[i] for i in ids]
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+
+class DocumentRepr:
+    """文档的紧凑表示：词ID序列，以及按ID排序的去重词ID和对应词频"""
+
+    __slots__ = ('ids', 'terms', 'counts', 'norm')
+
+    def __init__(self, ids: np.ndarray):
+        self.ids = ids
+        self.terms, counts = np.unique(ids, return_counts=True)
+        self.counts = counts.astype(np.int32)
+        self.norm = float(np.sqrt(np.dot(counts, counts)))
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.terms.nbytes + self.counts.nbytes
+
+
+def cosine_similarity(a: DocumentRepr, b: DocumentRepr) -> float:
+    """词频向量的余弦相似度，任一文档为空时返回0"""
+    if a.norm == 0 or b.norm == 0:
+        return 0.0
+    _, index_a, index_b = np.intersect1d(a.terms, b.terms, assume_unique=True, return_indices=True)
+    dot = np.dot(a.counts[index_a].astype(np.int64), b.counts[index_b].astype(np.int64))
+    return float(dot) / (a.norm * b.norm)
+
+
+def jaccard_similarity(a: DocumentRepr, b: DocumentRepr) -> float:
+    """去重词集合的Jaccard相似度"""
+    union = len(a.terms) + len(b.terms)
+    if union == 0:
+        return 0.0
+    overlap = len(np.intersect1d(a.terms, b.terms, assume_unique=True))
+    return overlap / (union - overlap)
+
+
+class DocumentCache:
+    """按文本哈希缓存文档表示，最近最少使用的文档在超出容量时被淘汰
+    缓存的文档和词表属于同一代：词表超过max_vocabulary个词时清空缓存并换用新词表，内存不会随出现过的词无限增长"""
+
+    def __init__(self, vocabulary: Vocabulary, capacity: int = 10000, max_vocabulary: int = 500000):
+        self.vocabulary = vocabulary
+        self.capacity = capacity
+        self.max_vocabulary = max_vocabulary
+        self.generation = 0
+        self._entries: "OrderedDict[str, DocumentRepr]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _rotate(self) -> None:
+        """开始新的一代，调用方需持有_lock"""
+        self.vocabulary = Vocabulary()
+        self._entries.clear()
+        self.generation += 1
+
+    @staticmethod
+    def _key(text: str, tenant: Optional[str]) -> str:
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return f"{tenant}:{digest}" if tenant is not None else digest
+
+    def get_many(self, texts: Sequence[str], tenant: Optional[str] = None) -> List[DocumentRepr]:
+        """返回各文本的文档表示，未缓存的文本一次批量分词"""
+        keys = [self._key(text, tenant) for text in texts]
+        results: List[Optional[DocumentRepr]] = [None] * len(texts)
+        with self._lock:
+            vocabulary = self.vocabulary
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    results[i] = entry
+            missing = [i for i, entry in enumerate(results) if entry is None]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            token_lists = get_segmenter().segment_many([texts[i] for i in missing], tenant=tenant)
+            with self._lock:
+                if len(self.vocabulary) >= self.max_vocabulary:
+                    self._rotate()
+                if self.vocabulary is not vocabulary:
+                    # 分词期间词表已换代，已命中的文档按新词表重新编码，同一批结果的ID才可比较
+                    for i, entry in enumerate(results):
+                        if entry is not None:
+                            results[i] = DocumentRepr(self.vocabulary.intern(vocabulary.lookup(entry.ids)))
+                for i, tokens in zip(missing, token_lists):
+                    entry = DocumentRepr(self.vocabulary.intern(normalize_tokens(tokens)))
+                    results[i] = entry
+                    self._entries[keys[i]] = entry
+                    self._entries.move_to_end(keys[i])
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return results
+
+    def get(self, text: str, tenant: Optional[str] = None) -> DocumentRepr:
+        return self.get_many([text], tenant)[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": len(self._entries),
+                "capacity": self.capacity,
+                "document_bytes": sum(entry.nbytes for entry in self._entries.values()),
+                "vocabulary_size": len(self.vocabulary),
+                "vocabulary_limit": self.max_vocabulary,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+_cache: Optional[DocumentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_document_cache() -> DocumentCache:
+    """进程内共享的词表和文档表示缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = Config()
+                _cache = DocumentCache(Vocabulary(), capacity=config.TOKEN_CACHE_SIZE,
+                                       max_vocabulary=config.TOKEN_VOCABULARY_MAX)
+    return _cache
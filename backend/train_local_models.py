@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模型训练脚本
+从已保存的分析记录（包括已归档的记录）中取出文本和情感结果，训练 LLM_PROVIDER=local 使用的
+情感模型（TF-IDF + 逻辑回归），并在全部文本上拟合关键词模型的TF-IDF。
+默认优先使用LLM给出的情感标签，没有LLM结果的记录使用传统方法的结果。
+
+示例：
+    python train_local_models.py
+    python train_local_models.py --labels llm --output ./models --min-samples 200
+"""
+
+import argparse
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from sqlalchemy import select
+
+from config import Config
+from history_export import parse_result
+from local_models import SENTIMENT_LABELS, keyword_tokenize, save_models, tokenize
+
+# 这些分析记录的text不是原文（例如相似度记录拼接了两段文本的开头）
+SKIPPED_TYPES = frozenset({'similarity'})
+
+
+def _label_of(candidate: Any, llm: bool) -> Optional[str]:
+    if not isinstance(candidate, dict):
+        return None
+    # LLM路由失败时会回退到传统方法；本地模型自己的结果也不能再用来训练它
+    if llm and candidate.get('method') in ('traditional', 'local'):
+        return None
+    label = candidate.get('sentiment')
+    return label if isinstance(label, str) and label in SENTIMENT_LABELS else None
+
+
+def sentiment_label(analysis_type: str, result: Any, source: str = 'any') -> Optional[str]:
+    """取出记录的情感标签：先找LLM结果，source为any时再找传统方法的结果"""
+    if not isinstance(result, dict):
+        return None
+    nested = {key: result[key].get('sentiment') for key in ('llm', 'traditional') if isinstance(result.get(key), dict)}
+    # 记录本身的结果：llm_开头的分析类型来自LLM，其余来自传统方法
+    own = [result, result.get('sentiment')]
+    if analysis_type.startswith('llm_'):
+        llm_candidates = [nested.get('llm')] + own
+        traditional_candidates = [nested.get('traditional')]
+    else:
+        llm_candidates = [nested.get('llm')]
+        traditional_candidates = [nested.get('traditional')] + own
+    for candidate in llm_candidates:
+        label = _label_of(candidate, llm=True)
+        if label:
+            return label
+    if source == 'any':
+        for candidate in traditional_candidates:
+            label = _label_of(candidate, llm=False)
+            if label:
+                return label
+    return None
+
+
+def iter_history(include_archived: bool = True) -> Iterator[Tuple[str, str, str]]:
+    """按ID顺序遍历(文本, 分析类型, 结果)，先归档记录后热表记录"""
+    from app import app, db, Analysis, archiver
+    with app.app_context():
+        last_archived_id = 0
+        if include_archived and archiver:
+            for record in archiver.store.iter_records():
+                last_archived_id = record.id
+                yield record.text, record.analysis_type, record.result
+        # 已归档但还没从热表删除的行不重复读取
+        query = select(Analysis.text, Analysis.analysis_type, Analysis.result) \
+            .where(Analysis.id > last_archived_id).order_by(Analysis.id)
+        for row in db.session.execute(query.execution_options(yield_per=1000)):
+            yield row.text, row.analysis_type, row.result
+
+
+def collect(records, source: str) -> Tuple[Dict[str, str], Dict[str, None]]:
+    """返回(文本 -> 情感标签, 全部文本)；同一文本有多条记录时以最新一条为准"""
+    labels: Dict[str, str] = {}
+    texts: Dict[str, None] = {}
+    for text, analysis_type, result in records:
+        if not text or analysis_type in SKIPPED_TYPES:
+            continue
+        texts[text] = None
+        label = sentiment_label(analysis_type, parse_result(result) if isinstance(result, str) else result, source)
+        if label:
+            labels[text] = label
+    return labels, texts
+
+
+def build_sentiment_pipeline(max_iter: int = 1000) -> Pipeline:
+    return Pipeline([
+        ('tfidf', TfidfVectorizer(tokenizer=tokenize, token_pattern=None, lowercase=False,
+                                  ngram_range=(1, 2), sublinear_tf=True)),
+        ('clf', LogisticRegression(max_iter=max_iter, class_weight='balanced'))
+    ])
+
+
+def build_keywords_pipeline() -> Pipeline:
+    return Pipeline([
+        ('tfidf', TfidfVectorizer(tokenizer=keyword_tokenize, token_pattern=None, lowercase=False, norm=None))
+    ])
+
+
+def train(output: str, source: str = 'any', min_samples: int = 50, test_size: float = 0.2,
+          include_archived: bool = True) -> bool:
+    started = time.perf_counter()
+    labels, texts = collect(iter_history(include_archived), source)
+    print(f"📚 读取到 {len(texts)} 段不重复文本，其中 {len(labels)} 段有情感标签：{dict(Counter(labels.values()))}")
+
+    metadata: Dict[str, Any] = {"trained_at": time.strftime("%Y-%m-%d %H:%M:%S"), "label_source": source}
+    sentiment = None
+    label_counts = Counter(labels.values())
+    if len(labels) < min_samples or len(label_counts) < 2:
+        print(f"⚠️ 情感标签不足（至少需要 {min_samples} 条且包含两种以上情感），跳过情感模型")
+    else:
+        samples, targets = list(labels), list(labels.values())
+        # 每类至少两条时按类别分层抽取验证集
+        stratify = targets if min(label_counts.values()) >= 2 else None
+        train_x, test_x, train_y, test_y = train_test_split(samples, targets, test_size=test_size,
+                                                            random_state=0, stratify=stratify)
+        evaluation = build_sentiment_pipeline().fit(train_x, train_y)
+        predicted = evaluation.predict(test_x)
+        accuracy = accuracy_score(test_y, predicted)
+        macro_f1 = f1_score(test_y, predicted, average='macro')
+        print(f"🧪 验证集 {len(test_x)} 条：准确率 {accuracy:.3f}，macro-F1 {macro_f1:.3f}")
+        # 评估后用全部标签重新训练
+        sentiment = build_sentiment_pipeline().fit(samples, targets)
+        metadata["sentiment"] = {
+            "samples": len(samples),
+            "labels": dict(label_counts),
+            "validation_accuracy": round(accuracy, 4),
+            "validation_macro_f1": round(macro_f1, 4)
+        }
+
+    keywords = None
+    if texts:
+        keywords = build_keywords_pipeline().fit(list(texts))
+        metadata["keywords"] = {
+            "documents": len(texts),
+            "vocabulary": len(keywords.named_steps['tfidf'].vocabulary_)
+        }
+    else:
+        print("⚠️ 没有可用的文本，跳过关键词模型")
+
+    if sentiment is None and keywords is None:
+        return False
+    save_models(output, sentiment, keywords, metadata)
+    print(f"💾 模型已保存到 {output}，用时 {time.perf_counter() - started:.1f} 秒（重启服务后生效）")
+    return True
+
+
+def main() -> int:
+    config = Config()
+    parser = argparse.ArgumentParser(description='用历史分析记录训练本地模型（LLM_PROVIDER=local）')
+    parser.add_argument('--output', default=config.LOCAL_MODEL_PATH, help='模型目录')
+    parser.add_argument('--labels', choices=('any', 'llm'), default='any',
+                        help='情感标签来源：llm只使用LLM结果，any在没有LLM结果时使用传统方法的结果')
+    parser.add_argument('--min-samples', type=int, default=50, help='训练情感模型所需的最少标签数')
+    parser.add_argument('--test-size', type=float, default=0.2, help='验证集比例')
+    parser.add_argument('--no-archive', action='store_true', help='不读取已归档的记录')
+    args = parser.parse_args()
+
+    print("🚀 开始训练本地模型...")
+    ok = train(args.output, args.labels, args.min_samples, args.test_size, not args.no_archive)
+    print("🎉 训练完成！" if ok else "💥 训练失败！")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())